@@ -0,0 +1,45 @@
+"""
+Benchmark for the per query overhead of the data collector, as the number of queries in a profiled block grows.
+
+It is run for two cases: every query having a different sql, so that the number of query signatures grows with the
+number of queries, and every query having the same sql (like for N+1 queries), so that all of them update the
+statistics of one query signature - with its latency histogram and its heap of the slowest executions.
+
+The statistics of a query signature are updated in place, hence for the same sql the per query overhead stays flat.
+For different sql it goes up once there are more sql strings than the caches of the sql parsing functions keep
+(SQL_CACHE_MAX_SIZE), since every query then misses these caches - and with the memory held for every new signature
+"""
+from benchmarks.utils import setup_django, time_in_micros
+
+setup_django()
+
+from django_query_profiler.query_profiler_storage import QueryProfilerLevel  # noqa: E402
+from django_query_profiler.query_profiler_storage.data_collector import data_collector_storage  # noqa: E402
+
+QUERY_COUNTS = (100, 1000, 10000, 50000)
+
+
+def profile_queries(query_count: int, is_same_sql: bool) -> None:
+    data_collector_storage.enter_profiler_mode(QueryProfilerLevel.QUERY)
+    for index in range(query_count):
+        data_collector_storage.add_query_profiler_data(
+            query_without_params='SELECT * FROM table WHERE id=%s' if is_same_sql
+            else f'SELECT * FROM table_{index} WHERE id=%s',
+            params=(index,),
+            target_db='default',
+            query_execution_time_in_micros=index % 997,
+            db_row_count=1)
+    data_collector_storage.exit_profiler_mode()
+
+
+def main() -> None:
+    for is_same_sql in (False, True):
+        print('Same sql for every query' if is_same_sql else 'Different sql for every query')
+        print(f'{"queries":>10} {"total (ms)":>12} {"per query (μs)":>16}')
+        for query_count in QUERY_COUNTS:
+            total_time_in_micros = time_in_micros(lambda: profile_queries(query_count, is_same_sql), repeat=3)
+            print(f'{query_count:>10} {total_time_in_micros / 1000:>12.1f} {total_time_in_micros / query_count:>16.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Benchmark for the key used to find exact duplicate queries, against the key that was used before - the mmh3 hash of
+the repr of (sql, params, db).  The old approach needs mmh3, which is no longer a dependency of the profiler:
+
+    pip install mmh3
+    python -m benchmarks.benchmark_duplicate_hash
+"""
+from binascii import hexlify
+from datetime import datetime
+
+import mmh3
+
+from benchmarks.utils import setup_django, time_in_micros
+
+setup_django()
+
+from django_query_profiler.query_profiler_storage.data_collector import query_params_db_hash  # noqa: E402
+
+ITERATIONS = 1000
+QUERIES = {
+    'one param': ('SELECT * FROM pizza WHERE id=%s', [1]),
+    'few params': ('SELECT * FROM pizza WHERE name=%s AND created>%s AND id<%s', ['margherita', datetime.now(), 10]),
+    'IN with 1,000 params': ('SELECT * FROM pizza WHERE id IN (%s)', list(range(1000))),
+    'executemany with 1,000 rows': ('INSERT INTO pizza (id, name) VALUES (%s, %s)',
+                                    [(index, f'pizza-{index}') for index in range(1000)]),
+}
+
+
+def legacy_query_params_db_hash(query_without_params, params, target_db) -> bytes:
+    query_params_db_key = (query_without_params, params or '', target_db)
+    return hexlify(mmh3.hash_bytes(str(query_params_db_key)))
+
+
+def main() -> None:
+    print(f'{"query":>30} {"legacy (μs)":>14} {"current (μs)":>14}')
+    for name, (query_without_params, params) in QUERIES.items():
+        legacy_time_in_micros, current_time_in_micros = (
+            time_in_micros(lambda: [hash_func(query_without_params, params, 'default') for _ in range(ITERATIONS)])
+            for hash_func in (legacy_query_params_db_hash, query_params_db_hash))
+        print(f'{name:>30} {legacy_time_in_micros / ITERATIONS:>14.2f} {current_time_in_micros / ITERATIONS:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Benchmark for classifying module names against a large DJANGO_QUERY_PROFILER_APP_MODULES_TO_EXCLUDE, with the
+ModulePrefixTrie against checking str.startswith with every prefix:
+
+    python -m benchmarks.benchmark_module_prefix_trie
+"""
+import sys
+from typing import Tuple
+
+from benchmarks.utils import time_in_micros
+from django_query_profiler.query_profiler_storage.stack_tracer import ModulePrefixTrie
+
+ITERATIONS = 20
+
+
+def linear_matches(prefixes: Tuple[str, ...], module_name: str) -> bool:
+    return any(module_name.startswith(prefix) for prefix in prefixes)
+
+
+def main() -> None:
+    module_names = tuple(sorted(sys.modules)) + ('myapp.views', 'myapp.models.user', 'myapp.services.billing.invoice')
+    print(f'{len(module_names)} module names')
+    print(f'{"prefixes":>9} {"startswith (μs)":>16} {"trie (μs)":>10}')
+    for prefix_count in (10, 100, 1000):
+        prefixes = tuple(f'vendored_package_{index}.' for index in range(prefix_count - 2)) + ('django', 'test')
+        trie = ModulePrefixTrie(prefixes)
+        assert all(trie.matches(module_name) == linear_matches(prefixes, module_name) for module_name in module_names)
+
+        linear_time_in_micros = time_in_micros(lambda: [
+            linear_matches(prefixes, module_name) for _ in range(ITERATIONS) for module_name in module_names])
+        trie_time_in_micros = time_in_micros(lambda: [
+            trie.matches(module_name) for _ in range(ITERATIONS) for module_name in module_names])
+        print(f'{prefix_count:>9} {linear_time_in_micros / ITERATIONS:>16.2f} '
+              f'{trie_time_in_micros / ITERATIONS:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark for parsing the sql of a query signature for its tables & the column of its where equality clause, over a
+corpus of the sql that the ORM generates for the test app, against the moz-sql-parser based parser used before.  It
+reports the time, the queries that each parser fails on, and the queries where their results differ:
+
+    python -m benchmarks.benchmark_sql_parser
+"""
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.utils import setup_django, time_in_micros
+
+setup_django()
+
+from django.db.models import Count, Exists, F, OuterRef, Q  # noqa: E402
+from mo_sql_parsing import parse  # noqa: E402
+
+from django_query_profiler.query_profiler_storage.django_stack_trace_analyze import (  # noqa: E402
+    _parse_sql_for_tables_and_eq
+)
+from tests.testapp.food.models import Pizza, Restaurant, Topping  # noqa: E402
+
+ITERATIONS = 20
+
+
+def legacy_parse_sql_for_tables_and_eq(query_without_params: str) -> Tuple[list, bool, str]:
+    """ The parser used before, as it was """
+    query_with_fake_params = query_without_params.replace('%s', '1')
+    parsed_sql: Dict = parse(query_with_fake_params)
+
+    # Table Names
+    table_names = []
+    from_clause = parsed_sql.get('from', None)
+    if from_clause:
+        if isinstance(from_clause, str):  # SELECT * FROM test1
+            table_names.append(from_clause)
+        elif isinstance(from_clause, list):
+            for from_clause_part in from_clause:
+                if isinstance(from_clause_part, str):  # SELECT * FROM test2, test1
+                    table_names.append(from_clause_part)
+                elif isinstance(from_clause_part, dict):
+                    if 'value' in from_clause_part:  # # SELECT A.f1, B.f1 FROM test1 as A, test1 as B
+                        table_names.append(from_clause_part['value'])
+                    elif any(key for key in from_clause_part.keys() if 'join' in key):
+                        # select a.* from a INNER JOIN b USING (id)
+                        table_names.extend(value for key, value in from_clause_part.items() if 'join' in key)
+
+    # Where clause
+    where_clause: Dict = parsed_sql.get('where', None)
+    where_equality_key = ''
+    if where_clause and len(where_clause) == 1:
+        eq_clause = where_clause.get('eq', None)
+        if eq_clause and isinstance(eq_clause, list):
+            where_equality_key = eq_clause[0]
+
+    return table_names, bool(where_clause), where_equality_key
+
+
+def orm_queries() -> List[str]:
+    """ The sql (without params) of the queries of the test app, like the ones in the N+1 patterns of a request """
+    pizza = Pizza(id=1)
+    querysets = [
+        Topping.objects.all(),
+        Topping.objects.filter(id=1),
+        Topping.objects.filter(name='jalapenos')[:21],
+        Topping.objects.filter(is_spicy=True),
+        Topping.objects.filter(is_spicy=True, name__startswith='j'),
+        Topping.objects.filter(Q(is_spicy=True) | Q(name__in=['a', 'b'])),
+        Topping.objects.exclude(name__icontains='pepper').order_by('-name'),
+        Topping.objects.filter(id__in=[1, 2, 3]),
+        Topping.objects.values('is_spicy').annotate(count=Count('id')).order_by(),
+        Topping.objects.filter(id=1).values_list('name', flat=True),
+        pizza.toppings.all(),
+        pizza.toppings.filter(is_spicy=True),
+        pizza.restaurants.all(),
+        pizza.restaurants.filter(is_active=True).order_by('name'),
+        Pizza.objects.filter(toppings__is_spicy=True).distinct(),
+        Pizza.objects.annotate(topping_count=Count('toppings')).filter(topping_count__gt=2),
+        Pizza.objects.filter(restaurants__best_pizza=F('id')),
+        Pizza.objects.filter(Exists(Restaurant.objects.filter(best_pizza=OuterRef('pk')))),
+        Pizza.objects.filter(id__in=Restaurant.objects.filter(is_active=True).values('best_pizza')),
+        Restaurant.objects.select_related('best_pizza'),
+        Restaurant.objects.select_related('best_pizza').filter(best_pizza__is_vegetarian=True),
+        Restaurant.objects.filter(best_pizza_id=1),
+        Restaurant.objects.filter(pizzas__toppings__name='jalapenos').values('name'),
+        Restaurant.objects.order_by('name').reverse()[10:20],
+        Topping.objects.union(Topping.objects.filter(is_spicy=True)),
+    ]
+    return [queryset.query.sql_with_params()[0] for queryset in querysets] + list(EXECUTED_ORM_QUERIES)
+
+
+# The queries that are built & executed in one call, like count() - as the ORM executes them
+EXECUTED_ORM_QUERIES = (
+    'SELECT 1 AS "a" FROM "toppings" WHERE "toppings"."is_spicy" LIMIT 1',
+    'SELECT COUNT(*) AS "__count" FROM "toppings" WHERE "toppings"."is_spicy"',
+    'SELECT COUNT(*) FROM (SELECT DISTINCT "pizza"."id" AS "col1", "pizza"."name" AS "col2", '
+    '"pizza"."is_vegetarian" AS "col3" FROM "pizza" INNER JOIN "restaurant_pizzas" ON '
+    '("pizza"."id" = "restaurant_pizzas"."pizza_id") INNER JOIN "restaurant" ON '
+    '("restaurant_pizzas"."restaurant_id" = "restaurant"."id") WHERE "restaurant"."is_active") subquery',
+)
+
+
+def main() -> None:
+    queries = orm_queries()
+    print(f'{len(queries)} queries')
+    print(f'{"parser":>8} {"time (μs)":>12} {"failed":>8}')
+
+    parser_to_results = {}
+    for parser_name, parser in (('legacy', legacy_parse_sql_for_tables_and_eq),
+                                ('current', _parse_sql_for_tables_and_eq)):
+        results, failed_query_count = [], 0
+        for query in queries:
+            try:
+                results.append(parser(query))
+            except Exception:
+                results.append(None)
+                failed_query_count += 1
+        parser_to_results[parser_name] = results
+        time_taken_in_micros = time_in_micros(lambda: [
+            _parse_or_none(parser, query) for _ in range(ITERATIONS) for query in queries])
+        print(f'{parser_name:>8} {time_taken_in_micros / ITERATIONS:>12.2f} {failed_query_count:>8}')
+
+    for query, legacy_result, result in zip(queries, parser_to_results['legacy'], parser_to_results['current']):
+        if legacy_result is not None and legacy_result != result:
+            print(f'\nDiffers for: {query}\n  legacy: {legacy_result}\n  current: {result}')
+
+
+def _parse_or_none(parser: Callable[[str], Tuple[list, bool, str]], query: str):
+    try:
+        return parser(query)
+    except Exception:
+        return None
+
+
+if __name__ == '__main__':
+    main()
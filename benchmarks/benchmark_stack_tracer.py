@@ -0,0 +1,97 @@
+"""
+Benchmark for finding the stack trace at the default depth of QUERY_SIGNATURE level (500 frames), against the stack
+walker that was used before - which classified every frame by its module name, in two memo dicts.  The lazy column is
+the capture done for every query when DJANGO_QUERY_PROFILER_LAZY_STACK_CAPTURE is on:
+
+    python -m benchmarks.benchmark_stack_tracer
+"""
+import inspect
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.utils import setup_django, time_in_micros
+
+setup_django()
+
+import django.db.models as django_base_model  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from django_query_profiler.query_profiler_storage import QueryProfilerLevel, StackTraceElement  # noqa: E402
+from django_query_profiler.query_profiler_storage.stack_tracer import (  # noqa: E402
+    RawStackTrace, capture_raw_stack_trace, find_stack_trace
+)
+
+ITERATIONS = 200
+MAX_DEPTH = QueryProfilerLevel.QUERY_SIGNATURE.stack_trace_depth
+LEGACY_MEMO_DJANGO_MODULE_NAME_DECISION: Dict[Tuple[str], Dict[str, bool]] = defaultdict(dict)
+LEGACY_MEMO_APP_MODULE_NAME_DECISION: Dict[Tuple[str], Dict[str, bool]] = defaultdict(dict)
+
+
+def legacy_find_stack_trace(app_module_names_to_exclude: Tuple[str], django_module_names_to_include: Tuple[str],
+                            max_depth: int) -> Tuple[Tuple[StackTraceElement], Tuple[StackTraceElement]]:
+    app_stack_trace: List[StackTraceElement] = []
+    django_stack_trace: List[StackTraceElement] = []
+    current_iteration = 0
+    current_frame = inspect.currentframe()
+    try:
+        while current_iteration < max_depth and current_frame is not None:
+            module_name = current_frame.f_globals.get('__name__', '')
+            is_django_stack_trace = LEGACY_MEMO_DJANGO_MODULE_NAME_DECISION[django_module_names_to_include].get(
+                module_name)
+            if is_django_stack_trace is None:
+                is_django_stack_trace = any(module_name.startswith(app) for app in django_module_names_to_include)
+            LEGACY_MEMO_DJANGO_MODULE_NAME_DECISION[django_module_names_to_include][module_name] = is_django_stack_trace
+
+            if is_django_stack_trace:
+                is_app_stack_trace = False
+            else:
+                is_app_stack_trace = LEGACY_MEMO_APP_MODULE_NAME_DECISION[app_module_names_to_exclude].get(module_name)
+                if is_app_stack_trace is None:
+                    is_app_stack_trace = not (any(module_name.startswith(app) for app in app_module_names_to_exclude))
+            LEGACY_MEMO_APP_MODULE_NAME_DECISION[app_module_names_to_exclude][module_name] = is_app_stack_trace
+
+            if is_app_stack_trace:
+                app_stack_trace.append(StackTraceElement.app_stacktrace_element(
+                    module_name, current_frame.f_code.co_name, current_frame.f_lineno))
+            elif is_django_stack_trace:
+                django_stack_trace.append(StackTraceElement.django_stacktrace_element(
+                    module_name, current_frame.f_code.co_name))
+            current_frame = current_frame.f_back
+            current_iteration += 1
+    finally:
+        del current_frame
+    return tuple(app_stack_trace), tuple(django_stack_trace)
+
+
+def lazy_capture_stack_trace(app_module_names_to_exclude: Tuple[str], django_module_names_to_include: Tuple[str],
+                             max_depth: int) -> RawStackTrace:
+    """ Only the capture, since a captured stack is resolved once when the profiler block exits """
+    return capture_raw_stack_trace(max_depth)
+
+
+def call_at_depth(depth: int, func: Callable[[], None]) -> None:
+    """ Calls the function with "depth" frames of this module above it - which are app frames """
+    if depth <= 0:
+        func()
+    else:
+        call_at_depth(depth - 1, func)
+
+
+def main() -> None:
+    arguments = (settings.DJANGO_QUERY_PROFILER_APP_MODULES_TO_EXCLUDE, (django_base_model.__name__,), MAX_DEPTH)
+    # The legacy function is in this module, and so it finds itself as the first app frame
+    legacy_stack_trace, stack_trace = legacy_find_stack_trace(*arguments), find_stack_trace(*arguments)
+    assert (legacy_stack_trace[0][1:], legacy_stack_trace[1]) == stack_trace
+
+    print(f'{"frames":>8} {"legacy (μs)":>14} {"current (μs)":>14} {"lazy (μs)":>14}')
+    for depth in (50, 200, MAX_DEPTH):
+        legacy_time_in_micros, current_time_in_micros, lazy_time_in_micros = (
+            time_in_micros(lambda: call_at_depth(depth, lambda: [
+                find_stack_trace_func(*arguments) for _ in range(ITERATIONS)]))
+            for find_stack_trace_func in (legacy_find_stack_trace, find_stack_trace, lazy_capture_stack_trace))
+        print(f'{depth:>8} {legacy_time_in_micros / ITERATIONS:>14.2f} {current_time_in_micros / ITERATIONS:>14.2f} '
+              f'{lazy_time_in_micros / ITERATIONS:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
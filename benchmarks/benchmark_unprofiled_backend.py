@@ -0,0 +1,59 @@
+"""
+Benchmark for the cost of the profiler's database backends when the profiler is not on, against the django backend
+they derive from.  Most of the traffic goes through these backends without being profiled, hence they should cost the
+same as the django backend then.  The cost when profiling at QUERY level is shown for comparison:
+
+    python -m benchmarks.benchmark_unprofiled_backend
+"""
+from benchmarks.utils import setup_django, time_in_micros
+
+setup_django()
+
+from django.db import connection  # noqa: E402
+from django.db.backends.sqlite3.base import DatabaseWrapper as DjangoDatabaseWrapper  # noqa: E402
+
+from django_query_profiler.client.context_manager import QueryProfiler  # noqa: E402
+from django_query_profiler.django.db.backends.sqlite3.base import DatabaseWrapper  # noqa: E402
+from django_query_profiler.query_profiler_storage import QueryProfilerLevel  # noqa: E402
+
+QUERIES = 1000
+ROWS = 100
+
+
+def _new_connection(database_wrapper_class):
+    settings_dict = dict(connection.settings_dict, NAME=':memory:')
+    database_wrapper = database_wrapper_class(settings_dict, alias='benchmark')
+    with database_wrapper.cursor() as cursor:
+        cursor.execute('CREATE TABLE pizza (id INTEGER PRIMARY KEY, name TEXT)')
+        cursor.executemany('INSERT INTO pizza (id, name) VALUES (%s, %s)',
+                           [(index, f'pizza-{index}') for index in range(ROWS)])
+    return database_wrapper
+
+
+def _run_queries(database_wrapper) -> None:
+    for index in range(QUERIES):
+        with database_wrapper.cursor() as cursor:
+            cursor.execute('SELECT id, name FROM pizza WHERE id = %s', [index % ROWS])
+            cursor.fetchall()
+
+
+def _run_queries_profiled(database_wrapper) -> None:
+    with QueryProfiler(QueryProfilerLevel.QUERY):
+        _run_queries(database_wrapper)
+
+
+def main() -> None:
+    django_database_wrapper, database_wrapper = (
+        _new_connection(database_wrapper_class) for database_wrapper_class in (DjangoDatabaseWrapper, DatabaseWrapper))
+    timings = (
+        ('django backend', time_in_micros(lambda: _run_queries(django_database_wrapper), repeat=20)),
+        ('profiler backend, not profiled', time_in_micros(lambda: _run_queries(database_wrapper), repeat=20)),
+        ('profiler backend, QUERY level', time_in_micros(lambda: _run_queries_profiled(database_wrapper), repeat=20)),
+    )
+    print(f'{"backend":>32} {"per query (μs)":>16}')
+    for name, timing_in_micros in timings:
+        print(f'{name:>32} {timing_in_micros / QUERIES:>16.2f}')
+
+
+if __name__ == '__main__':
+    main()
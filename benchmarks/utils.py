@@ -0,0 +1,27 @@
+"""
+Helpers shared by the benchmarks.  Benchmarks are not run as part of the tests, they are run as modules from the root
+of the repo, e.g.:
+
+    python -m benchmarks.benchmark_data_collector
+"""
+import os
+from time import perf_counter
+from typing import Callable
+
+import django
+
+
+def setup_django() -> None:
+    """ Same as runtests.py - uses the sqlite settings unless the caller has set DJANGO_SETTINGS_MODULE """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.testapp.sqlite_settings')
+    django.setup()
+
+
+def time_in_micros(func: Callable[[], None], repeat: int = 5) -> float:
+    """ Runs the function "repeat" times, and returns the best time.  The best time is the least noisy one """
+    best_time = float('inf')
+    for _ in range(repeat):
+        start_time = perf_counter()
+        func()
+        best_time = min(best_time, perf_counter() - start_time)
+    return best_time * 1000 * 1000
@@ -8,7 +8,7 @@ import uuid
 import redis
 from django.conf import settings
 
-from django_query_profiler.query_profiler_storage import QueryProfiledData
+from django_query_profiler.query_profiler_storage import ProfilerPhase, QueryProfiledData, perf_counter_ns
 
 REDIS_INSTANCE = redis.StrictRedis(
     host=settings.DJANGO_QUERY_PROFILER_REDIS_HOST,
@@ -17,10 +17,16 @@ REDIS_INSTANCE = redis.StrictRedis(
 
 
 def store_data(query_profiled_data: QueryProfiledData) -> str:
+    start_time = perf_counter_ns()
     pickled_query_profiled_data = pickle.dumps(query_profiled_data)
+    serialization_end_time = perf_counter_ns()
+
     redis_key = str(uuid.uuid4().hex)
     ttl_seconds: int = settings.DJANGO_QUERY_PROFILER_REDIS_KEYS_EXPIRY_SECONDS
     REDIS_INSTANCE.set(name=_get_key(redis_key), value=pickled_query_profiled_data, ex=ttl_seconds)
+
+    query_profiled_data.add_profiler_phase_time(ProfilerPhase.SERIALIZATION, serialization_end_time - start_time)
+    query_profiled_data.add_profiler_phase_time(ProfilerPhase.REDIS_STORE, perf_counter_ns() - serialization_end_time)
     return redis_key
 
 
@@ -19,5 +19,6 @@ def get_query_profiled_data(request, redis_key: str, query_profiler_level: str)
         'summary': query_profiled_data.summary,
         'query_signature_to_statistics': query_profiled_data.query_signature_to_query_signature_statistics,
         'flamegraphStack': json.dumps(query_profiled_data.flamegraph_stack),
+        'index_recommendations': query_profiled_data.index_recommendations,
     }
     return render(request, QUERY_PROFILER_LEVEL_TO_TEMPLATE[query_profiler_level], context)
@@ -1,24 +1,52 @@
 """
-Context manager which "starts" the profiling when it enters, and stops & return the profiled data when it exits
+Context manager which "starts" the profiling when it enters, and stops & return the profiled data when it exits.
+It can be used in async code as well, with "async with"
 """
+from types import FrameType
 from typing import Optional
 
+from django.conf import settings
+
+from django_query_profiler.django.db.models.model_instantiation import (
+    connect_model_instantiation_hook, disconnect_model_instantiation_hook
+)
 from django_query_profiler.query_profiler_storage import QueryProfiledData, QueryProfilerLevel
-from django_query_profiler.query_profiler_storage.data_collector import data_collector_thread_local_storage
+from django_query_profiler.query_profiler_storage.data_collector import data_collector_storage
 
 
 class QueryProfiler:
 
-    def __init__(self, query_profiler_level: QueryProfilerLevel, clear_thread_local: bool = False):
+    def __init__(self, query_profiler_level: QueryProfilerLevel, clear_thread_local: bool = False,
+                 query_sample_interval: int = 1, stack_trace_boundary_frame: Optional[FrameType] = None):
+        """
+        query_sample_interval: Profile only every k-th query executed in the block.  The other queries are just counted,
+            and the summary of the profiled data reports the sample rate and the extrapolated totals
+        stack_trace_boundary_frame: The frame where the stack trace of the queries stops, which the middleware sets to
+            its own frame when DJANGO_QUERY_PROFILER_STACK_TRACE_STOP_AT_MIDDLEWARE is on
+        """
         if clear_thread_local:
-            data_collector_thread_local_storage.reset()
+            data_collector_storage.reset()
 
         self.query_profiled_data: Optional[QueryProfiledData] = None
         self.query_profiler_level: QueryProfilerLevel = query_profiler_level
+        self.query_sample_interval: int = query_sample_interval
+        self.stack_trace_boundary_frame: Optional[FrameType] = stack_trace_boundary_frame
 
     def __enter__(self) -> 'QueryProfiler':
-        data_collector_thread_local_storage.enter_profiler_mode(self.query_profiler_level)
+        if settings.DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION:
+            connect_model_instantiation_hook()
+        else:
+            disconnect_model_instantiation_hook()
+        data_collector_storage.enter_profiler_mode(
+            self.query_profiler_level, self.query_sample_interval, self.stack_trace_boundary_frame)
         return self
 
     def __exit__(self, *_) -> None:
-        self.query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
+        self.query_profiled_data = data_collector_storage.exit_profiler_mode()
+        self.stack_trace_boundary_frame = None  # Not keeping the frame alive
+
+    async def __aenter__(self) -> 'QueryProfiler':
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.__exit__(*exc_info)
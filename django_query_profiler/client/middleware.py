@@ -4,9 +4,13 @@ It internally calls context manager, and has the same output as the context mana
 headers, for the chrome plugin to display
 """
 import json
+import random
+import sys
 from time import time
-from typing import Callable, Optional
+from types import FrameType
+from typing import Callable, Dict, Optional, Tuple
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.http import HttpRequest
 from django.http.response import HttpResponseBase
@@ -15,32 +19,109 @@ from django.urls import reverse
 import django_query_profiler.client.urls as query_profiler_url
 from django_query_profiler.chrome_plugin_helpers import ChromePluginData, redis_utils
 from django_query_profiler.client.context_manager import QueryProfiler
-from django_query_profiler.query_profiler_storage import QueryProfiledData, QueryProfilerLevel
+from django_query_profiler.client.query_explainer import explain_slowest_query_signatures
+from django_query_profiler.query_profiler_storage import (
+    ProfilerPhase, QueryProfiledData, QueryProfilerLevel, perf_counter_ns
+)
+
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:  # asgiref < 3.6, which is the version used by django < 4.1
+    import asyncio
+    from asyncio import iscoroutinefunction
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
 
 DETAILED_VIEW_EXCEPTION_URL = "django_query_profiler_detailed_view_not_setup_check_redis_and_urls.py"
 DETAILED_VIEW_EXCEPTION_LINK_TEXT = "redis_or_urls.py_not_setup"
 
 
 class QueryProfilerMiddleware:
+    """
+    A hybrid middleware: under ASGI it is called as a coroutine, and so Django doesn't have to run it in a thread.
+    The profiled block follows the request into the threads of sync views, since the data collector keeps the block in
+    a context variable
+    """
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response: Callable):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request: HttpRequest) -> HttpResponseBase:
-        # Check if we have to enable query profiler or not.
-        query_profiler_level: Optional[QueryProfilerLevel] = settings.DJANGO_QUERY_PROFILER_LEVEL_FUNC(request)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        query_profiler_level, request_sample_rate = self._sampled_query_profiler_level(
+            settings.DJANGO_QUERY_PROFILER_LEVEL_FUNC(request))
         if not query_profiler_level:
             return self.get_response(request)
 
         start_time: float = time()
+        with self._query_profiler(query_profiler_level) as query_profiler:
+            response = self.get_response(request)
+
+        self._add_query_profiled_data_to_response(
+            request, response, query_profiler.query_profiled_data, query_profiler_level, request_sample_rate,
+            start_time)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        # The level function can read the user or the session from the database, which can't be done in the event loop
+        query_profiler_level_func: Callable = settings.DJANGO_QUERY_PROFILER_LEVEL_FUNC
+        if iscoroutinefunction(query_profiler_level_func):
+            query_profiler_level: Optional[QueryProfilerLevel] = await query_profiler_level_func(request)
+        else:
+            query_profiler_level: Optional[QueryProfilerLevel] = await sync_to_async(query_profiler_level_func)(request)
+        query_profiler_level, request_sample_rate = self._sampled_query_profiler_level(query_profiler_level)
+        if not query_profiler_level:
+            return await self.get_response(request)
+
+        start_time: float = time()
+        async with self._query_profiler(query_profiler_level) as query_profiler:
+            response = await self.get_response(request)
+
+        # Storing in redis, and the post processor are blocking calls, which should not block the event loop
+        await sync_to_async(self._add_query_profiled_data_to_response)(
+            request, response, query_profiler.query_profiled_data, query_profiler_level, request_sample_rate,
+            start_time)
+        return response
+
+    @staticmethod
+    def _sampled_query_profiler_level(
+            query_profiler_level: Optional[QueryProfilerLevel]) -> Tuple[Optional[QueryProfilerLevel], float]:
+        """ Returns the level to profile the request with, which is None if the request should not be profiled """
+        request_sample_rate: float = settings.DJANGO_QUERY_PROFILER_REQUEST_SAMPLE_RATE
+        if query_profiler_level and request_sample_rate < 1 and random.random() >= request_sample_rate:
+            query_profiler_level = None
+        return query_profiler_level, request_sample_rate
+
+    @staticmethod
+    def _query_profiler(query_profiler_level: QueryProfilerLevel) -> QueryProfiler:
+        query_sample_interval: int = settings.DJANGO_QUERY_PROFILER_QUERY_SAMPLE_INTERVAL
         '''
         Lets clear all the storage related to this thread.  This is not strictly needed, but just as a safety measure
         As a side effect, this implies that we *CANNOT* use this middleware twice for a request
         '''
-        with QueryProfiler(query_profiler_level, clear_thread_local=True) as query_profiler:
-            response = self.get_response(request)
+        # The frame of __call__ (or __acall__), where the request enters the profiler
+        stack_trace_boundary_frame: Optional[FrameType] = (
+            sys._getframe(1) if settings.DJANGO_QUERY_PROFILER_STACK_TRACE_STOP_AT_MIDDLEWARE else None)
+        return QueryProfiler(query_profiler_level, clear_thread_local=True, query_sample_interval=query_sample_interval,
+                             stack_trace_boundary_frame=stack_trace_boundary_frame)
+
+    @staticmethod
+    def _add_query_profiled_data_to_response(request: HttpRequest, response: HttpResponseBase,
+                                             query_profiled_data: QueryProfiledData,
+                                             query_profiler_level: QueryProfilerLevel, request_sample_rate: float,
+                                             start_time: float) -> None:
+        explain_query_signature_count: int = settings.DJANGO_QUERY_PROFILER_EXPLAIN_SLOWEST_QUERY_SIGNATURES
+        if explain_query_signature_count:
+            explain_slowest_query_signatures(query_profiled_data, explain_query_signature_count)
 
-        query_profiled_data: QueryProfiledData = query_profiler.query_profiled_data
         try:
             # Pickling the object, and saving to redis
             redis_key: str = redis_utils.store_data(query_profiled_data)
@@ -59,11 +140,22 @@ class QueryProfilerMiddleware:
                 raise ex
 
         # Setting all headers that the chrome plugin require
-        response[ChromePluginData.QUERY_PROFILED_SUMMARY_DATA] = json.dumps(query_profiled_data.summary.as_dict())
+        summary_start_time: int = perf_counter_ns()
+        summary_as_dict: Dict = query_profiled_data.summary.as_dict()
+        serialization_start_time: int = perf_counter_ns()
+        query_profiled_data.add_profiler_phase_time(ProfilerPhase.SUMMARY,
+                                                    serialization_start_time - summary_start_time)
+        response[ChromePluginData.QUERY_PROFILED_SUMMARY_DATA] = json.dumps(summary_as_dict)
+        query_profiled_data.add_profiler_phase_time(ProfilerPhase.SERIALIZATION,
+                                                    perf_counter_ns() - serialization_start_time)
         response[ChromePluginData.QUERY_PROFILED_DETAILED_URL] = query_profiled_detail_absolute_url
         response[ChromePluginData.TIME_SPENT_PROFILING_IN_MICROS] = query_profiled_data.time_spent_profiling_in_micros
+        for profiler_phase, time_in_micros in query_profiled_data.profiler_phase_to_time_in_micros.items():
+            phase_header: str = ChromePluginData.TIME_SPENT_PROFILING_IN_MICROS_PHASE_PREFIX + profiler_phase.name
+            response[phase_header] = time_in_micros
         response[ChromePluginData.TOTAL_SERVER_TIME_IN_MILLIS] = int((time() - start_time) * 1000)
         response[ChromePluginData.QUERY_PROFILER_DETAILED_VIEW_LINK_TEXT] = detailed_view_link_text
+        response[ChromePluginData.REQUEST_SAMPLE_RATE] = request_sample_rate
+        response[ChromePluginData.QUERY_SAMPLE_RATE] = summary_as_dict['query_sample_rate']
 
         settings.DJANGO_QUERY_PROFILER_POST_PROCESSOR(query_profiled_data, request, response)
-        return response
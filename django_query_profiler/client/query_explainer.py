@@ -0,0 +1,91 @@
+"""
+This module runs EXPLAIN on the slowest SELECT query signatures of the profiled data, so that we don't have to copy the
+queries from the detailed view to the database console.  The slowest execution of the query signature is explained,
+with its params, using the EXPLAIN of the database (EXPLAIN QUERY PLAN on sqlite) - as given by django.
+
+Running EXPLAIN is a round-trip to the database, hence the plans are cached in the process by the sql of the query
+signature (and the database), for DJANGO_QUERY_PROFILER_EXPLAIN_CACHE_TTL_SECONDS.  The cache is shared by the threads
+of the server, and a lock guards reading, evicting & adding the plans - but not running EXPLAIN, so two threads can
+explain the same query at the same time, and the plan of the last one is kept.
+
+The EXPLAIN queries are run on connection.cursor() after the profiler block of the request has exited, each in
+transaction.atomic - so that a failing EXPLAIN does not break the transaction of the request.  They are not
+profiled in that block, but if an outer profiler block is active (like a QueryProfiler around a call to the test
+client), they are profiled in it like any other query
+"""
+import threading
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+
+from django_query_profiler.query_profiler_storage import (
+    SQL_CACHE_MAX_SIZE, ProfilerPhase, QueryExecution, QueryProfiledData, QuerySignature, SqlStatement, perf_counter_ns
+)
+
+# (sql of the query signature, database) -> (expiry time, plan).  A plan of None means the database could not explain
+EXPLAIN_PLAN_CACHE: Dict[Tuple[str, str], Tuple[float, Optional[str]]] = {}
+_EXPLAIN_PLAN_CACHE_LOCK = threading.Lock()
+
+
+def explain_slowest_query_signatures(query_profiled_data: QueryProfiledData, query_signature_count: int) -> None:
+    """ Adds the plans to the statistics of the query signatures in query_profiled_data """
+    start_time = perf_counter_ns()
+    slowest_select_query_signatures = _slowest_select_query_signatures(query_profiled_data, query_signature_count)
+    for query_signature, query_execution in slowest_select_query_signatures:
+        explain_plan = _explain_plan(query_signature, query_execution)
+        if explain_plan is not None:
+            query_profiled_data.add_explain_plan(query_signature, explain_plan)
+    query_profiled_data.add_profiler_phase_time(ProfilerPhase.EXPLAIN, perf_counter_ns() - start_time)
+
+
+def _slowest_select_query_signatures(query_profiled_data: QueryProfiledData,
+                                     query_signature_count: int) -> List[Tuple[QuerySignature, QueryExecution]]:
+    """ The query signatures with the slowest executions, along with their slowest execution """
+    query_signature_and_slowest_query_execution_list = [
+        (query_signature, max(query_signature_statistics.slowest_query_executions))
+        for query_signature, query_signature_statistics
+        in query_profiled_data.query_signature_to_query_signature_statistics.items()
+        if query_signature_statistics.slowest_query_executions and
+        SqlStatement.from_sql(query_signature.query_without_params) is SqlStatement.SELECT]
+    query_signature_and_slowest_query_execution_list.sort(key=lambda item: item[1], reverse=True)
+    return query_signature_and_slowest_query_execution_list[:query_signature_count]
+
+
+def _explain_plan(query_signature: QuerySignature, query_execution: QueryExecution) -> Optional[str]:
+    cache_key = (query_signature.query_without_params, query_signature.target_db)
+    now = monotonic()
+    with _EXPLAIN_PLAN_CACHE_LOCK:
+        cached_expiry_time_and_explain_plan = EXPLAIN_PLAN_CACHE.get(cache_key)
+    if cached_expiry_time_and_explain_plan is not None and cached_expiry_time_and_explain_plan[0] > now:
+        return cached_expiry_time_and_explain_plan[1]
+
+    explain_plan = _run_explain(query_signature.target_db, query_execution)
+    with _EXPLAIN_PLAN_CACHE_LOCK:
+        if len(EXPLAIN_PLAN_CACHE) >= SQL_CACHE_MAX_SIZE:
+            _evict(now)
+        EXPLAIN_PLAN_CACHE[cache_key] = (now + settings.DJANGO_QUERY_PROFILER_EXPLAIN_CACHE_TTL_SECONDS, explain_plan)
+    return explain_plan
+
+
+def _run_explain(target_db: str, query_execution: QueryExecution) -> Optional[str]:
+    connection = connections[target_db]
+    try:
+        explain_query_prefix: str = connection.ops.explain_query_prefix()
+        # In a savepoint, since a failed query aborts the transaction of the request on postgres
+        with transaction.atomic(using=target_db), connection.cursor() as cursor:
+            cursor.execute(f'{explain_query_prefix} {query_execution.query}', query_execution.params)
+            rows = cursor.fetchall()
+    except DatabaseError:
+        # The database can't explain (like oracle), or the params can't be bound again
+        return None
+    return '\n'.join(' '.join(str(column) for column in row) if isinstance(row, (list, tuple)) else str(row)
+                     for row in rows)
+
+
+def _evict(now: float) -> None:
+    """ Removes the expired plans, and if none expired - the oldest plan.  Called with the lock held """
+    expired_cache_keys = [cache_key for cache_key, (expiry_time, _) in EXPLAIN_PLAN_CACHE.items() if expiry_time <= now]
+    for cache_key in expired_cache_keys or [next(iter(EXPLAIN_PLAN_CACHE))]:
+        del EXPLAIN_PLAN_CACHE[cache_key]
@@ -1,28 +1,66 @@
 """
 This module add a "wrapper" around the Django CursorWrapper (which is a wrapper to various database cursor)
-to call our hook after the query was executed
+to call our hook after the query was executed, and after rows are fetched from the cursor
 
-profiler_hook calls the data_collector_thread_local_storage to record that a query was run
+profiler_hook calls the data_collector_storage to record that a query was run, and fetch_hook adds the rows fetched
+(and the time spent fetching them) to the query that was run last on the cursor - and tells the data_collector_storage
+that the model instances built next are built from the rows of that query.  On large result sets, most of the
+time is spent fetching the rows and not in executing the query
 """
 
-from time import time
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Iterator, Optional, Sized
 
 from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
 
-from django_query_profiler.query_profiler_storage.data_collector import data_collector_thread_local_storage
+from django_query_profiler.query_profiler_storage import perf_counter_ns
+from django_query_profiler.query_profiler_storage.data_collector import QueryHandle, data_collector_storage
 
 
 class QueryProfilerCursorWrapper(CursorWrapper):
-    def __init__(self, cursor, db: str, db_row_count: Optional[int]):
+    def __init__(self, cursor, db):
         super().__init__(cursor, db)
-        self.db_row_count = db_row_count
+        self.query_handle: Optional[QueryHandle] = None
 
     def execute(self, sql, params=None):
         return profiler_hook(self, base_class_func=super().execute, sql=sql, params=params)
 
     def executemany(self, sql, param_list):
-        return profiler_hook(self, base_class_func=super().executemany, sql=sql, params=param_list)
+        return profiler_hook(self, base_class_func=super().executemany, sql=sql, params=param_list, is_executemany=True)
+
+    def fetchone(self):
+        return fetch_hook(self, base_class_func=super().__getattr__('fetchone'), row_count_func=_row_count_of_one,
+                          args=(), kwargs={})
+
+    def fetchmany(self, *args, **kwargs):
+        return fetch_hook(self, base_class_func=super().__getattr__('fetchmany'), row_count_func=len,
+                          args=args, kwargs=kwargs)
+
+    def fetchall(self):
+        return fetch_hook(self, base_class_func=super().__getattr__('fetchall'), row_count_func=len,
+                          args=(), kwargs={})
+
+    def __iter__(self) -> Iterator:
+        query_handle: Optional[QueryHandle] = self.query_handle
+        if query_handle is None:
+            yield from super().__iter__()
+            return
+
+        fetched_row_count: int = 0
+        fetch_time_in_nanos: int = 0
+        rows = super().__iter__()
+        try:
+            while True:
+                start_time = perf_counter_ns()
+                try:
+                    row = next(rows)
+                finally:
+                    fetch_time_in_nanos += perf_counter_ns() - start_time
+                fetched_row_count += 1
+                yield row
+        except StopIteration:
+            pass
+        finally:
+            query_handle.add_fetch_data(fetched_row_count, fetch_time_in_nanos // 1000)
 
 
 class QueryProfilerCursorDebugWrapper(QueryProfilerCursorWrapper, CursorDebugWrapper):
@@ -34,21 +72,48 @@ class QueryProfilerCursorDebugWrapper(QueryProfilerCursorWrapper, CursorDebugWra
     pass
 
 
-def profiler_hook(query_profiler_cursor_wrapper: CursorWrapper, base_class_func: Callable, sql: str, params: Any):
+def profiler_hook(query_profiler_cursor_wrapper: QueryProfilerCursorWrapper, base_class_func: Callable, sql: str,
+                  params: Any, is_executemany: bool = False):
     """
-    This function calls invokes the "do something/nothing" with all the parameters
+    This function calls invokes the "do something/nothing" with all the parameters.  The row count is read after the
+    query was executed, since that is when the cursor has it.  Nothing is timed if the profiler is not on, which
+    happens only when the cursor was created in a profiler block and is used after it exits - see the mixin
     """
-    start_time = time()
+    if not data_collector_storage.query_profiler_enabled:
+        query_profiler_cursor_wrapper.query_handle = None
+        return base_class_func(sql, params)
+    if is_executemany and not isinstance(params, Sized):
+        params = list(params)  # A generator of parameter sets can be read only once, and we need to count them
+
+    start_time = perf_counter_ns()
     try:
         output = base_class_func(sql, params)
     finally:
-        end_time = time()
-        query_execution_time_in_micros = int((end_time - start_time) * 1000 * 1000)
+        query_execution_time_in_micros = (perf_counter_ns() - start_time) // 1000
 
-        data_collector_thread_local_storage.add_query_profiler_data(
+        query_profiler_cursor_wrapper.query_handle = data_collector_storage.add_query_profiler_data(
             query_without_params=sql,
             params=params,
             target_db=query_profiler_cursor_wrapper.db.alias,
             query_execution_time_in_micros=query_execution_time_in_micros,
-            db_row_count=query_profiler_cursor_wrapper.db_row_count)
+            db_row_count=query_profiler_cursor_wrapper.db.db_row_count(query_profiler_cursor_wrapper.cursor),
+            is_executemany=is_executemany)
     return output
+
+
+def fetch_hook(query_profiler_cursor_wrapper: QueryProfilerCursorWrapper, base_class_func: Callable,
+               row_count_func: Callable[[Any], int], args: tuple, kwargs: dict):
+    query_handle: Optional[QueryHandle] = query_profiler_cursor_wrapper.query_handle
+    if query_handle is None:
+        return base_class_func(*args, **kwargs)
+
+    start_time = perf_counter_ns()
+    output = base_class_func(*args, **kwargs)
+    fetch_time_in_micros = (perf_counter_ns() - start_time) // 1000
+    query_handle.add_fetch_data(row_count_func(output), fetch_time_in_micros)
+    data_collector_storage.rows_fetched(query_handle)
+    return output
+
+
+def _row_count_of_one(row: Optional[Any]) -> int:
+    return 0 if row is None else 1
@@ -1,25 +1,36 @@
 """
 This module defines a mixin, which can be used by all implementations for all databases.
 All the databases have a different hierarchy of DatabaseWrapper, but all of them derive from BaseDatabaseWrapper
+
+Apart from the cursor, the mixin also times connecting to the database, commits, rollbacks and savepoints.  With
+non-persistent connections (CONN_MAX_AGE=0), connecting can take a big part of the time spent in the database
 """
 
 from abc import ABC
-from typing import Optional
+from typing import Any, Callable, Optional
 
 from django.db.backends.base.base import BaseDatabaseWrapper
 from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
 
+from django_query_profiler.query_profiler_storage import DatabaseOperation, perf_counter_ns
+from django_query_profiler.query_profiler_storage.data_collector import data_collector_storage
+
 from .cursor_wrapper_instrumentation import QueryProfilerCursorDebugWrapper, QueryProfilerCursorWrapper
 
 
 class QueryProfilerDatabaseWrapperMixin(BaseDatabaseWrapper, ABC):
 
     def cursor(self):
+        """
+        When the profiler is not on in this thread (or async context), django's own cursor wrapper is returned, which
+        keeps the cost of the backend the same as the django backend.  A cursor created before the profiler block is
+        entered, and used within it, does not get profiled - django creates a cursor for every queryset evaluation,
+        and so this never happens for the ORM
+        """
         cursor_wrapper = super().cursor()
-        kwargs = dict(
-            cursor=cursor_wrapper.cursor,
-            db=cursor_wrapper.db,
-            db_row_count=self.db_row_count(cursor_wrapper.cursor))
+        if not data_collector_storage.query_profiler_enabled:
+            return cursor_wrapper
+        kwargs = dict(cursor=cursor_wrapper.cursor, db=cursor_wrapper.db)
 
         if isinstance(cursor_wrapper, CursorDebugWrapper):
             return QueryProfilerCursorDebugWrapper(**kwargs)
@@ -30,9 +41,43 @@ class QueryProfilerDatabaseWrapperMixin(BaseDatabaseWrapper, ABC):
                             "new version of django?  Did you run the tests in the django_query_profiler - they must  "
                             "have failed")
 
+    def connect(self):
+        return database_operation_hook(DatabaseOperation.CONNECT, super().connect)
+
+    def _commit(self):
+        return database_operation_hook(DatabaseOperation.COMMIT, super()._commit)
+
+    def _rollback(self):
+        return database_operation_hook(DatabaseOperation.ROLLBACK, super()._rollback)
+
+    def _savepoint(self, sid):
+        return database_operation_hook(DatabaseOperation.SAVEPOINT, super()._savepoint, sid)
+
+    def _savepoint_rollback(self, sid):
+        return database_operation_hook(DatabaseOperation.SAVEPOINT, super()._savepoint_rollback, sid)
+
+    def _savepoint_commit(self, sid):
+        return database_operation_hook(DatabaseOperation.SAVEPOINT, super()._savepoint_commit, sid)
+
     @staticmethod
     def db_row_count(cursor) -> Optional[int]:
         """
-        Implementation varies by database types, having it as a function allows it to be overriden
+        Implementation varies by database types, having it as a function allows it to be overriden.  This is called
+        after the query is executed
         """
         return cursor.rowcount
+
+
+def database_operation_hook(database_operation: DatabaseOperation, base_class_func: Callable, *args) -> Any:
+    """
+    Backends that override one of these methods, without calling super(), have to call this hook from their own
+    DatabaseWrapper - since the mixin comes after the django backend in the method resolution order
+    """
+    if not data_collector_storage.query_profiler_enabled:
+        return base_class_func(*args)
+
+    start_time = perf_counter_ns()
+    try:
+        return base_class_func(*args)
+    finally:
+        data_collector_storage.add_database_operation_data(database_operation, (perf_counter_ns() - start_time) // 1000)
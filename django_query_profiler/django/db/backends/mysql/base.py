@@ -2,7 +2,10 @@ from typing import Optional
 
 import django.db.backends.mysql.base as mysql_base
 
-from django_query_profiler.django.db.backends.database_wrapper_mixin import QueryProfilerDatabaseWrapperMixin
+from django_query_profiler.django.db.backends.database_wrapper_mixin import (
+    QueryProfilerDatabaseWrapperMixin, database_operation_hook
+)
+from django_query_profiler.query_profiler_storage import DatabaseOperation
 
 
 class DatabaseWrapper(mysql_base.DatabaseWrapper, QueryProfilerDatabaseWrapperMixin):
@@ -14,3 +17,7 @@ class DatabaseWrapper(mysql_base.DatabaseWrapper, QueryProfilerDatabaseWrapperMi
                 return -1
         except AttributeError:
             return cursor.rowcount
+
+    def _rollback(self):
+        # The mysql backend calls BaseDatabaseWrapper._rollback directly, which skips the mixin
+        return database_operation_hook(DatabaseOperation.ROLLBACK, super()._rollback)
@@ -1,7 +1,16 @@
 import django.db.backends.oracle.base as oracle_base
 
-from django_query_profiler.django.db.backends.database_wrapper_mixin import QueryProfilerDatabaseWrapperMixin
+from django_query_profiler.django.db.backends.database_wrapper_mixin import (
+    QueryProfilerDatabaseWrapperMixin, database_operation_hook
+)
+from django_query_profiler.query_profiler_storage import DatabaseOperation
 
 
 class DatabaseWrapper(oracle_base.DatabaseWrapper, QueryProfilerDatabaseWrapperMixin):
-    pass
+    """ The oracle backend overrides these methods without calling super(), which skips the mixin """
+
+    def _commit(self):
+        return database_operation_hook(DatabaseOperation.COMMIT, super()._commit)
+
+    def _savepoint_commit(self, sid):
+        return database_operation_hook(DatabaseOperation.SAVEPOINT, super()._savepoint_commit, sid)
@@ -0,0 +1,53 @@
+"""
+This module hooks into the building of model instances by the ORM, by wrapping "Model.from_db" - which is what the
+querysets call for every row they read from the database - to find the time spent in python building the model
+instances, apart from the time spent in the database.
+
+For wide querysets, building the model instances often takes longer than running the query - and seeing that for a
+query signature tells us to use ".values()" or ".only()" there.  Only the instances built from the rows of a query are
+counted: the ones built by hand (like the instances passed to bulk_create) don't go through "from_db".  A model that
+overrides "from_db" without calling the one of django is not counted.
+
+Since the wrapper is called for every model instance that is loaded, even when the profiler is not on, it is installed
+only when the setting DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION is on.  The profiler installs it when it enters,
+if the setting is on - and removes it if the setting is off by then (like after override_settings in tests)
+"""
+
+from django.db.models import Model
+
+from django_query_profiler.query_profiler_storage.data_collector import data_collector_storage
+
+_django_from_db = Model.from_db.__func__
+_is_connected: bool = False
+
+
+def connect_model_instantiation_hook() -> None:
+    """ Wraps Model.from_db once per process.  Calling it again does nothing """
+    global _is_connected
+    if _is_connected:
+        return
+    Model.from_db = classmethod(_from_db)
+    _is_connected = True
+
+
+def disconnect_model_instantiation_hook() -> None:
+    """ Puts back the Model.from_db of django.  Calling it when the hook is not connected does nothing """
+    global _is_connected
+    if not _is_connected:
+        return
+    Model.from_db = classmethod(_django_from_db)
+    _is_connected = False
+
+
+def _from_db(cls, db, field_names, values):
+    if not data_collector_storage.query_profiler_enabled:
+        return _django_from_db(cls, db, field_names, values)
+
+    data_collector_storage.model_instantiation_started()
+    is_instance_built = False
+    try:
+        model_instance = _django_from_db(cls, db, field_names, values)
+        is_instance_built = True
+        return model_instance
+    finally:
+        data_collector_storage.model_instantiation_finished(is_instance_built)
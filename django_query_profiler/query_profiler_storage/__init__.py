@@ -7,40 +7,139 @@ As an example, see "QuerySignatureStatistics __add__(self, other) function, wher
 becomes additive -- which is what it should be.
 """
 
+import dataclasses
+import datetime
+import heapq
 import json
+import math
 import operator
 import re
+import reprlib
 import typing
+import uuid
+import weakref
 from collections import Counter, OrderedDict, defaultdict
-from dataclasses import asdict, dataclass, field
+from dataclasses import InitVar, asdict, dataclass, field, fields
+from decimal import Decimal
 from enum import Enum
-from typing import Callable, Dict, Optional, Tuple
+from functools import lru_cache, reduce
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+from django.conf import settings
 from django.utils.functional import cached_property
 
+try:
+    from time import perf_counter_ns
+except ImportError:  # python 3.6
+    from time import perf_counter
+
+    def perf_counter_ns() -> int:
+        return int(perf_counter() * 1000 * 1000 * 1000)
+
 RE_STATEMENT_NAME = re.compile(r'(\S+)')
+SQL_CACHE_MAX_SIZE = 4096  # The number of sql strings kept in each of the caches of sql parsing functions
+EXECUTEMANY_PARAM_SETS_KEPT = 10  # The number of parameter sets kept for a slowest execution of an executemany
+
+
+def _with_slots(*extra_slots: str) -> Callable[[type], type]:
+    """
+    Class decorator, to be applied on top of @dataclass, that re-creates the class with __slots__ for its fields
+    (and the extra slots).  This is what dataclass(slots=True) does, which we can't use since it needs python 3.10.
+
+    Frozen dataclasses with slots can't be unpickled with the default protocol (it sets the slots with setattr), so
+    the class is pickled with its constructor arguments - unless it defines its own __reduce__
+    """
+    def wrap(cls: type) -> type:
+        field_names = tuple(dataclass_field.name for dataclass_field in fields(cls))
+        cls_dict = dict(cls.__dict__)
+        for field_name in field_names:
+            cls_dict.pop(field_name, None)
+        cls_dict.pop('__dict__', None)
+        cls_dict.pop('__weakref__', None)
+        cls_dict['__slots__'] = field_names + extra_slots
+        cls_dict.setdefault(
+            '__reduce__', lambda self: (type(self), tuple(getattr(self, field_name) for field_name in field_names)))
+        slotted_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+        slotted_cls.__qualname__ = cls.__qualname__
+        return slotted_cls
+    return wrap
 
 
+@_with_slots('_hash')
 @dataclass(frozen=True)
 class StackTraceElement:
+    """
+    A stack trace element is interned (see intern function), since the same few thousand elements of the code base
+    are in the stack trace of every query.  The hash is computed once, and kept in a slot
+    """
     module_name: str
     function_name: str
     line_number: Optional[int] = None  # None happens for django stack-trace
 
+    def __post_init__(self):
+        object.__setattr__(self, '_hash', hash((self.module_name, self.function_name, self.line_number)))
+
+    def __hash__(self):
+        return self._hash
+
     def __str__(self):
         return f'{self.module_name.replace(".", "/")}.py#{self.line_number} {self.function_name}()'
 
+    def __reduce__(self):
+        return StackTraceElement.intern, (self.module_name, self.function_name, self.line_number)
+
+    @staticmethod
+    def intern(module_name: str, function_name: str, line_number: Optional[int]) -> 'StackTraceElement':
+        """
+        Returns the canonical instance for these values.  The number of stack trace elements is bounded by the size
+        of the code base, so the canonical instances are never released
+        """
+        key = (module_name, function_name, line_number)
+        stack_trace_element = INTERNED_STACK_TRACE_ELEMENTS.get(key)
+        if stack_trace_element is None:
+            stack_trace_element = INTERNED_STACK_TRACE_ELEMENTS.setdefault(
+                key, StackTraceElement(module_name=module_name, function_name=function_name, line_number=line_number))
+        return stack_trace_element
+
     @staticmethod
     def django_stacktrace_element(module_name, function_name) -> 'StackTraceElement':
         """
         We are passing None for line_number.  This is important because when we want to compare django stack-traces,
         we want two stack-traces which have the same (module_name, function_name) combination to be same
         """
-        return StackTraceElement(module_name=module_name, function_name=function_name)
+        return StackTraceElement.intern(module_name, function_name, None)
 
     @staticmethod
     def app_stacktrace_element(module_name, function_name, line_number) -> 'StackTraceElement':
-        return StackTraceElement(module_name=module_name, function_name=function_name, line_number=line_number)
+        return StackTraceElement.intern(module_name, function_name, line_number)
+
+
+INTERNED_STACK_TRACE_ELEMENTS: Dict[Tuple[str, str, Optional[int]], StackTraceElement] = {}
+INTERNED_STACK_TRACES_MAX_SIZE = 8192
+INTERNED_STACK_TRACES: Dict[Tuple[StackTraceElement, ...], Tuple[StackTraceElement, ...]] = {}
+_INTERNED_STACK_TRACE_IDS: Dict[int, Tuple[StackTraceElement, ...]] = {}  # The same canonical tuples, by their id
+
+
+def intern_stack_trace(stack_trace: Tuple[StackTraceElement, ...]) -> Tuple[StackTraceElement, ...]:
+    """
+    Returns the canonical tuple for this stack trace, so that query signatures can be interned by the identity of their
+    stack traces.  Passing the canonical tuple itself (like the ones that a RawStackTrace keeps) costs a dict lookup by
+    its id, and only other tuples are hashed.
+
+    The number of distinct stack traces is not bounded by the size of the code base like the number of stack trace
+    elements, hence the canonical tuples are dropped once there are too many - that only costs hashing them again
+    """
+    if _INTERNED_STACK_TRACE_IDS.get(id(stack_trace)) is stack_trace:
+        return stack_trace
+    canonical_stack_trace = INTERNED_STACK_TRACES.get(stack_trace)
+    if canonical_stack_trace is None:
+        if len(INTERNED_STACK_TRACES) >= INTERNED_STACK_TRACES_MAX_SIZE:
+            INTERNED_STACK_TRACES.clear()
+            _INTERNED_STACK_TRACE_IDS.clear()
+        canonical_stack_trace = INTERNED_STACK_TRACES.setdefault(stack_trace, stack_trace)
+        _INTERNED_STACK_TRACE_IDS[id(canonical_stack_trace)] = canonical_stack_trace
+    return canonical_stack_trace
 
 
 class QuerySignatureAnalyzeResult(Enum):
@@ -55,13 +154,48 @@ class QuerySignatureAnalyzeResult(Enum):
         self.visible_in_ui = visible_in_ui
 
 
+@dataclass(frozen=True)
+class IndexRecommendation:
+    """
+    A composite index that the queries on a table would use, and the model does not have.  The columns for equality
+    filters come first, followed by one column that is filtered by a range or used for sorting.  Recommendations are
+    ranked by the time spent in the queries that would use them
+    """
+    model_label: str
+    table_name: str
+    field_names: Tuple[str, ...]
+    column_names: Tuple[str, ...]
+    frequency: int
+    query_execution_time_in_micros: int
+
+    @property
+    def index_definition(self) -> str:
+        """ What would go in the Meta.indexes of the model """
+        return f'models.Index(fields={list(self.field_names)!r})'
+
+
+@_with_slots('_hash', '_analysis', '__weakref__')
 @dataclass(frozen=True)
 class QuerySignature:
+    """
+    A query signature is interned (see intern function), since for N+1 queries the same signature is found again for
+    every query.  Reusing the canonical instance means that the accumulator's dict finds it by identity, with the hash
+    computed just once and kept in a slot
+    """
     query_without_params: str
     app_stack_trace: Tuple[StackTraceElement]
     django_stack_trace: Tuple[StackTraceElement]
     target_db: str
 
+    def __post_init__(self):
+        object.__setattr__(self, 'app_stack_trace', tuple(self.app_stack_trace))
+        object.__setattr__(self, 'django_stack_trace', tuple(self.django_stack_trace))
+        object.__setattr__(self, '_hash', hash(
+            (self.query_without_params, self.app_stack_trace, self.django_stack_trace, self.target_db)))
+
+    def __hash__(self):
+        return self._hash
+
     def __str__(self):
         app_stack_trace_str = '\n'.join(map(str, self.app_stack_trace))
         django_stack_trace_str = '\n'.join(map(str, self.django_stack_trace))
@@ -69,10 +203,42 @@ class QuerySignature:
         return f'''Query: \n {self.query_without_params}  \n{'##' * 20}\n app-stack-trace: \n {app_stack_trace_str}
                 \n{'##' * 20}\n django-stack-trace:\n {django_stack_trace_str} \n{'**' * 80}\n'''
 
-    @cached_property
+    @property
     def analysis(self) -> QuerySignatureAnalyzeResult:
-        from django_query_profiler.query_profiler_storage.django_stack_trace_analyze import code_recommendation
-        return code_recommendation(self)
+        """ Computed once per (interned) query signature, and kept in a slot since there is no __dict__ for caching """
+        try:
+            return self._analysis
+        except AttributeError:
+            from django_query_profiler.query_profiler_storage.django_stack_trace_analyze import code_recommendation
+            object.__setattr__(self, '_analysis', code_recommendation(self))
+            return self._analysis
+
+    def __reduce__(self):
+        return QuerySignature.intern, (
+            self.query_without_params, self.app_stack_trace, self.django_stack_trace, self.target_db)
+
+    @staticmethod
+    def intern(query_without_params: str, app_stack_trace: Tuple[StackTraceElement],
+               django_stack_trace: Tuple[StackTraceElement], target_db: str) -> 'QuerySignature':
+        """
+        Returns the canonical instance for these values.  Canonical instances are held weakly, and so are released
+        once no profiled data refers to them.
+        Two threads can race to create the canonical instance, and that is fine - equality is still by value, sharing
+        the instance is only an optimization.
+
+        The stack traces are interned, and the key has their ids instead of their elements, so that finding the
+        canonical instance does not hash & compare every element of the stack traces.  The ids are not reused while
+        the key is in the dict, since the canonical instance - which is what keeps the key in the dict - holds the
+        stack traces
+        """
+        app_stack_trace = intern_stack_trace(tuple(app_stack_trace))
+        django_stack_trace = intern_stack_trace(tuple(django_stack_trace))
+        key = (query_without_params, id(app_stack_trace), id(django_stack_trace), target_db)
+        query_signature = INTERNED_QUERY_SIGNATURES.get(key)
+        if query_signature is None:
+            query_signature = INTERNED_QUERY_SIGNATURES.setdefault(
+                key, QuerySignature(query_without_params, app_stack_trace, django_stack_trace, target_db))
+        return query_signature
 
     @property
     def is_fake(self) -> bool:
@@ -85,11 +251,177 @@ class QuerySignature:
         return not self.django_stack_trace and not self.app_stack_trace
 
 
+INTERNED_QUERY_SIGNATURES: 'weakref.WeakValueDictionary[tuple, QuerySignature]' = weakref.WeakValueDictionary()
+
+
+@_with_slots()
+@dataclass(frozen=True)
+class LatencyHistogram:
+    """
+    A histogram of query execution times, with log sized buckets.  Every power of two is split into
+    BUCKETS_PER_POWER_OF_TWO buckets, so the number of buckets is fixed (MAX_BUCKET_INDEX + 1), and a percentile read
+    from the histogram is off by at most ~19% (2 ** (1/4)).
+
+    Only the buckets that have a count are stored, which keeps the histogram compact and cheap to add, since most
+    query signatures have their timings in a handful of buckets
+    """
+    BUCKETS_PER_POWER_OF_TWO = 4
+    MAX_BUCKET_INDEX = 32 * BUCKETS_PER_POWER_OF_TWO  # 2 ** 32 micros is more than an hour
+
+    bucket_index_to_count: Dict[int, int] = field(default_factory=dict)
+
+    @staticmethod
+    def from_query_execution_time(query_execution_time_in_micros: int) -> 'LatencyHistogram':
+        return LatencyHistogram(
+            bucket_index_to_count={LatencyHistogram._bucket_index(query_execution_time_in_micros): 1})
+
+    def percentile(self, percent: float) -> Optional[int]:
+        """ Returns the upper bound of the bucket that has the percentile, or None if the histogram is empty """
+        total_count = sum(self.bucket_index_to_count.values())
+        if not total_count:
+            return None
+
+        rank = max(1, math.ceil(total_count * percent / 100))
+        cumulative_count = 0
+        for bucket_index in sorted(self.bucket_index_to_count):
+            cumulative_count += self.bucket_index_to_count[bucket_index]
+            if cumulative_count >= rank:
+                return self._bucket_upper_bound(bucket_index)
+
+    def __add__(self, other) -> 'LatencyHistogram':
+        """ Adding is O(number of non empty buckets), which is bounded by the fixed number of buckets """
+        combined_bucket_index_to_count = dict(self.bucket_index_to_count)
+        for bucket_index, count in other.bucket_index_to_count.items():
+            combined_bucket_index_to_count[bucket_index] = combined_bucket_index_to_count.get(bucket_index, 0) + count
+        return LatencyHistogram(bucket_index_to_count=combined_bucket_index_to_count)
+
+    def __radd__(self, other) -> 'LatencyHistogram':
+        """
+        This is needed for using sum() function to sum up a list of instances.
+        See http://www.marinamele.com/2014/04/modifying-add-method-of-python-class.html for more details
+        """
+        return self if other == 0 else self.__add__(other)
+
+    @staticmethod
+    def _bucket_index(query_execution_time_in_micros: int) -> int:
+        """ Bucket 0 is for 0 micros, and bucket i holds the times in [2 ** ((i-1)/4), 2 ** (i/4)) """
+        if query_execution_time_in_micros < 1:
+            return 0
+        bucket_index = int(math.log2(query_execution_time_in_micros) * LatencyHistogram.BUCKETS_PER_POWER_OF_TWO) + 1
+        return min(bucket_index, LatencyHistogram.MAX_BUCKET_INDEX)
+
+    @staticmethod
+    def _bucket_upper_bound(bucket_index: int) -> int:
+        return round(2 ** (bucket_index / LatencyHistogram.BUCKETS_PER_POWER_OF_TWO)) if bucket_index else 0
+
+
+@_with_slots()
+@dataclass(frozen=True, order=True)
+class QueryExecution:
+    """
+    One execution of a query, with its params.  Instances are ordered by the query execution time only, which lets us
+    keep the slowest executions of a query signature in a min-heap.
+
+    The params are kept (and pickled to redis, and shown in the detailed view) for every one of the slowest executions,
+    hence "capture" copies them - the caller can reuse its list of params - and keeps only the first
+    EXECUTEMANY_PARAM_SETS_KEPT parameter sets of an executemany, along with their count
+    """
+    query_execution_time_in_micros: int
+    query: str = field(compare=False)
+    params: Any = field(compare=False)
+    param_set_count: Optional[int] = field(default=None, compare=False)  # Of all the parameter sets, for executemany
+
+    @classmethod
+    def capture(cls, query_execution_time_in_micros: int, query: str, params: Any,
+                is_executemany: bool = False) -> 'QueryExecution':
+        if is_executemany:
+            return cls(query_execution_time_in_micros, query,
+                       tuple(_copied_params(param_set) for param_set in islice(params, EXECUTEMANY_PARAM_SETS_KEPT)),
+                       param_set_count=len(params))
+        return cls(query_execution_time_in_micros, query, _copied_params(params))
+
+    @property
+    def params_repr(self) -> str:
+        """ The params for showing them when they can't be interpolated in the query, with long values abbreviated """
+        params_repr = PARAMS_REPR.repr(self.params)
+        if self.param_set_count is not None and self.param_set_count > len(self.params):
+            params_repr += f' - the first {len(self.params)} of {self.param_set_count} parameter sets'
+        return params_repr
+
+    @property
+    def query_with_params(self) -> Optional[str]:
+        """
+        The query with params interpolated as sql literals, so that it can be copied straight into EXPLAIN.  Returns
+        None when the params don't fit the query - e.g. for executemany
+        """
+        if self.param_set_count is not None:
+            return None
+        if self.params is None:
+            return self.query
+        try:
+            if isinstance(self.params, dict):
+                return self.query % {name: _sql_literal(value) for name, value in self.params.items()}
+            return self.query % tuple(_sql_literal(value) for value in self.params)
+        except (TypeError, ValueError, KeyError):
+            return None
+
+    def __reduce__(self):
+        """ Params can have objects which can't be pickled (like database adapters), those are pickled as their repr """
+        return QueryExecution, (self.query_execution_time_in_micros, self.query, _picklable_params(self.params),
+                                self.param_set_count)
+
+
+@_with_slots()
 @dataclass(frozen=True)
 class QuerySignatureStatistics:
     frequency: int
     query_execution_time_in_micros: int
     db_row_count: Optional[int]
+    min_query_execution_time_in_micros: Optional[int] = None
+    max_query_execution_time_in_micros: Optional[int] = None
+    latency_histogram: LatencyHistogram = field(default_factory=LatencyHistogram)
+    # A min-heap with the slowest executions, bounded by DJANGO_QUERY_PROFILER_SLOWEST_QUERY_EXECUTIONS_PER_SIGNATURE
+    slowest_query_executions: Tuple[QueryExecution, ...] = ()
+    # Rows fetched from the cursor after the query was executed, and the time spent fetching them
+    fetched_row_count: int = 0
+    fetch_time_in_micros: int = 0
+    # Model instances built by the ORM from the rows, and the time spent building them.  Collected only when
+    # DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION is on
+    model_instance_count: int = 0
+    model_instantiation_time_in_micros: int = 0
+    # Calls of executemany (each of them is one query, of frequency 1), and the parameter sets sent in them
+    executemany_count: int = 0
+    executemany_param_set_count: int = 0
+    # The plan of the slowest execution, from the database.  See DJANGO_QUERY_PROFILER_EXPLAIN_SLOWEST_QUERY_SIGNATURES
+    explain_plan: Optional[str] = None
+
+    @property
+    def total_time_in_micros(self) -> int:
+        return self.query_execution_time_in_micros + self.fetch_time_in_micros
+
+    @property
+    def average_executemany_batch_size(self) -> Optional[float]:
+        return self.executemany_param_set_count / self.executemany_count if self.executemany_count else None
+
+    @property
+    def slowest_query_executions_sorted(self) -> Tuple[QueryExecution, ...]:
+        return tuple(sorted(self.slowest_query_executions, reverse=True))
+
+    @property
+    def p50_query_execution_time_in_micros(self) -> Optional[int]:
+        return self._query_execution_time_percentile(50)
+
+    @property
+    def p95_query_execution_time_in_micros(self) -> Optional[int]:
+        return self._query_execution_time_percentile(95)
+
+    @property
+    def p99_query_execution_time_in_micros(self) -> Optional[int]:
+        return self._query_execution_time_percentile(99)
+
+    def _query_execution_time_percentile(self, percent: float) -> Optional[int]:
+        return _clamp(self.latency_histogram.percentile(percent),
+                      self.min_query_execution_time_in_micros, self.max_query_execution_time_in_micros)
 
     def __add__(self, other) -> 'QuerySignatureStatistics':
         """
@@ -100,7 +432,22 @@ class QuerySignatureStatistics:
         return QuerySignatureStatistics(
             frequency=self.frequency + other.frequency,
             query_execution_time_in_micros=self.query_execution_time_in_micros + other.query_execution_time_in_micros,
-            db_row_count=total_db_row_count)
+            db_row_count=total_db_row_count,
+            min_query_execution_time_in_micros=_optional_op(
+                min, self.min_query_execution_time_in_micros, other.min_query_execution_time_in_micros),
+            max_query_execution_time_in_micros=_optional_op(
+                max, self.max_query_execution_time_in_micros, other.max_query_execution_time_in_micros),
+            latency_histogram=self.latency_histogram + other.latency_histogram,
+            slowest_query_executions=_merge_slowest_query_executions(
+                self.slowest_query_executions, other.slowest_query_executions),
+            fetched_row_count=self.fetched_row_count + other.fetched_row_count,
+            fetch_time_in_micros=self.fetch_time_in_micros + other.fetch_time_in_micros,
+            model_instance_count=self.model_instance_count + other.model_instance_count,
+            model_instantiation_time_in_micros=(
+                self.model_instantiation_time_in_micros + other.model_instantiation_time_in_micros),
+            executemany_count=self.executemany_count + other.executemany_count,
+            executemany_param_set_count=self.executemany_param_set_count + other.executemany_param_set_count,
+            explain_plan=self.explain_plan or other.explain_plan)
 
 
 class SqlStatement(Enum):
@@ -108,14 +455,17 @@ class SqlStatement(Enum):
     INSERT = ('INSERT',)
     UPDATE = ('UPDATE',)
     DELETE = ('DELETE',)
-    TRANSACTIONALS = ('BEGIN', 'END')
+    # Savepoints are run as queries: "SAVEPOINT x", "RELEASE SAVEPOINT x" and "ROLLBACK TO SAVEPOINT x"
+    TRANSACTIONALS = ('BEGIN', 'END', 'SAVEPOINT', 'RELEASE', 'ROLLBACK')
     OTHER = ()
 
     def __init__(self, *statements: Tuple[str]):
         self.statements = statements
 
     @staticmethod
+    @lru_cache(maxsize=SQL_CACHE_MAX_SIZE)
     def from_sql(query_without_params: str) -> 'SqlStatement':
+        """ Cached, since it is called for the same sql strings again & again - see the sql_normalizer module """
         sql_statement_str = RE_STATEMENT_NAME.search(query_without_params).groups()[0].upper()
         for sql_statement in SqlStatement:
             if sql_statement_str in sql_statement.statements:
@@ -125,37 +475,157 @@ class SqlStatement(Enum):
 
 @dataclass(frozen=True)
 class QueryProfiledSummaryData:
+    """
+    When the queries are sampled (query_sample_rate is less than 1), all the values are of the profiled queries only -
+    apart from the database operations (connections, commits, rollbacks & savepoints), which are never sampled.  The
+    "estimated_" values extrapolate the totals and the counts of every sql statement by the query sample rate.
+
+    The exact query duplicates and the potential N+1 query count are not extrapolated, since they are not proportional
+    to the number of queries - every other execution of a query, or of a query signature, is not profiled
+    """
     sql_statement_type_counter: typing.Counter[SqlStatement]
     exact_query_duplicates: int
     total_query_execution_time_in_micros: int
     total_db_row_count: Optional[int]
     potential_n_plus1_query_count: Optional[int]
+    query_sample_rate: float = 1.0  # Fraction of the queries that were profiled.  See QueryProfiler
+    min_query_execution_time_in_micros: Optional[int] = None
+    max_query_execution_time_in_micros: Optional[int] = None
+    p50_query_execution_time_in_micros: Optional[int] = None
+    p95_query_execution_time_in_micros: Optional[int] = None
+    p99_query_execution_time_in_micros: Optional[int] = None
+    total_fetched_row_count: int = 0
+    total_fetch_time_in_micros: int = 0
+    total_model_instance_count: int = 0
+    total_model_instantiation_time_in_micros: int = 0
+    # Round-trips to the database that are not queries run through a cursor.  See DatabaseOperation
+    connection_count: int = 0
+    connection_time_in_micros: int = 0
+    commit_count: int = 0
+    commit_time_in_micros: int = 0
+    rollback_count: int = 0
+    rollback_time_in_micros: int = 0
+    savepoint_count: int = 0
+    savepoint_time_in_micros: int = 0
+    total_executemany_count: int = 0
+    total_executemany_param_set_count: int = 0
 
     @cached_property
     def total_query_count(self) -> int:
         return sum(self.sql_statement_type_counter.values())
 
+    @cached_property
+    def estimated_total_query_count(self) -> int:
+        """ The estimates are the totals of the profiled queries, extrapolated by the query sample rate """
+        return round(self.total_query_count / self.query_sample_rate)
+
+    @cached_property
+    def estimated_sql_statement_type_counter(self) -> typing.Counter[SqlStatement]:
+        return Counter({sql_statement: round(count / self.query_sample_rate)
+                        for sql_statement, count in self.sql_statement_type_counter.items()})
+
+    @cached_property
+    def estimated_total_query_execution_time_in_micros(self) -> int:
+        return round(self.total_query_execution_time_in_micros / self.query_sample_rate)
+
+    @cached_property
+    def estimated_total_db_row_count(self) -> Optional[int]:
+        return round(self.total_db_row_count / self.query_sample_rate) if self.total_db_row_count is not None else None
+
+    @cached_property
+    def average_executemany_batch_size(self) -> Optional[float]:
+        return (self.total_executemany_param_set_count / self.total_executemany_count
+                if self.total_executemany_count else None)
+
     def as_dict(self) -> Dict:
         dict_representation: Dict = asdict(self)
         dict_representation.pop('sql_statement_type_counter', None)
         dict_representation.update({sql_statement.name: self.sql_statement_type_counter[sql_statement]
                                     for sql_statement in SqlStatement})
+        dict_representation.update(
+            {f'estimated_{sql_statement.name}': self.estimated_sql_statement_type_counter[sql_statement]
+             for sql_statement in SqlStatement})
+        dict_representation.update(
+            estimated_total_query_count=self.estimated_total_query_count,
+            estimated_total_query_execution_time_in_micros=self.estimated_total_query_execution_time_in_micros,
+            estimated_total_db_row_count=self.estimated_total_db_row_count,
+            average_executemany_batch_size=self.average_executemany_batch_size)
         return dict_representation
 
     def __str__(self):
         return json.dumps(self.as_dict(), indent=2)
 
 
-@dataclass(frozen=True)
+class ProfilerPhase(Enum):
+    """
+    The phases of the profiler's own work, for finding which part of the profiler is slow.  The first four happen for
+    every query, when the data is collected.  The rest happen once per profiled block, after the data is collected
+    """
+    STACK_WALK = 'STACK_WALK'
+    NORMALIZATION = 'NORMALIZATION'
+    HASHING = 'HASHING'  # Of the query & params, for finding exact duplicates
+    MERGE = 'MERGE'  # Of the statistics of the query, into the statistics of its query signature
+    SUMMARY = 'SUMMARY'
+    SERIALIZATION = 'SERIALIZATION'
+    REDIS_STORE = 'REDIS_STORE'
+    EXPLAIN = 'EXPLAIN'  # Of the slowest query signatures, if it is turned on
+    OTHER = 'OTHER'  # The time passed to QueryProfiledData as time_spent_profiling_in_micros, which has no phase
+
+
+class DatabaseOperation(Enum):
+    """
+    The work done by the database wrapper, apart from running the queries.  Connecting is not cheap when the connections
+    are not persistent (CONN_MAX_AGE=0), and commits and rollbacks are sent to the database driver without a cursor.
+
+    Savepoints are run as queries, hence they are counted as TRANSACTIONALS queries as well, and the time of those
+    queries is a part of the query execution time.  The SAVEPOINT time is measured around the same queries (plus the
+    work django does for them), so it is a breakdown of the query execution time - and should not be added to it
+    """
+    CONNECT = 'CONNECT'
+    COMMIT = 'COMMIT'
+    ROLLBACK = 'ROLLBACK'
+    SAVEPOINT = 'SAVEPOINT'  # Creating, releasing or rolling back to a savepoint
+
+
+@dataclass
 class QueryProfiledData:
     """
     This is the main class that helps in collecting data as part of query profiling. In a way, all other classes in this
     module are designed to support this class.
+
+    It is mutable, since the data of the phases that happen after the data is collected - the time of the phases (see
+    ProfilerPhase), and the plans of EXPLAIN - are added to it by the middleware.  Reading its properties has no side
+    effects, and the caller times finding the summary if it wants to.  Being mutable, it is not hashable.
+
+    time_spent_profiling_in_micros is the sum of the time of the phases.  It can still be passed to the constructor,
+    as it could be before the phases were timed, and it is then added as the time of the OTHER phase
     """
     query_signature_to_query_signature_statistics: Dict[QuerySignature, QuerySignatureStatistics] = field(
         default_factory=dict)
-    time_spent_profiling_in_micros: int = 0
-    _query_params_db_hash_counter: typing.Counter[str] = field(default_factory=Counter)
+    time_spent_profiling_in_micros: InitVar[int] = 0  # Replaced by the property after the class, see below
+    _query_params_db_hash_counter: typing.Counter[int] = field(default_factory=Counter)
+    profiler_phase_to_time_in_nanos: typing.Counter[ProfilerPhase] = field(default_factory=Counter)
+    skipped_query_count: int = 0  # Queries that were executed, but not profiled because of query sampling
+    database_operation_to_count: typing.Counter[DatabaseOperation] = field(default_factory=Counter)
+    database_operation_to_time_in_micros: typing.Counter[DatabaseOperation] = field(default_factory=Counter)
+
+    def __post_init__(self, time_spent_profiling_in_micros: int):
+        if time_spent_profiling_in_micros:
+            self.profiler_phase_to_time_in_nanos[ProfilerPhase.OTHER] += time_spent_profiling_in_micros * 1000
+
+    @property
+    def profiler_phase_to_time_in_micros(self) -> Dict[ProfilerPhase, int]:
+        return {profiler_phase: self.profiler_phase_to_time_in_nanos[profiler_phase] // 1000
+                for profiler_phase in ProfilerPhase}
+
+    def add_profiler_phase_time(self, profiler_phase: ProfilerPhase, time_in_nanos: int) -> None:
+        """ For the phases that happen after the data is collected, like storing it in redis """
+        self.profiler_phase_to_time_in_nanos[profiler_phase] += time_in_nanos
+
+    def add_explain_plan(self, query_signature: QuerySignature, explain_plan: str) -> None:
+        """ Plans are found after the data is collected, similar to the phase times """
+        self.query_signature_to_query_signature_statistics[query_signature] = dataclasses.replace(
+            self.query_signature_to_query_signature_statistics[query_signature], explain_plan=explain_plan)
 
     @cached_property
     def summary(self) -> QueryProfiledSummaryData:
@@ -167,8 +637,7 @@ class QueryProfiledData:
         potential_n_plus1_query_count = 0
         is_any_query_signature_fake = False
         for query_signature, query_signature_statistics in self.query_signature_to_query_signature_statistics.items():
-            sql_statement_str = RE_STATEMENT_NAME.search(query_signature.query_without_params).groups()[0]
-            sql_statement_type = SqlStatement.from_sql(sql_statement_str)
+            sql_statement_type = SqlStatement.from_sql(query_signature.query_without_params)
             sql_statement_type_to_count[sql_statement_type] += query_signature_statistics.frequency
 
             total_query_execution_time_in_micros += query_signature_statistics.query_execution_time_in_micros
@@ -179,12 +648,46 @@ class QueryProfiledData:
 
             is_any_query_signature_fake |= query_signature.is_fake
 
+        # Adding the statistics of all signatures puts all the queries in one histogram, to read the percentiles from
+        combined_query_signature_statistics: QuerySignatureStatistics = reduce(
+            operator.add, self.query_signature_to_query_signature_statistics.values(),
+            QuerySignatureStatistics(frequency=0, query_execution_time_in_micros=0, db_row_count=None))
+
+        profiled_query_count = sum(sql_statement_type_to_count.values())
+        query_sample_rate = (profiled_query_count / (profiled_query_count + self.skipped_query_count)
+                             if profiled_query_count else 1.0)
         return QueryProfiledSummaryData(
             sql_statement_type_counter=Counter(sql_statement_type_to_count),
             exact_query_duplicates=exact_query_duplicates,
             total_query_execution_time_in_micros=total_query_execution_time_in_micros,
             total_db_row_count=total_db_row_count,
-            potential_n_plus1_query_count=None if is_any_query_signature_fake else potential_n_plus1_query_count)
+            potential_n_plus1_query_count=None if is_any_query_signature_fake else potential_n_plus1_query_count,
+            query_sample_rate=query_sample_rate,
+            min_query_execution_time_in_micros=combined_query_signature_statistics.min_query_execution_time_in_micros,
+            max_query_execution_time_in_micros=combined_query_signature_statistics.max_query_execution_time_in_micros,
+            p50_query_execution_time_in_micros=combined_query_signature_statistics.p50_query_execution_time_in_micros,
+            p95_query_execution_time_in_micros=combined_query_signature_statistics.p95_query_execution_time_in_micros,
+            p99_query_execution_time_in_micros=combined_query_signature_statistics.p99_query_execution_time_in_micros,
+            total_fetched_row_count=combined_query_signature_statistics.fetched_row_count,
+            total_fetch_time_in_micros=combined_query_signature_statistics.fetch_time_in_micros,
+            total_model_instance_count=combined_query_signature_statistics.model_instance_count,
+            total_model_instantiation_time_in_micros=(
+                combined_query_signature_statistics.model_instantiation_time_in_micros),
+            connection_count=self.database_operation_to_count[DatabaseOperation.CONNECT],
+            connection_time_in_micros=self.database_operation_to_time_in_micros[DatabaseOperation.CONNECT],
+            commit_count=self.database_operation_to_count[DatabaseOperation.COMMIT],
+            commit_time_in_micros=self.database_operation_to_time_in_micros[DatabaseOperation.COMMIT],
+            rollback_count=self.database_operation_to_count[DatabaseOperation.ROLLBACK],
+            rollback_time_in_micros=self.database_operation_to_time_in_micros[DatabaseOperation.ROLLBACK],
+            savepoint_count=self.database_operation_to_count[DatabaseOperation.SAVEPOINT],
+            savepoint_time_in_micros=self.database_operation_to_time_in_micros[DatabaseOperation.SAVEPOINT],
+            total_executemany_count=combined_query_signature_statistics.executemany_count,
+            total_executemany_param_set_count=combined_query_signature_statistics.executemany_param_set_count)
+
+    @cached_property
+    def index_recommendations(self) -> List[IndexRecommendation]:
+        from django_query_profiler.query_profiler_storage.missing_index_analyze import index_recommendations
+        return index_recommendations(self.query_signature_to_query_signature_statistics)
 
     @cached_property
     def flamegraph_stack(self) -> Dict:
@@ -236,11 +739,16 @@ class QueryProfiledData:
             op=operator.add)
 
         combined_query_params_db_hash_counter = self._query_params_db_hash_counter + other._query_params_db_hash_counter
-        combined_profiling_time = self.time_spent_profiling_in_micros + other.time_spent_profiling_in_micros
+        combined_profiler_phase_to_time_in_nanos = (
+            self.profiler_phase_to_time_in_nanos + other.profiler_phase_to_time_in_nanos)
         return QueryProfiledData(
             _query_params_db_hash_counter=combined_query_params_db_hash_counter,
-            time_spent_profiling_in_micros=combined_profiling_time,
-            query_signature_to_query_signature_statistics=combined_query_signature_to_query_signature_statistics)
+            profiler_phase_to_time_in_nanos=combined_profiler_phase_to_time_in_nanos,
+            query_signature_to_query_signature_statistics=combined_query_signature_to_query_signature_statistics,
+            skipped_query_count=self.skipped_query_count + other.skipped_query_count,
+            database_operation_to_count=self.database_operation_to_count + other.database_operation_to_count,
+            database_operation_to_time_in_micros=(
+                self.database_operation_to_time_in_micros + other.database_operation_to_time_in_micros))
 
     def __radd__(self, other) -> 'QueryProfiledData':
         """
@@ -250,13 +758,247 @@ class QueryProfiledData:
         return self if other == 0 else self.__add__(other)
 
 
+# A property can't be defined in the class body, since the dataclass would take it as the default of the InitVar
+QueryProfiledData.time_spent_profiling_in_micros = property(
+    lambda self: sum(self.profiler_phase_to_time_in_nanos.values()) // 1000)
+
+
+class QuerySignatureStatisticsAccumulator:
+    """
+    This is the counterpart of QuerySignatureStatistics that QueryProfiledDataAccumulator updates in place, for every
+    query of a query signature.  Adding QuerySignatureStatistics creates a new instance, which copies the buckets of
+    the latency histogram and the heap of the slowest executions - here a query is added with a couple of additions, a
+    dict increment and a heap push, and it is converted to QuerySignatureStatistics only when the profiler block exits
+    """
+    __slots__ = ('frequency', 'query_execution_time_in_micros', 'db_row_count', 'min_query_execution_time_in_micros',
+                 'max_query_execution_time_in_micros', 'bucket_index_to_count', 'slowest_query_executions',
+                 'fetched_row_count', 'fetch_time_in_micros', 'model_instance_count',
+                 'model_instantiation_time_in_micros', 'executemany_count', 'executemany_param_set_count',
+                 'explain_plan')
+
+    def __init__(self):
+        self.frequency: int = 0
+        self.query_execution_time_in_micros: int = 0
+        self.db_row_count: Optional[int] = 0
+        self.min_query_execution_time_in_micros: Optional[int] = None
+        self.max_query_execution_time_in_micros: Optional[int] = None
+        self.bucket_index_to_count: Dict[int, int] = {}
+        self.slowest_query_executions: List[QueryExecution] = []  # A min-heap, like in QuerySignatureStatistics
+        self.fetched_row_count: int = 0
+        self.fetch_time_in_micros: int = 0
+        self.model_instance_count: int = 0
+        self.model_instantiation_time_in_micros: int = 0
+        self.executemany_count: int = 0
+        self.executemany_param_set_count: int = 0
+        self.explain_plan: Optional[str] = None
+
+    def add_query(self, query_execution_time_in_micros: int, db_row_count: Optional[int], query: str, params: Any,
+                  is_executemany: bool, slowest_query_execution_count: int) -> None:
+        self.frequency += 1
+        self.query_execution_time_in_micros += query_execution_time_in_micros
+        self.db_row_count = (self.db_row_count + db_row_count
+                             if self.db_row_count is not None and db_row_count is not None else None)
+        self.min_query_execution_time_in_micros = _optional_op(
+            min, self.min_query_execution_time_in_micros, query_execution_time_in_micros)
+        self.max_query_execution_time_in_micros = _optional_op(
+            max, self.max_query_execution_time_in_micros, query_execution_time_in_micros)
+        bucket_index = LatencyHistogram._bucket_index(query_execution_time_in_micros)
+        self.bucket_index_to_count[bucket_index] = self.bucket_index_to_count.get(bucket_index, 0) + 1
+        # Capturing copies the params, hence it is done only for the executions that enter the heap
+        slowest_query_executions = self.slowest_query_executions
+        if len(slowest_query_executions) < slowest_query_execution_count:
+            heapq.heappush(slowest_query_executions,
+                           QueryExecution.capture(query_execution_time_in_micros, query, params, is_executemany))
+        elif (slowest_query_executions and
+              query_execution_time_in_micros > slowest_query_executions[0].query_execution_time_in_micros):
+            heapq.heapreplace(slowest_query_executions,
+                              QueryExecution.capture(query_execution_time_in_micros, query, params, is_executemany))
+        if is_executemany:
+            self.executemany_count += 1
+            self.executemany_param_set_count += len(params)
+
+    def add_query_signature_statistics(self, query_signature_statistics: QuerySignatureStatistics,
+                                       slowest_query_execution_count: int) -> None:
+        """ Folds the statistics of a nested block, or of another accumulator (once it is frozen) """
+        self.frequency += query_signature_statistics.frequency
+        self.query_execution_time_in_micros += query_signature_statistics.query_execution_time_in_micros
+        self.db_row_count = (self.db_row_count + query_signature_statistics.db_row_count
+                             if self.db_row_count is not None and query_signature_statistics.db_row_count is not None
+                             else None)
+        self.min_query_execution_time_in_micros = _optional_op(
+            min, self.min_query_execution_time_in_micros, query_signature_statistics.min_query_execution_time_in_micros)
+        self.max_query_execution_time_in_micros = _optional_op(
+            max, self.max_query_execution_time_in_micros, query_signature_statistics.max_query_execution_time_in_micros)
+        for bucket_index, count in query_signature_statistics.latency_histogram.bucket_index_to_count.items():
+            self.bucket_index_to_count[bucket_index] = self.bucket_index_to_count.get(bucket_index, 0) + count
+        for query_execution in query_signature_statistics.slowest_query_executions:
+            self._add_query_execution(query_execution, slowest_query_execution_count)
+        self.fetched_row_count += query_signature_statistics.fetched_row_count
+        self.fetch_time_in_micros += query_signature_statistics.fetch_time_in_micros
+        self.model_instance_count += query_signature_statistics.model_instance_count
+        self.model_instantiation_time_in_micros += query_signature_statistics.model_instantiation_time_in_micros
+        self.executemany_count += query_signature_statistics.executemany_count
+        self.executemany_param_set_count += query_signature_statistics.executemany_param_set_count
+        self.explain_plan = self.explain_plan or query_signature_statistics.explain_plan
+
+    def _add_query_execution(self, query_execution: QueryExecution, slowest_query_execution_count: int) -> None:
+        if len(self.slowest_query_executions) < slowest_query_execution_count:
+            heapq.heappush(self.slowest_query_executions, query_execution)
+        elif self.slowest_query_executions:
+            heapq.heappushpop(self.slowest_query_executions, query_execution)
+
+    def freeze(self) -> QuerySignatureStatistics:
+        """ The histogram buckets are handed over without copying them, hence this must not be updated after it """
+        return QuerySignatureStatistics(
+            frequency=self.frequency,
+            query_execution_time_in_micros=self.query_execution_time_in_micros,
+            db_row_count=self.db_row_count,
+            min_query_execution_time_in_micros=self.min_query_execution_time_in_micros,
+            max_query_execution_time_in_micros=self.max_query_execution_time_in_micros,
+            latency_histogram=LatencyHistogram(bucket_index_to_count=self.bucket_index_to_count),
+            slowest_query_executions=tuple(self.slowest_query_executions),
+            fetched_row_count=self.fetched_row_count,
+            fetch_time_in_micros=self.fetch_time_in_micros,
+            model_instance_count=self.model_instance_count,
+            model_instantiation_time_in_micros=self.model_instantiation_time_in_micros,
+            executemany_count=self.executemany_count,
+            executemany_param_set_count=self.executemany_param_set_count,
+            explain_plan=self.explain_plan)
+
+
+class QueryProfiledDataAccumulator:
+    """
+    This is the counterpart of QueryProfiledData that the data collector updates, while a profiler block is active.
+
+    Adding a query to QueryProfiledData creates a new instance, which copies all the dicts - that makes profiling a
+    request with n queries O(n^2).  This class instead updates the statistics of the query signature in place (see
+    QuerySignatureStatisticsAccumulator), which is O(1) per query, and is converted to QueryProfiledData only once -
+    when the profiler block exits
+    """
+
+    def __init__(self):
+        self.query_signature_to_query_signature_statistics: Dict[QuerySignature,
+                                                                 QuerySignatureStatisticsAccumulator] = {}
+        self.profiler_phase_to_time_in_nanos: typing.Counter[ProfilerPhase] = Counter()
+        self.query_params_db_hash_counter: typing.Counter[int] = Counter()
+        self.skipped_query_count: int = 0
+        self.database_operation_to_count: typing.Counter[DatabaseOperation] = Counter()
+        self.database_operation_to_time_in_micros: typing.Counter[DatabaseOperation] = Counter()
+        self.slowest_query_execution_count: int = settings.DJANGO_QUERY_PROFILER_SLOWEST_QUERY_EXECUTIONS_PER_SIGNATURE
+        self.is_frozen: bool = False
+        # The accumulator of the parent block, once the block of this one has exited & its data is folded into it
+        self.folded_into: Optional[QueryProfiledDataAccumulator] = None
+
+    def add_query(self, query_signature: QuerySignature, query_params_db_hash: int,
+                  query_execution_time_in_micros: int, db_row_count: Optional[int], query: str, params: Any,
+                  is_executemany: bool = False) -> None:
+        """ For executemany, params is the list of parameter sets """
+        self._query_signature_statistics(query_signature).add_query(
+            query_execution_time_in_micros, db_row_count, query, params, is_executemany,
+            self.slowest_query_execution_count)
+        self.query_params_db_hash_counter[query_params_db_hash] += 1
+
+    def add_query_profiled_data(self, query_profiled_data: QueryProfiledData) -> None:
+        """ Folds the data of a nested block in place.  This is O(size) of the passed data, not of this container """
+        for query_signature, query_signature_statistics in \
+                query_profiled_data.query_signature_to_query_signature_statistics.items():
+            self._query_signature_statistics(query_signature).add_query_signature_statistics(
+                query_signature_statistics, self.slowest_query_execution_count)
+        self.query_params_db_hash_counter.update(query_profiled_data._query_params_db_hash_counter)
+        self.profiler_phase_to_time_in_nanos.update(query_profiled_data.profiler_phase_to_time_in_nanos)
+        self.skipped_query_count += query_profiled_data.skipped_query_count
+        self.database_operation_to_count.update(query_profiled_data.database_operation_to_count)
+        self.database_operation_to_time_in_micros.update(query_profiled_data.database_operation_to_time_in_micros)
+
+    def add_database_operation(self, database_operation: DatabaseOperation, time_in_micros: int) -> None:
+        self.database_operation_to_count[database_operation] += 1
+        self.database_operation_to_time_in_micros[database_operation] += time_in_micros
+
+    def add_fetch_statistics(self, query_signature: QuerySignature, fetched_row_count: int,
+                             fetch_time_in_micros: int) -> None:
+        """
+        Rows are fetched after the query was added, and maybe after the block has exited - once the accumulator is
+        frozen, its containers belong to the QueryProfiledData, and the fetch is not added.  If the block was nested,
+        the QueryHandle of the data collector adds it to the accumulator that the data was folded into instead
+        """
+        if self.is_frozen:
+            return
+        query_signature_statistics = self.query_signature_to_query_signature_statistics[query_signature]
+        query_signature_statistics.fetched_row_count += fetched_row_count
+        query_signature_statistics.fetch_time_in_micros += fetch_time_in_micros
+
+    def add_model_instantiation_statistics(self, query_signature: QuerySignature, model_instance_count: int,
+                                           model_instantiation_time_in_micros: int) -> None:
+        if self.is_frozen:
+            return
+        query_signature_statistics = self.query_signature_to_query_signature_statistics[query_signature]
+        query_signature_statistics.model_instance_count += model_instance_count
+        query_signature_statistics.model_instantiation_time_in_micros += model_instantiation_time_in_micros
+
+    def _query_signature_statistics(self, query_signature: QuerySignature) -> QuerySignatureStatisticsAccumulator:
+        query_signature_statistics = self.query_signature_to_query_signature_statistics.get(query_signature)
+        if query_signature_statistics is None:
+            query_signature_statistics = self.query_signature_to_query_signature_statistics[query_signature] = \
+                QuerySignatureStatisticsAccumulator()
+        return query_signature_statistics
+
+    def map_query_signatures(self, query_signature_func: Callable[[Any], QuerySignature]) -> None:
+        """ Replaces every query signature by the one the function returns, merging the ones that end up the same """
+        query_signature_to_query_signature_statistics = self.query_signature_to_query_signature_statistics
+        self.query_signature_to_query_signature_statistics = {}
+        for query_signature, query_signature_statistics in query_signature_to_query_signature_statistics.items():
+            mapped_query_signature = query_signature_func(query_signature)
+            existing_query_signature_statistics = self.query_signature_to_query_signature_statistics.get(
+                mapped_query_signature)
+            if existing_query_signature_statistics is None:
+                self.query_signature_to_query_signature_statistics[mapped_query_signature] = query_signature_statistics
+            else:
+                existing_query_signature_statistics.add_query_signature_statistics(
+                    query_signature_statistics.freeze(), self.slowest_query_execution_count)
+
+    def freeze(self) -> QueryProfiledData:
+        """
+        The containers are handed over to QueryProfiledData without copying them, hence the accumulator must not be
+        written to after it is frozen
+        """
+        self.is_frozen = True
+        return QueryProfiledData(
+            query_signature_to_query_signature_statistics={
+                query_signature: query_signature_statistics.freeze()
+                for query_signature, query_signature_statistics
+                in self.query_signature_to_query_signature_statistics.items()},
+            profiler_phase_to_time_in_nanos=self.profiler_phase_to_time_in_nanos,
+            _query_params_db_hash_counter=self.query_params_db_hash_counter,
+            skipped_query_count=self.skipped_query_count,
+            database_operation_to_count=self.database_operation_to_count,
+            database_operation_to_time_in_micros=self.database_operation_to_time_in_micros)
+
+
+class SqlNormalization(Enum):
+    """ How the sql of a query is normalized, before grouping queries by it.  See the sql_normalizer module """
+    NONE = 'NONE'
+    # "IN (%s, %s, %s)" is the same as "IN (%s)"
+    COLLAPSE_REPEATED_PARAMS = 'COLLAPSE_REPEATED_PARAMS'
+    # Literals and placeholders are replaced by "?", lists of them are collapsed, and comments & whitespace are removed
+    FINGERPRINT = 'FINGERPRINT'
+
+
 class QueryProfilerLevel(Enum):
-    QUERY_SIGNATURE = (500, True)
-    QUERY = (0, False)
+    """
+    The sql normalization is the default for the level, which can be changed with the
+    DJANGO_QUERY_PROFILER_SQL_NORMALIZATION_FUNC setting
+    """
+    QUERY_SIGNATURE = (500, SqlNormalization.COLLAPSE_REPEATED_PARAMS)
+    QUERY = (0, SqlNormalization.FINGERPRINT)
 
-    def __init__(self, stack_trace_depth: int, normalize_sql: bool):
+    def __init__(self, stack_trace_depth: int, sql_normalization: SqlNormalization):
         self.stack_trace_depth = stack_trace_depth
-        self.normalize_sql = normalize_sql
+        self.sql_normalization = sql_normalization
+
+    @property
+    def normalize_sql(self) -> bool:
+        """ Kept for backward compatibility, from before a level had a SqlNormalization.  Use sql_normalization """
+        return self.sql_normalization is not SqlNormalization.NONE
 
     def __add__(self, other) -> 'QueryProfilerLevel':
         """
@@ -280,6 +1022,78 @@ class QueryProfilerLevel(Enum):
         return self if other == 0 else self.__add__(other)
 
 
+def _optional_op(op: Callable, first_value: Optional[int], second_value: Optional[int]) -> Optional[int]:
+    """ Applies op (like min, max) to the values which are not None.  Returns None if both of them are None """
+    if first_value is None or second_value is None:
+        return second_value if first_value is None else first_value
+    return op(first_value, second_value)
+
+
+def _merge_slowest_query_executions(first_heap: Tuple[QueryExecution, ...],
+                                    second_heap: Tuple[QueryExecution, ...]) -> Tuple[QueryExecution, ...]:
+    """ Returns a min-heap with the slowest executions of both heaps, bounded by the capacity in settings """
+    if not second_heap:
+        return first_heap
+
+    capacity: int = settings.DJANGO_QUERY_PROFILER_SLOWEST_QUERY_EXECUTIONS_PER_SIGNATURE
+    combined_heap = list(first_heap)
+    for query_execution in second_heap:
+        if len(combined_heap) < capacity:
+            heapq.heappush(combined_heap, query_execution)
+        elif combined_heap and query_execution > combined_heap[0]:
+            heapq.heapreplace(combined_heap, query_execution)
+    return tuple(combined_heap)
+
+
+def _sql_literal(value: Any) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"X'{bytes(value).hex()}'"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+PICKLABLE_PARAM_TYPES = (type(None), bool, int, float, str, bytes, Decimal, datetime.date, datetime.time,
+                         datetime.timedelta, uuid.UUID)
+
+
+def _copied_params(params: Any) -> Any:
+    """ Params are read only once they are shown, and by then the list passed to the cursor could have been changed """
+    if isinstance(params, list):
+        return tuple(params)
+    if isinstance(params, dict):
+        return dict(params)
+    return params
+
+
+PARAMS_REPR = reprlib.Repr()
+PARAMS_REPR.maxlevel = 3
+PARAMS_REPR.maxtuple = PARAMS_REPR.maxlist = PARAMS_REPR.maxdict = 100
+PARAMS_REPR.maxstring = PARAMS_REPR.maxother = 200
+
+
+def _picklable_params(params: Any) -> Any:
+    if isinstance(params, dict):
+        return {name: _picklable_params(value) for name, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return type(params)(_picklable_params(value) for value in params)
+    return params if isinstance(params, PICKLABLE_PARAM_TYPES) else repr(params)
+
+
+def _clamp(value: Optional[int], min_value: Optional[int], max_value: Optional[int]) -> Optional[int]:
+    if value is None:
+        return None
+    if min_value is not None:
+        value = max(value, min_value)
+    if max_value is not None:
+        value = min(value, max_value)
+    return value
+
+
 def merge_dicts(first_dict: Dict, second_dict: Dict, op: Callable) -> OrderedDict:
     return OrderedDict(list(first_dict.items()) + list(second_dict.items()) +
                        [(key, op(first_dict[key], second_dict[key])) for key in set(second_dict) & set(first_dict)])
@@ -1,6 +1,6 @@
 """
-This is the module that collects & stores data (in its data structures, maintained in a thread-local) when a query is
-executed.
+This is the module that collects & stores data (in its data structures, maintained in a context variable) when a query
+is executed.
 
 There are three main functions in this module:
 1. enter_profiled_mode : Called from the context manager
@@ -23,128 +23,409 @@ Nested context manager results in following complexity:
 
 Implementation Notes:
 --------------------
-1.  To segregate the data for each time we enter via the context manager, we are going to use a List.  Data at an
-    index represents the query profiled data that was collected when that "index" was active.  Lets say we are at 4th
-    nested context manager => we would be writing data at list[3]
-2.  When we exit from a context manger, we are going to return all the data that we had started collecting, from the
-    index at which we entered.  ie. Lets assume we enter at index 2, and now list has grown to index 5.  When we exit
-    from index 2, we would want to get all data from index 2 to 5.
-    Its very clear from above that we would need to keep track of index when we had entered.  For that, we are going
-    to use a stack of indices A stack would work because when we exit a block, we would pop from the stack
-3.  "QueryProfilerData" is the container that collects all the data that we collect.   When we enter a block, we
-    initialize with an empty container.  Any time Django hook calls to register a query, we add existing data to the
-    new data, create "QueryProfiledData" object which has combined data, and use this new object in the list
-4.  For finding which QueryProfilerType would be active, we are again using a stack.  And using the fact that if anyone
-    above the current call has used QUERY_SIGNATURE, the active one would be QUERY_SIGNATURE
+1.  Every time we enter via the context manager, we create a "_ProfilerBlock".  A block is linked to the block it is
+    nested in (its parent), and we keep a reference to the innermost block - which makes the blocks a stack.  Data is
+    always written to the innermost block, so a block holds ONLY the data that was collected while it was innermost
+2.  When we exit from a context manager, the innermost block has all the data of its own queries, plus the data of all
+    the blocks that were nested in it - because every inner block folds its data into its parent block when it exits.
+    So exiting just returns the data of the innermost block, folds it into the parent block, and makes the parent the
+    innermost block.  That costs time proportional to the data in the exiting block, and the data of a finished
+    inner block is freed as soon as it is folded
+3.  "QueryProfiledDataAccumulator" is the container that collects all the data that we collect.   When we enter a
+    block, we initialize with an empty container.  Any time Django hook calls to register a query, we update the
+    statistics of the container of the innermost block in place.  The container is converted into
+    "QueryProfiledData" only when we exit from the block
+4.  For finding which QueryProfilerType would be active, every block stores the level active in it.  And using the
+    fact that if anyone above the current call has used QUERY_SIGNATURE, the active one would be QUERY_SIGNATURE - the
+    level active in a block is the level of its parent block added to the level asked for the block
+5.  Query sampling works the same way: a block profiles every k-th query, and k is the smallest of the query sample
+    interval asked for the block and the one active in its parent block.  The queries that are not profiled are just
+    counted, so that the summary can extrapolate the totals
+6.  The innermost block is kept in a context variable, and not a thread-local.  Under ASGI, many requests run as
+    coroutines on the same thread, and a thread-local would mix up their blocks.  A context variable is isolated per
+    asyncio task, and is copied to the tasks created by asyncio.gather and to the threads running sync_to_async code -
+    since the copy refers to the same block, queries run by those children are collected in the block of the request.
+    For sync code, every thread has its own context, which makes it work the same way as a thread-local.
+
+    The children share the accumulator of the block, and it is updated without any synchronization.  That is fine
+    for the tasks of asyncio.gather, which run on one thread, and for sync_to_async with thread_sensitive=True (the
+    default), which runs one child at a time.  But children run in parallel threads - by sync_to_async with
+    thread_sensitive=False, under asyncio.gather - can race on the statistics of the same query signature, and lose
+    some of their updates
+7.  Model instances loaded by the ORM (when DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION is on) are attributed to
+    the query whose rows were fetched last in the innermost block, since the ORM builds them from the rows it has just
+    fetched.  They are counted in the block, and added to the statistics of that query signature when rows of another
+    query are fetched, or when the block exits - which keeps the work done for every model instance to a couple of
+    additions.
+
+    The instances don't know the cursor they were built from, hence this is not exact: when a queryset is iterated
+    with ".iterator()", and a query is run in the loop, the instances built from the rest of the chunk that was already
+    fetched are attributed to the query in the loop - till the next chunk is fetched
+8.  When DJANGO_QUERY_PROFILER_LAZY_STACK_CAPTURE is on, a query is added with a LazyQuerySignature - which has the raw
+    stack trace (the code objects & instruction offsets of the frames) instead of the app & django stack traces.  The
+    lazy query signatures are replaced by the query signatures when the block exits, before its data is returned, and
+    the statistics of the ones that end up with the same query signature are merged
+
 """
 
-import re
-import threading
-from binascii import hexlify
-from collections import Counter
-from time import time
-from typing import List, Optional, Union
+import contextvars
+from types import FrameType
+from typing import Any, List, NamedTuple, Optional, Tuple, Union
 
 import django.db.models as django_base_model
-import mmh3 as mmh3
 from django.conf import settings
 
-from . import QueryProfiledData, QueryProfilerLevel, QuerySignature, QuerySignatureStatistics
-from .stack_tracer import find_stack_trace
+from . import (
+    DatabaseOperation, ProfilerPhase, QueryProfiledData, QueryProfiledDataAccumulator, QueryProfilerLevel,
+    QuerySignature, SqlNormalization, perf_counter_ns
+)
+from .sql_normalizer import normalize_sql
+from .stack_tracer import RawStackTrace, capture_raw_stack_trace, find_stack_trace
 
-RE_NORMALIZE_REPEATED_PARAMS_PERCENT = re.compile(r'%s(, %s)+')
 
+class _ProfilerBlock:
+    """ The data collected, and the level active, when a block of the context manager is the innermost block """
+    __slots__ = ('query_profiled_data_accumulator', 'query_profiler_level', 'sql_normalization',
+                 'query_sample_interval', 'query_count', 'parent_block', 'last_query_handle',
+                 'model_instantiation_start_times', 'model_instance_count', 'model_instantiation_time_in_nanos',
+                 'lazy_stack_capture', 'stack_trace_boundary_frame')
 
-class DataCollectorThreadLocalStorage(threading.local):
+    def __init__(self, query_profiler_level: QueryProfilerLevel, query_sample_interval: int,
+                 parent_block: Optional['_ProfilerBlock'], stack_trace_boundary_frame: Optional[FrameType]):
+        self.query_profiled_data_accumulator = QueryProfiledDataAccumulator()
+        if parent_block is None:
+            self.query_profiler_level: QueryProfilerLevel = query_profiler_level
+            self.query_sample_interval: int = query_sample_interval
+            self.stack_trace_boundary_frame: Optional[FrameType] = stack_trace_boundary_frame
+        else:
+            self.query_profiler_level: QueryProfilerLevel = parent_block.query_profiler_level + query_profiler_level
+            self.query_sample_interval: int = min(parent_block.query_sample_interval, query_sample_interval)
+            self.stack_trace_boundary_frame: Optional[FrameType] = (
+                parent_block.stack_trace_boundary_frame or stack_trace_boundary_frame)
+        self.sql_normalization: SqlNormalization = settings.DJANGO_QUERY_PROFILER_SQL_NORMALIZATION_FUNC(
+            self.query_profiler_level)
+        self.lazy_stack_capture: bool = settings.DJANGO_QUERY_PROFILER_LAZY_STACK_CAPTURE
+        self.query_count: int = 0  # Queries executed while this block is innermost, including the ones not profiled
+        self.parent_block: Optional[_ProfilerBlock] = parent_block
+        # The model instances built since the last query was profiled, which are not yet added to its statistics
+        self.last_query_handle: Optional[QueryHandle] = None
+        self.model_instantiation_start_times: List[int] = []  # A stack, since a model can build another model
+        self.model_instance_count: int = 0
+        self.model_instantiation_time_in_nanos: int = 0
+
+    def flush_model_instantiation_data(self) -> None:
+        if self.model_instance_count and self.last_query_handle is not None:
+            self.last_query_handle.add_model_instantiation_data(
+                self.model_instance_count, self.model_instantiation_time_in_nanos // 1000)
+        self.model_instance_count = 0
+        self.model_instantiation_time_in_nanos = 0
+
+    def resolve_lazy_query_signatures(self) -> None:
+        if not self.lazy_stack_capture:
+            return
+        start_time = perf_counter_ns()
+        query_profiled_data_accumulator = self.query_profiled_data_accumulator
+        query_profiled_data_accumulator.map_query_signatures(_query_signature)
+        if self.last_query_handle is not None:
+            self.last_query_handle = QueryHandle(
+                query_profiled_data_accumulator, _query_signature(self.last_query_handle.query_signature))
+        query_profiled_data_accumulator.profiler_phase_to_time_in_nanos[ProfilerPhase.STACK_WALK] += \
+            perf_counter_ns() - start_time
+
+
+class LazyQuerySignature(NamedTuple):
+    """
+    The key of the statistics of a query while the block is active, when DJANGO_QUERY_PROFILER_LAZY_STACK_CAPTURE is
+    on.  Raw stack traces are interned, hence hashing this does not hash the frames
+    """
+    query_without_params: str
+    raw_stack_trace: RawStackTrace
+    target_db: str
+
+    def query_signature(self) -> QuerySignature:
+        app_stack_trace, django_stack_trace = self.raw_stack_trace.stack_traces(
+            app_module_names_to_exclude=settings.DJANGO_QUERY_PROFILER_APP_MODULES_TO_EXCLUDE,
+            django_module_names_to_include=(django_base_model.__name__, ),
+            stack_trace_boundaries=settings.DJANGO_QUERY_PROFILER_STACK_TRACE_BOUNDARIES)
+        return QuerySignature.intern(
+            query_without_params=self.query_without_params,
+            app_stack_trace=app_stack_trace,
+            django_stack_trace=django_stack_trace,
+            target_db=self.target_db)
 
-    def __init__(self):
-        self._query_profiler_enabled: bool = False
-        self._query_profiled_data_list: List[QueryProfiledData] = []
-        self._entry_index_stack: List[int] = []
-        self._query_profiler_level_stack: List[QueryProfilerLevel] = []
-        self._current_query_profiler_level: Optional[QueryProfilerLevel] = None
+
+def _query_signature(query_signature: Union[QuerySignature, LazyQuerySignature]) -> QuerySignature:
+    return query_signature.query_signature() if query_signature.__class__ is LazyQuerySignature else query_signature
+
+
+class QueryHandle(NamedTuple):
+    """
+    Returned when a query is profiled, for adding the rows that are fetched from its cursor later (and the time spent
+    fetching them), and the model instances built from them, to the statistics of its query signature.
+
+    The rows can be fetched after the block of the query has exited, since an iterator over a queryset fetches a chunk
+    at a time.  If the block was nested, its data is in the accumulator of its parent by then, and the data is added
+    there - with the query signature that the lazy one was resolved to.  Once the outermost block exits, it is dropped
+    """
+    query_profiled_data_accumulator: QueryProfiledDataAccumulator
+    query_signature: Union[QuerySignature, LazyQuerySignature]
+
+    def add_fetch_data(self, fetched_row_count: int, fetch_time_in_micros: int) -> None:
+        query_profiled_data_accumulator, query_signature = self._live_accumulator_and_query_signature()
+        query_profiled_data_accumulator.add_fetch_statistics(query_signature, fetched_row_count, fetch_time_in_micros)
+
+    def add_model_instantiation_data(self, model_instance_count: int, model_instantiation_time_in_micros: int) -> None:
+        query_profiled_data_accumulator, query_signature = self._live_accumulator_and_query_signature()
+        query_profiled_data_accumulator.add_model_instantiation_statistics(
+            query_signature, model_instance_count, model_instantiation_time_in_micros)
+
+    def _live_accumulator_and_query_signature(self) \
+            -> Tuple[QueryProfiledDataAccumulator, Union[QuerySignature, LazyQuerySignature]]:
+        query_profiled_data_accumulator = self.query_profiled_data_accumulator
+        if not query_profiled_data_accumulator.is_frozen:
+            return query_profiled_data_accumulator, self.query_signature
+        while query_profiled_data_accumulator.is_frozen and query_profiled_data_accumulator.folded_into is not None:
+            query_profiled_data_accumulator = query_profiled_data_accumulator.folded_into
+        return query_profiled_data_accumulator, _query_signature(self.query_signature)
+
+
+class DataCollectorStorage:
+    """
+    The storage of the blocks, and the functions to enter & exit a block and to add the data of a query.  Sub-classes
+    define where the innermost block is kept, in the "_innermost_block" attribute
+    """
+    _innermost_block: Optional[_ProfilerBlock]
 
     def reset(self) -> None:
-        self.__init__()
+        self._innermost_block = None
 
-    def __str__(self):
-        return f'_query_profiler_enabled={self._query_profiler_enabled}, ' \
-            f'query_profiled_data_list={self._query_profiled_data_list}, _entry_index_stack={self._entry_index_stack}'
+    @property
+    def query_profiler_enabled(self) -> bool:
+        return self._innermost_block is not None
 
-    def enter_profiler_mode(self, query_profiler_level: QueryProfilerLevel) -> None:
-        self._query_profiler_enabled = True
+    @property
+    def _current_query_profiler_level(self) -> Optional[QueryProfilerLevel]:
+        return self._innermost_block.query_profiler_level if self._innermost_block else None
 
-        # Put index to use in stack
-        current_active_index = len(self._query_profiled_data_list)
-        self._entry_index_stack.append(current_active_index)
+    @property
+    def _nesting_depth(self) -> int:
+        nesting_depth = 0
+        block = self._innermost_block
+        while block is not None:
+            nesting_depth += 1
+            block = block.parent_block
+        return nesting_depth
 
-        # Activate a new index in the list, by appending.  Use empty container object here
-        empty_query_profiled_data: QueryProfiledData = QueryProfiledData()
-        self._query_profiled_data_list.append(empty_query_profiled_data)
+    def __str__(self):
+        return f'query_profiler_enabled={self.query_profiler_enabled}, _nesting_depth={self._nesting_depth}, ' \
+            f'_current_query_profiler_level={self._current_query_profiler_level}'
 
-        # Append the passed query_profiler_level to the stack that maintains
-        self._query_profiler_level_stack.append(query_profiler_level)
-        self._current_query_profiler_level = sum(self._query_profiler_level_stack)
+    def enter_profiler_mode(self, query_profiler_level: QueryProfilerLevel, query_sample_interval: int = 1,
+                            stack_trace_boundary_frame: Optional[FrameType] = None) -> None:
+        """
+        stack_trace_boundary_frame: The stack trace of a query stops at this frame, if it is in its stack.  A nested
+            block keeps the frame of its outermost block, so that the stack traces don't depend on the nesting
+        """
+        if query_sample_interval < 1:
+            raise Exception(f'query_sample_interval must be a positive integer, got {query_sample_interval}')
+        self._innermost_block = _ProfilerBlock(
+            query_profiler_level, query_sample_interval=query_sample_interval, parent_block=self._innermost_block,
+            stack_trace_boundary_frame=stack_trace_boundary_frame)
 
     def exit_profiler_mode(self) -> QueryProfiledData:
-        if not self._entry_index_stack:
+        exiting_block = self._innermost_block
+        if exiting_block is None:
             raise Exception(f'Looks like exit profiler is called before enter was called. {str(self)}')
 
-        last_enter_index = self._entry_index_stack.pop()
-        combined_query_profiler_data = sum(self._query_profiled_data_list[last_enter_index:])
+        exiting_block.flush_model_instantiation_data()
+        exiting_block.resolve_lazy_query_signatures()
+        query_profiled_data = exiting_block.query_profiled_data_accumulator.freeze()
 
-        if self._entry_index_stack:
-            self._query_profiler_level_stack.pop()
-            self._current_query_profiler_level = sum(self._query_profiler_level_stack)
-        else:
-            # If it is the last exit, reset everything
-            self.reset()
-        return combined_query_profiler_data
+        # Fold the data of this block into its parent, which becomes the innermost block now
+        parent_block = exiting_block.parent_block
+        if parent_block is not None:
+            parent_block.query_profiled_data_accumulator.add_query_profiled_data(query_profiled_data)
+            exiting_block.query_profiled_data_accumulator.folded_into = parent_block.query_profiled_data_accumulator
+            if exiting_block.last_query_handle is not None:  # Its query signature is in the parent block now
+                parent_block.flush_model_instantiation_data()
+                parent_block.last_query_handle = QueryHandle(
+                    parent_block.query_profiled_data_accumulator, exiting_block.last_query_handle.query_signature)
+        self._innermost_block = parent_block
+        return query_profiled_data
 
     def add_query_profiler_data(self, query_without_params: str, params: Union[list, str, None], target_db: str,
-                                query_execution_time_in_micros: int, db_row_count: Optional[int]) -> None:
-        """ This function adds to the bucket in the last index of the list, if the profiler is on """
+                                query_execution_time_in_micros: int, db_row_count: Optional[int],
+                                is_executemany: bool = False) -> Optional[QueryHandle]:
+        """
+        This function adds to the bucket of the innermost block, if the profiler is on.  Returns the handle for adding
+        the fetched rows, if the query was profiled.  For executemany, params is the list of parameter sets
+        """
 
-        if not self._query_profiler_enabled:
-            return
+        innermost_block = self._innermost_block
+        if innermost_block is None:
+            return None
+
+        if innermost_block.model_instance_count:
+            innermost_block.flush_model_instantiation_data()
+        query_count = innermost_block.query_count
+        innermost_block.query_count += 1
+        if query_count % innermost_block.query_sample_interval:
+            innermost_block.query_profiled_data_accumulator.skipped_query_count += 1
+            innermost_block.last_query_handle = None
+            return None
 
-        start_time = time()
-        if self._current_query_profiler_level.normalize_sql and params:
-            sql_normalized = re.sub(RE_NORMALIZE_REPEATED_PARAMS_PERCENT, '%s', query_without_params)
+        start_time = perf_counter_ns()
+        sql_normalization = innermost_block.sql_normalization
+        if params or sql_normalization is SqlNormalization.FINGERPRINT:  # Without params, only literals can be there
+            sql_normalized = normalize_sql(query_without_params, sql_normalization)
         else:
             sql_normalized = query_without_params
+        normalization_end_time = perf_counter_ns()
+
+        if innermost_block.lazy_stack_capture:
+            raw_stack_trace = capture_raw_stack_trace(
+                max_depth=innermost_block.query_profiler_level.stack_trace_depth,
+                boundary_frame=innermost_block.stack_trace_boundary_frame)
+        else:
+            app_stack_trace, django_stack_trace = find_stack_trace(
+                    app_module_names_to_exclude=settings.DJANGO_QUERY_PROFILER_APP_MODULES_TO_EXCLUDE,
+                    django_module_names_to_include=(django_base_model.__name__, ),
+                    max_depth=innermost_block.query_profiler_level.stack_trace_depth,
+                    stack_trace_boundaries=settings.DJANGO_QUERY_PROFILER_STACK_TRACE_BOUNDARIES,
+                    boundary_frame=innermost_block.stack_trace_boundary_frame)
+        stack_walk_end_time = perf_counter_ns()
 
-        app_stack_trace, django_stack_trace = find_stack_trace(
-                app_module_names_to_exclude=settings.DJANGO_QUERY_PROFILER_APP_MODULES_TO_EXCLUDE,
-                django_module_names_to_include=(django_base_model.__name__, ),
-                max_depth=self._current_query_profiler_level.stack_trace_depth)
+        query_params_db_key_hash = query_params_db_hash(query_without_params, params, target_db)
+        hashing_end_time = perf_counter_ns()
 
-        # New query_signature & query_signature_statistics instances
-        query_signature = QuerySignature(
-            query_without_params=sql_normalized,
-            app_stack_trace=app_stack_trace,
-            django_stack_trace=django_stack_trace,
-            target_db=target_db)
-        query_signature_statistics = QuerySignatureStatistics(
-            frequency=1,  # Number of sql calls would be 1, when we entered this block
+        # The canonical query_signature (or the lazy one)
+        if innermost_block.lazy_stack_capture:
+            query_signature = LazyQuerySignature(sql_normalized, raw_stack_trace, target_db)
+        else:
+            query_signature = QuerySignature.intern(
+                query_without_params=sql_normalized,
+                app_stack_trace=app_stack_trace,
+                django_stack_trace=django_stack_trace,
+                target_db=target_db)
+
+        # Update the statistics of the query signature, in the active container, in place
+        query_profiled_data_accumulator: QueryProfiledDataAccumulator = innermost_block.query_profiled_data_accumulator
+        query_profiled_data_accumulator.add_query(
+            query_signature=query_signature,
+            query_params_db_hash=query_params_db_key_hash,
             query_execution_time_in_micros=query_execution_time_in_micros,
-            db_row_count=db_row_count)
+            db_row_count=db_row_count,
+            query=query_without_params,
+            params=params,
+            is_executemany=is_executemany)
+
+        profiler_phase_to_time_in_nanos = query_profiled_data_accumulator.profiler_phase_to_time_in_nanos
+        profiler_phase_to_time_in_nanos[ProfilerPhase.NORMALIZATION] += normalization_end_time - start_time
+        profiler_phase_to_time_in_nanos[ProfilerPhase.STACK_WALK] += stack_walk_end_time - normalization_end_time
+        profiler_phase_to_time_in_nanos[ProfilerPhase.HASHING] += hashing_end_time - stack_walk_end_time
+        profiler_phase_to_time_in_nanos[ProfilerPhase.MERGE] += perf_counter_ns() - hashing_end_time
+        query_handle = QueryHandle(query_profiled_data_accumulator, query_signature)
+        innermost_block.last_query_handle = query_handle
+        return query_handle
+
+    def rows_fetched(self, query_handle: QueryHandle) -> None:
+        """
+        Called when rows are fetched from the cursor of a profiled query.  The model instances built from now on are
+        built from these rows, even if another query was profiled after this one - like a query in the loop over an
+        iterator of a queryset, which fetches the rows of its query a chunk at a time
+        """
+        innermost_block = self._innermost_block
+        if innermost_block is None or innermost_block.last_query_handle is query_handle or \
+                query_handle.query_profiled_data_accumulator is not innermost_block.query_profiled_data_accumulator:
+            return
+        if innermost_block.model_instance_count:
+            innermost_block.flush_model_instantiation_data()
+        innermost_block.last_query_handle = query_handle
+
+    def add_database_operation_data(self, database_operation: DatabaseOperation, time_in_micros: int) -> None:
+        """ Connecting, committing etc. are rare compared to the queries, hence they are never sampled out """
+        innermost_block = self._innermost_block
+        if innermost_block is not None:
+            innermost_block.query_profiled_data_accumulator.add_database_operation(database_operation, time_in_micros)
 
-        query_params_db_key = (query_without_params, params or '', target_db)
-        query_params_db_key_hash = hexlify(mmh3.hash_bytes(str(query_params_db_key)))
+    def model_instantiation_started(self) -> None:
+        """ Called before a model instance is built, only when DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION is on """
+        innermost_block = self._innermost_block
+        if innermost_block is not None:
+            innermost_block.model_instantiation_start_times.append(perf_counter_ns())
+
+    def model_instantiation_finished(self, is_instance_built: bool = True) -> None:
+        """
+        Called after a model instance is built, or failed to be built (is_instance_built is False then), so that the
+        stack of start times is always emptied.  Every instance built is counted, but the time is added only for the
+        outermost one, as the time of the instances it built is already a part of it
+        """
+        innermost_block = self._innermost_block
+        if innermost_block is None or not innermost_block.model_instantiation_start_times:
+            return
+        model_instantiation_start_times = innermost_block.model_instantiation_start_times
+        start_time = model_instantiation_start_times.pop()
+        if is_instance_built:
+            innermost_block.model_instance_count += 1
+        if not model_instantiation_start_times:
+            innermost_block.model_instantiation_time_in_nanos += perf_counter_ns() - start_time
+
+
+def query_params_db_hash(query_without_params: str, params: Any, target_db: str) -> int:
+    """
+    The key for finding exact duplicate queries.  Python's hash of a tuple hashes every item in C, and the hash of the
+    sql string is cached in the string itself - so there is no need to build a repr of the params, which was the bulk
+    of the time for executemany & big "IN (...)" queries.
+
+    The hash is randomized per process, which is fine since the duplicate counter is never shared across processes.
+    Params can be unhashable (a list inside the params for executemany or for array columns), which we retry after
+    converting them, and as a last resort we hash their repr
+    """
+    if isinstance(params, (list, tuple)):
+        hashable_params = tuple(params)
+    elif isinstance(params, dict):
+        hashable_params = tuple(params.items())
+    else:
+        hashable_params = params or ()
+
+    try:
+        return hash((query_without_params, hashable_params, target_db))
+    except TypeError:
+        pass
+    try:
+        return hash((query_without_params, _hashable(hashable_params), target_db))
+    except TypeError:
+        return hash((query_without_params, repr(params), target_db))
+
+
+def _hashable(value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple((key, _hashable(item)) for key, item in value.items())
+    return value
+
+
+class DataCollectorContextVarStorage(DataCollectorStorage):
+    """ Keeps the innermost block in a context variable, which works for both sync and async code """
+
+    def __init__(self):
+        self._innermost_block_context_var: contextvars.ContextVar[Optional[_ProfilerBlock]] = contextvars.ContextVar(
+            'django_query_profiler_innermost_block', default=None)
 
-        new_query_profiled_data = QueryProfiledData(
-            query_signature_to_query_signature_statistics={query_signature: query_signature_statistics},
-            _query_params_db_hash_counter=Counter({query_params_db_key_hash: 1}),
-            time_spent_profiling_in_micros=int((time() - start_time) * 1000 * 1000))
+    @property
+    def _innermost_block(self) -> Optional[_ProfilerBlock]:
+        return self._innermost_block_context_var.get()
 
-        # Add to existing data and set it back
-        existing_query_profiled_data: QueryProfiledData = self._query_profiled_data_list[-1]
-        combined_query_profiled_data: QueryProfiledData = existing_query_profiled_data + new_query_profiled_data
-        self._query_profiled_data_list[-1] = combined_query_profiled_data
+    @_innermost_block.setter
+    def _innermost_block(self, innermost_block: Optional[_ProfilerBlock]) -> None:
+        self._innermost_block_context_var.set(innermost_block)
 
 
 #######################################################################################################################
 # The public instance.  Using the fact that module level instances are singleton
 #######################################################################################################################
-data_collector_thread_local_storage = DataCollectorThreadLocalStorage()
+data_collector_storage = DataCollectorContextVarStorage()
+# Deprecated, use data_collector_storage.  Kept for backward compatibility, since it was the name of the public instance
+# when the innermost block was kept in a thread-local
+data_collector_thread_local_storage = data_collector_storage
@@ -7,13 +7,14 @@ We rely on stack-traces & query to see if we are able to predict what code chang
 to convert a N+1 query signature to a non N+1 one OR if its not possible at all
 """
 
-from typing import Callable, Dict, Tuple
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Tuple
 
 from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
 from django.db.models.query import QuerySet
-from mo_sql_parsing import parse
 
-from . import QuerySignature, QuerySignatureAnalyzeResult, SqlStatement, StackTraceElement
+from . import SQL_CACHE_MAX_SIZE, QuerySignature, QuerySignatureAnalyzeResult, SqlStatement, StackTraceElement
 
 
 def stack_trace_element(func: Callable) -> StackTraceElement:
@@ -40,12 +41,21 @@ FILTER_STACK_TRACE_ELEMENTS = {
 
 
 def code_recommendation(query_signature: QuerySignature) -> QuerySignatureAnalyzeResult:
+    """
+    The recommendation depends only on the sql & the django stack trace, which are the same for the query signatures of
+    many requests (that differ only in the app stack trace, or are of another request) - hence it is cached for the
+    process, and the sql of a query signature is parsed once
+    """
+    return _code_recommendation(
+        query_signature.query_without_params, query_signature.django_stack_trace, query_signature.is_fake)
+
 
-    query_without_params = query_signature.query_without_params
-    django_stack_trace = query_signature.django_stack_trace
+@lru_cache(maxsize=SQL_CACHE_MAX_SIZE)
+def _code_recommendation(query_without_params: str, django_stack_trace: Tuple[StackTraceElement],
+                         is_fake: bool) -> QuerySignatureAnalyzeResult:
     sql_statement: SqlStatement = SqlStatement.from_sql(query_without_params)
 
-    if sql_statement != SqlStatement.SELECT or query_signature.is_fake:
+    if sql_statement != SqlStatement.SELECT or is_fake:
         return QuerySignatureAnalyzeResult.UNKNOWN
 
     if PREFETCHED_RELATED_STACK_TRACE_ELEMENT in django_stack_trace:
@@ -75,7 +85,7 @@ def code_recommendation(query_signature: QuerySignature) -> QuerySignatureAnalyz
         if where_clause_exists and FILTER_STACK_TRACE_ELEMENTS.intersection(django_stack_trace):
             return QuerySignatureAnalyzeResult.FILTER
     except Exception:
-        # Don't want to throw exception in case moz parser is not able to parse the sql;  See Issue#21 & Issue#23
+        # Don't want to throw exception in case the sql could not be parsed;  See Issue#21 & Issue#23
         pass
 
     return QuerySignatureAnalyzeResult.UNKNOWN
@@ -88,40 +98,147 @@ def _parse_sql_for_tables_and_eq(query_without_params: str) -> Tuple[list, bool,
     2. Does where clause exists
     3. table_name.column_name used in the where equality clause.  Only when equality is the ONLY clause
 
-    NB:  1. This code looks ugly because the underlying library that we are using to parse returns a tree like structure
-            and there was no easy way to fetch the information we wanted.
-         2. Django's latest version has introduced sqlparse library as a requirement for using django.   We can explore
-            that library in future, if that can make this code more readable
-         3. The library is trying to write sql parser for a generic case, but there are many types of sql that django
-            is never going to produce -- those are esoteric sql that probably only a human can write.
-            See the test cases: https://github.com/mozilla/moz-sql-parser/tree/dev/tests to get an idea
+    NB:  This is not a sql parser.  Django generates a small dialect of sql, and we only need the tables in its FROM
+         (and JOIN) clause and the column of its WHERE clause - hence the sql is split into tokens, and only the top
+         level FROM & WHERE clauses are looked at.  A general sql parser (moz-sql-parser) was used before, which was
+         slow for the big queries that the ORM generates, and could not parse many of them.
+         See the test cases, and benchmarks/benchmark_sql_parser.py
+    """
+    clause_to_tokens = _top_level_clause_to_tokens(_sql_tokens(query_without_params))
+    table_names = _table_names(clause_to_tokens.get('FROM', []))
+    where_clause_tokens = clause_to_tokens.get('WHERE', [])
+    return table_names, bool(where_clause_tokens), _where_equality_key(where_clause_tokens)
+
+
+class _SqlToken(NamedTuple):
+    kind: str  # One of the group names of RE_SQL_TOKEN
+    value: str  # Without the quotes, for quoted identifiers
+    keyword: str  # The upper case value of a word, and empty for the other kinds
+
+
+RE_SQL_TOKEN = re.compile(r"""
+    (?P<identifier>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+    |(?P<string>'(?:[^']|'')*')
+    |(?P<word>[^\W\d][\w$]*)
+    |(?P<number>\d+(?:\.\d*)?)
+    |(?P<param>%s|%\(\w+\)s|\?)
+    |(?P<operator><>|!=|<=|>=|\|\||::|\S)
+""", re.VERBOSE)
+
+# The clauses of a select, that end the clause before them.  The FROM & WHERE clauses are the only ones we look at
+CLAUSE_KEYWORDS = {'SELECT', 'FROM', 'WHERE', 'GROUP', 'HAVING', 'WINDOW', 'ORDER', 'LIMIT', 'OFFSET', 'FETCH', 'FOR'}
+COMPOUND_KEYWORDS = {'UNION', 'INTERSECT', 'EXCEPT'}  # Only the first select of a compound select is looked at
+
+
+def _sql_tokens(query_without_params: str) -> List[_SqlToken]:
+    tokens = []
+    for match in RE_SQL_TOKEN.finditer(query_without_params):
+        kind, value = match.lastgroup, match.group()
+        if kind == 'identifier':
+            quote = value[-1]
+            value = value[1:-1].replace(quote * 2, quote)
+        tokens.append(_SqlToken(kind, value, value.upper() if kind == 'word' else ''))
+    return tokens
+
+
+def _top_level_clause_to_tokens(tokens: List[_SqlToken]) -> Dict[str, List[_SqlToken]]:
+    """ The tokens of every clause of the select, excluding the keyword of the clause.  Sub-queries are skipped over """
+    clause_to_tokens: Dict[str, List[_SqlToken]] = {}
+    clause_tokens: List[_SqlToken] = []
+    depth = 0
+    for token in tokens:
+        if token.kind == 'operator':
+            if token.value == '(':
+                depth += 1
+            elif token.value == ')':
+                depth -= 1
+                if depth < 0:
+                    raise Exception('Unbalanced parentheses in the sql')
+        elif depth == 0 and token.keyword:
+            if token.keyword in CLAUSE_KEYWORDS:
+                clause_tokens = clause_to_tokens.setdefault(token.keyword, [])
+                continue
+            if token.keyword in COMPOUND_KEYWORDS:
+                break
+        clause_tokens.append(token)
+    if depth:
+        raise Exception('Unbalanced parentheses in the sql')
+    return clause_to_tokens
+
+
+def _table_names(from_clause_tokens: List[_SqlToken]) -> List[str]:
+    """
+    The table after the FROM, after every comma and after every JOIN - like "t1", "t2" & "t3" in:
+        FROM t1 AS a, t2 INNER JOIN t3 ON (t2.id = t3.t2_id)
     """
-    query_with_fake_params = query_without_params.replace('%s', '1')
-    parsed_sql: Dict = parse(query_with_fake_params)
-
-    # Table Names
     table_names = []
-    from_clause = parsed_sql.get('from', None)
-    if from_clause:
-        if isinstance(from_clause, str):  # SELECT * FROM test1
-            table_names.append(from_clause)
-        elif isinstance(from_clause, list):
-            for from_clause_part in from_clause:
-                if isinstance(from_clause_part, str):  # SELECT * FROM test2, test1
-                    table_names.append(from_clause_part)
-                elif isinstance(from_clause_part, dict):
-                    if 'value' in from_clause_part:  # # SELECT A.f1, B.f1 FROM test1 as A, test1 as B
-                        table_names.append(from_clause_part['value'])
-                    elif any(key for key in from_clause_part.keys() if 'join' in key):
-                        # select a.* from a INNER JOIN b USING (id)
-                        table_names.extend(value for key, value in from_clause_part.items() if 'join' in key)
-
-    # Where clause
-    where_clause: Dict = parsed_sql.get('where', None)
-    where_equality_key = ''
-    if where_clause and len(where_clause) == 1:
-        eq_clause = where_clause.get('eq', None)
-        if eq_clause and isinstance(eq_clause, list):
-            where_equality_key = eq_clause[0]
-
-    return table_names, bool(where_clause), where_equality_key
+    is_table_name_expected = True
+    depth = 0
+    index = 0
+    while index < len(from_clause_tokens):
+        token = from_clause_tokens[index]
+        index += 1
+        if token.kind == 'operator' and token.value in '()':
+            if is_table_name_expected and depth == 0:  # A sub-query, which is not a table
+                is_table_name_expected = False
+            depth += 1 if token.value == '(' else -1
+        elif depth:
+            continue
+        elif token.keyword == 'JOIN' or token.value == ',' and token.kind == 'operator':
+            is_table_name_expected = True
+        elif is_table_name_expected and token.kind in ('word', 'identifier'):
+            table_name_parts = [token.value]
+            while index + 1 < len(from_clause_tokens) and from_clause_tokens[index].value == '.':
+                table_name_parts.append(from_clause_tokens[index + 1].value)
+                index += 2
+            table_names.append('.'.join(table_name_parts))
+            is_table_name_expected = False
+    return table_names
+
+
+def _where_equality_key(where_clause_tokens: List[_SqlToken]) -> str:
+    """ The column in "WHERE column = %s", if that is the only condition - in "table_name.column_name" form """
+    while where_clause_tokens and _is_enclosed_in_parentheses(where_clause_tokens):
+        where_clause_tokens = where_clause_tokens[1:-1]
+
+    depth = 0
+    equality_index = None
+    for index, token in enumerate(where_clause_tokens):
+        if token.kind == 'operator' and token.value in '()':
+            depth += 1 if token.value == '(' else -1
+        elif depth:
+            continue
+        elif token.keyword in ('AND', 'OR', 'NOT'):
+            return ''
+        elif token.kind == 'operator' and token.value == '=' and equality_index is None:
+            equality_index = index
+
+    if not equality_index or equality_index % 2 == 0:  # A column is "name" or "name.name" ...
+        return ''
+    column_tokens = where_clause_tokens[:equality_index]
+    if any(token.kind not in ('word', 'identifier') for token in column_tokens[::2]) or \
+            any(token.value != '.' for token in column_tokens[1::2]):
+        return ''
+    return '.'.join(token.value for token in column_tokens[::2])
+
+
+def _is_enclosed_in_parentheses(tokens: List[_SqlToken]) -> bool:
+    """ True for "(a = 1)", and false for "(a = 1) AND (b = 2)" """
+    if tokens[0].kind != 'operator' or tokens[0].value != '(' or tokens[-1].value != ')':
+        return False
+    depth = 0
+    for token in tokens[:-1]:
+        if token.kind == 'operator' and token.value in '()':
+            depth += 1 if token.value == '(' else -1
+            if depth == 0:
+                return False
+    return True
+
+
+def cache_info() -> Dict[str, int]:
+    """ The hits, misses and size of the cache of the code recommendations """
+    return _code_recommendation.cache_info()._asdict()
+
+
+def cache_clear() -> None:
+    _code_recommendation.cache_clear()
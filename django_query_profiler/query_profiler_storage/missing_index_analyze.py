@@ -0,0 +1,217 @@
+"""
+This module finds the indexes that are missing for the queries in the profiled data.  It parses the columns that the
+queries filter on (equality, range, join) and sort by, and checks them against the indexes of the models - from the
+db_index / unique of the fields, and the indexes, unique_together & unique constraints in their Meta.
+
+Like the code recommendation in django_stack_trace_analyze, this is a guess - it does not know the size of the tables
+or the selectivity of the columns.  Hence only the query signatures that run many times, or are slow, are considered,
+and the recommendations are ranked by the time spent in the queries that would use the index
+"""
+
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple, Type
+
+from django.apps import apps
+from django.db import models
+from mo_sql_parsing import parse
+
+from . import SQL_CACHE_MAX_SIZE, IndexRecommendation, QuerySignature, QuerySignatureStatistics, SqlStatement
+
+# A query signature that runs just once is considered only if its slowest execution is at least this slow
+MIN_QUERY_EXECUTION_TIME_IN_MICROS: int = 1000
+
+EQUALITY_OPERATORS: FrozenSet[str] = frozenset({'eq', 'in'})
+RANGE_OPERATORS: FrozenSet[str] = frozenset({'gt', 'gte', 'lt', 'lte', 'between', 'like'})
+
+
+class TableColumns(NamedTuple):
+    """ The columns of a table used by a query, in the order they are found in the query """
+    equality_columns: Tuple[str, ...]
+    range_columns: Tuple[str, ...]
+    order_by_columns: Tuple[str, ...]
+
+
+def index_recommendations(
+        query_signature_to_query_signature_statistics: Dict[QuerySignature, QuerySignatureStatistics],
+) -> List[IndexRecommendation]:
+    table_name_to_model = {model._meta.db_table: model for model in apps.get_models(include_auto_created=True)}
+    recommended_index_to_statistics: Dict[Tuple[str, Tuple[str, ...]], List[int]] = defaultdict(lambda: [0, 0])
+    for query_signature, query_signature_statistics in query_signature_to_query_signature_statistics.items():
+        is_slow = ((query_signature_statistics.max_query_execution_time_in_micros or 0) >=
+                   MIN_QUERY_EXECUTION_TIME_IN_MICROS)
+        if query_signature_statistics.frequency < 2 and not is_slow:
+            continue
+        if SqlStatement.from_sql(query_signature.query_without_params) != SqlStatement.SELECT:
+            continue
+
+        for table_name, table_columns in _parse_sql_for_table_columns(query_signature.query_without_params).items():
+            model = table_name_to_model.get(table_name)
+            if model is None:
+                continue
+            column_names = _recommended_column_names(table_columns)
+            if column_names and not _is_indexed(column_names, len(table_columns.equality_columns), model):
+                statistics = recommended_index_to_statistics[(table_name, column_names)]
+                statistics[0] += query_signature_statistics.frequency
+                statistics[1] += query_signature_statistics.query_execution_time_in_micros
+
+    recommendations = []
+    for (table_name, column_names), (frequency, query_execution_time_in_micros) in \
+            recommended_index_to_statistics.items():
+        model = table_name_to_model[table_name]
+        column_name_to_field_name = {field.column: field.name for field in model._meta.concrete_fields}
+        recommendations.append(IndexRecommendation(
+            model_label=model._meta.label,
+            table_name=table_name,
+            field_names=tuple(column_name_to_field_name.get(column_name, column_name) for column_name in column_names),
+            column_names=column_names,
+            frequency=frequency,
+            query_execution_time_in_micros=query_execution_time_in_micros))
+    recommendations.sort(key=lambda recommendation: recommendation.query_execution_time_in_micros, reverse=True)
+    return recommendations
+
+
+def _recommended_column_names(table_columns: TableColumns) -> Tuple[str, ...]:
+    """
+    Equality columns first, since any order of them can be used by the index.  They can be followed by one range
+    column, or else by the order by columns - an index can't be used for sorting after a range
+    """
+    if table_columns.range_columns:
+        return table_columns.equality_columns + table_columns.range_columns[:1]
+    return table_columns.equality_columns + tuple(
+        column for column in table_columns.order_by_columns if column not in table_columns.equality_columns)
+
+
+def _is_indexed(column_names: Tuple[str, ...], equality_column_count: int, model: Type[models.Model]) -> bool:
+    equality_column_names = frozenset(column_names[:equality_column_count])
+    for index_column_names, is_unique in _index_column_names_of_model(model):
+        if is_unique and equality_column_names.issuperset(index_column_names):
+            return True  # The equality filter finds at most one row
+        if (frozenset(index_column_names[:equality_column_count]) == equality_column_names and
+                index_column_names[equality_column_count:len(column_names)] == column_names[equality_column_count:]):
+            return True
+    return False
+
+
+def _index_column_names_of_model(model: Type[models.Model]) -> Iterable[Tuple[Tuple[str, ...], bool]]:
+    """ Yields the columns of every index of the model, and if the index is unique """
+    opts = model._meta
+    field_name_to_column_name = {field.name: field.column for field in opts.concrete_fields}
+
+    def column_names(field_names: Iterable[str]) -> Tuple[str, ...]:
+        return tuple(field_name_to_column_name.get(field_name.lstrip('-'), field_name) for field_name in field_names)
+
+    for field in opts.concrete_fields:
+        if field.primary_key or field.unique:
+            yield (field.column,), True
+        elif field.db_index:
+            yield (field.column,), False
+    for field_names in opts.unique_together:
+        yield column_names(field_names), True
+    for field_names in getattr(opts, 'index_together', ()):  # Removed in django 5.1
+        yield column_names(field_names), False
+    for index in opts.indexes:
+        if index.fields:
+            yield column_names(index.fields), False
+    for constraint in opts.constraints:
+        if isinstance(constraint, models.UniqueConstraint) and constraint.fields and constraint.condition is None:
+            yield column_names(constraint.fields), True
+
+
+@lru_cache(maxsize=SQL_CACHE_MAX_SIZE)
+def _parse_sql_for_table_columns(query_without_params: str) -> Dict[str, TableColumns]:
+    """
+    Cached, since parsing is slow and the same sql comes up again for every request.  Returns no tables if the sql can't
+    be parsed, for the same reason as the code recommendation - see Issue#21 & Issue#23
+    """
+    query_with_fake_params = query_without_params.replace('%s', '1').replace('?', '1')
+    try:
+        parsed_sql = parse(query_with_fake_params)
+    except Exception:
+        return {}
+
+    collector = _ColumnCollector()
+    collector.collect_select(parsed_sql)
+    return {
+        table_name: TableColumns(
+            equality_columns=tuple(dict.fromkeys(collector.table_name_to_equality_columns[table_name])),
+            range_columns=tuple(dict.fromkeys(collector.table_name_to_range_columns[table_name])),
+            order_by_columns=tuple(dict.fromkeys(collector.table_name_to_order_by_columns[table_name])))
+        for table_name in collector.table_names}
+
+
+class _ColumnCollector:
+    """ Walks the tree returned by mo_sql_parsing, including the sub-queries, and collects the columns by table """
+
+    def __init__(self):
+        self.table_names: List[str] = []
+        self.alias_to_table_name: Dict[str, str] = {}
+        self.table_name_to_equality_columns: Dict[str, List[str]] = defaultdict(list)
+        self.table_name_to_range_columns: Dict[str, List[str]] = defaultdict(list)
+        self.table_name_to_order_by_columns: Dict[str, List[str]] = defaultdict(list)
+
+    def collect_select(self, parsed_sql: Dict) -> None:
+        from_clause = parsed_sql.get('from')
+        join_conditions = []
+        for from_clause_part in (from_clause if isinstance(from_clause, list) else [from_clause]):
+            if isinstance(from_clause_part, dict):
+                join_keys = [key for key in from_clause_part if 'join' in key]
+                if join_keys:
+                    self._add_table(from_clause_part[join_keys[0]])
+                    join_conditions.append(from_clause_part.get('on'))
+                    continue
+            self._add_table(from_clause_part)
+
+        for join_condition in join_conditions:
+            self._collect_condition(join_condition)
+        self._collect_condition(parsed_sql.get('where'))
+
+        order_by = parsed_sql.get('orderby')
+        for order_by_part in (order_by if isinstance(order_by, list) else [order_by]):
+            if isinstance(order_by_part, dict):
+                self._add_column(order_by_part.get('value'), self.table_name_to_order_by_columns)
+
+    def _add_table(self, from_clause_part) -> None:
+        if isinstance(from_clause_part, str):
+            self.table_names.append(from_clause_part)
+        elif isinstance(from_clause_part, dict) and isinstance(from_clause_part.get('value'), str):
+            self.table_names.append(from_clause_part['value'])
+            if 'name' in from_clause_part:
+                self.alias_to_table_name[from_clause_part['name']] = from_clause_part['value']
+        elif isinstance(from_clause_part, dict) and isinstance(from_clause_part.get('value'), dict):
+            self.collect_select(from_clause_part['value'])  # A sub-query in the from clause
+
+    def _collect_condition(self, condition) -> None:
+        if isinstance(condition, str):  # A boolean column, like WHERE "toppings"."is_spicy"
+            self._add_column(condition, self.table_name_to_equality_columns)
+            return
+        if not isinstance(condition, dict) or len(condition) != 1:
+            return  # A condition we don't look into
+        (operator, operands), = condition.items()
+        if operator == 'not' and isinstance(operands, str):
+            self._add_column(operands, self.table_name_to_equality_columns)
+        elif operator == 'and':
+            for operand in operands:
+                self._collect_condition(operand)
+        elif operator in EQUALITY_OPERATORS and isinstance(operands, list) and operands:
+            if operator == 'eq' and len(operands) == 2 and all(isinstance(operand, str) for operand in operands):
+                for operand in operands:  # A join condition, both the columns would be looked up by equality
+                    self._add_column(operand, self.table_name_to_equality_columns)
+            else:
+                self._add_column(operands[0], self.table_name_to_equality_columns)
+            for operand in operands[1:]:
+                if isinstance(operand, dict) and 'select' in operand:
+                    self.collect_select(operand)
+        elif operator in RANGE_OPERATORS and isinstance(operands, list) and operands:
+            self._add_column(operands[0], self.table_name_to_range_columns)
+
+    def _add_column(self, column, table_name_to_columns: Dict[str, List[str]]) -> None:
+        table_name = self._table_name(column)
+        if table_name is not None:
+            table_name_to_columns[table_name].append(column.rsplit('.', 1)[1])
+
+    def _table_name(self, column) -> Optional[str]:
+        if not isinstance(column, str) or '.' not in column:
+            return None
+        table_name_or_alias = column.rsplit('.', 1)[0]
+        return self.alias_to_table_name.get(table_name_or_alias, table_name_or_alias)
@@ -0,0 +1,90 @@
+"""
+This module normalizes the sql of a query, so that queries which are the same except for their params (or literals)
+are grouped in the same query signature.  There are two normalizations (see SqlNormalization enum):
+1. normalize_repeated_params:  Collapses runs of params, which is all that is needed for the queries generated by the
+    ORM, since their params are never inlined
+2. fingerprint:  Replaces literals & placeholders with "?", collapses lists of them (like IN lists, or the tuples of
+    VALUES), and removes comments & extra whitespace.  This groups the raw sql of .extra(), RawSQL, or sql written by
+    hand - and the sql of other placeholder styles, like the ":arg0" of oracle
+
+Django runs the same few hundred sql strings over and over, so the results are kept in process-wide LRU caches - and
+for most queries, we don't run any regex at all.  The caches are bounded in the number of sql strings they keep
+"""
+import re
+from functools import lru_cache
+from typing import Dict, Match
+
+from . import SQL_CACHE_MAX_SIZE, SqlNormalization, SqlStatement
+
+RE_NORMALIZE_REPEATED_PARAMS_PERCENT = re.compile(r'%s(, %s)+')
+
+"""
+The tokens of sql that the fingerprint cares about.  The tokens are matched in one pass, and in this order - which is
+what makes sure that a "--" in a string literal is not a comment, or that the digits in a quoted identifier are not a
+number.  Everything that is not matched (keywords, identifiers, operators) is kept as it is
+"""
+RE_FINGERPRINT_TOKEN = re.compile(r"""
+    (?P<string>'(?:[^']|'')*')
+    | (?P<quoted_identifier>"(?:[^"]|"")*"|`[^`]*`)
+    | (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<placeholder>%s|%\(\w+\)s|(?<!:):(?!:)\w+|\?|\$\d+)
+    | (?P<number>(?<![\w.$])(?:0x[0-9a-fA-F]+|\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)(?![\w.]))
+    | (?P<whitespace>\s+)
+""", re.VERBOSE | re.DOTALL)
+RE_LIST_OF_PLACEHOLDERS = re.compile(r'\( ?\?(?: ?, ?\?)* ?\)')
+RE_LIST_OF_TUPLES = re.compile(r'\(\?\)(?: ?, ?\(\?\))+')
+FINGERPRINT_TOKEN_REPLACEMENTS = {
+    'string': '?',
+    'comment': ' ',
+    'placeholder': '?',
+    'number': '?',
+    'whitespace': ' ',
+}
+
+
+def normalize_sql(query_without_params: str, sql_normalization: SqlNormalization) -> str:
+    if sql_normalization is SqlNormalization.FINGERPRINT:
+        return fingerprint(query_without_params)
+    if sql_normalization is SqlNormalization.COLLAPSE_REPEATED_PARAMS:
+        return normalize_repeated_params(query_without_params)
+    return query_without_params
+
+
+@lru_cache(maxsize=SQL_CACHE_MAX_SIZE)
+def normalize_repeated_params(query_without_params: str) -> str:
+    """ Collapses a run of params like "IN (%s, %s, %s)" into one, so that the number of params doesn't matter """
+    return RE_NORMALIZE_REPEATED_PARAMS_PERCENT.sub('%s', query_without_params)
+
+
+@lru_cache(maxsize=SQL_CACHE_MAX_SIZE)
+def fingerprint(query_without_params: str) -> str:
+    """
+    As an example, both of these:
+        SELECT * FROM "t" WHERE "a" = 'x' AND "id" IN (1, 2, 3) -- a comment
+        SELECT * FROM "t" WHERE "a" = %s AND "id" IN (%s)
+    have the same fingerprint:
+        SELECT * FROM "t" WHERE "a" = ? AND "id" IN (?)
+    """
+    tokens_replaced = RE_FINGERPRINT_TOKEN.sub(_replace_fingerprint_token, query_without_params)
+    lists_collapsed = RE_LIST_OF_TUPLES.sub('(?)', RE_LIST_OF_PLACEHOLDERS.sub('(?)', tokens_replaced))
+    return ' '.join(lists_collapsed.rstrip().rstrip(';').split())
+
+
+def _replace_fingerprint_token(match: Match) -> str:
+    return FINGERPRINT_TOKEN_REPLACEMENTS.get(match.lastgroup, match.group())
+
+
+def cache_info() -> Dict[str, Dict[str, int]]:
+    """ The hits, misses and size of the caches, by the name of the cached function """
+    cached_functions = {
+        'normalize_repeated_params': normalize_repeated_params,
+        'fingerprint': fingerprint,
+        'sql_statement_from_sql': SqlStatement.from_sql,
+    }
+    return {name: cached_function.cache_info()._asdict() for name, cached_function in cached_functions.items()}
+
+
+def cache_clear() -> None:
+    normalize_repeated_params.cache_clear()
+    fingerprint.cache_clear()
+    SqlStatement.from_sql.cache_clear()
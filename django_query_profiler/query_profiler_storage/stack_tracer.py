@@ -2,75 +2,179 @@
 This module contains one public function - for finding the stack_trace partitioned into a tuple of two items:
 1. app_stack_trace
 2. django_stack_trace
+
+And its lazy counterpart - capture_raw_stack_trace, which captures the stack as a RawStackTrace, from which the same
+tuple is found later
+
+The stack trace is found for every query, and walks up to 500 frames.  The frames are of the same few thousand functions
+in every request, hence how a frame is added to the stack trace is decided once per code object of the function (by
+matching its module name against a ModulePrefixTrie of the module names to include / exclude), and memoized.  For a
+frame of an excluded module, the walk just moves on to the next frame.  For a django frame the stack trace element is
+the same for every call, and for an app frame it is one per line number of the function
 """
 
-import inspect
-from collections import defaultdict
-from typing import Dict, List, Tuple
+import dis
+import sys
+import threading
+from functools import lru_cache
+from types import CodeType, FrameType
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from . import StackTraceElement, intern_stack_trace
+
+
+class ModulePrefixTrie:
+    """
+    Finds if a module name starts with any of the prefixes - the same as any(module_name.startswith(prefix) for prefix
+    in prefixes), in time proportional to the length of the module name, rather than to the number of prefixes.
+
+    The trie has a node per dotted component of the prefixes.  The last component of a prefix can match just the start
+    of a component of the module name (like "test" matches "tests.unit"), hence every node keeps the last components
+    that end there, and their lengths - so that a component of the module name is checked with one set lookup per
+    distinct length
+    """
+    __slots__ = ('_children', '_last_components', '_last_component_lengths')
+
+    def __init__(self, prefixes: Tuple[str, ...] = ()):
+        self._children: Dict[str, ModulePrefixTrie] = {}
+        self._last_components: Set[str] = set()
+        self._last_component_lengths: Tuple[int, ...] = ()
+        for prefix in prefixes:
+            self._add(prefix.split('.'))
+
+    def _add(self, components: List[str]) -> None:
+        node = self
+        for component in components[:-1]:
+            node = node._children.setdefault(component, ModulePrefixTrie())
+        node._last_components.add(components[-1])
+        node._last_component_lengths = tuple(sorted({len(component) for component in node._last_components}))
+
+    def matches(self, module_name: str) -> bool:
+        node = self
+        for component in module_name.split('.'):
+            if node._last_components:
+                last_components = node._last_components
+                for length in node._last_component_lengths:
+                    if length > len(component):
+                        break
+                    if component[:length] in last_components:
+                        return True
+            node = node._children.get(component)
+            if node is None:
+                return False
+        return False
+
+
+@lru_cache(maxsize=64)
+def module_prefix_trie(prefixes: Tuple[str, ...]) -> ModulePrefixTrie:
+    """ Built once for the tuple of prefixes, which comes from the settings """
+    return ModulePrefixTrie(prefixes)
+
+
+class _AppCodeDecision:
+    """ The stack trace elements of an app function, by line number (and by instruction offset for RawStackTrace) """
+    __slots__ = ('module_name', 'function_name', 'line_number_to_stack_trace_element',
+                 'instruction_offset_to_stack_trace_element')
+
+    def __init__(self, module_name: str, function_name: str):
+        self.module_name: str = module_name
+        self.function_name: str = function_name
+        self.line_number_to_stack_trace_element: Dict[int, StackTraceElement] = {}
+        self.instruction_offset_to_stack_trace_element: Dict[int, StackTraceElement] = {}
+
+    def stack_trace_element(self, line_number: int) -> StackTraceElement:
+        stack_trace_element = self.line_number_to_stack_trace_element.get(line_number)
+        if stack_trace_element is None:
+            stack_trace_element = self.line_number_to_stack_trace_element[line_number] = \
+                StackTraceElement.app_stacktrace_element(self.module_name, self.function_name, line_number)
+        return stack_trace_element
+
+    def stack_trace_element_at_offset(self, code: CodeType, instruction_offset: int) -> StackTraceElement:
+        stack_trace_element = self.instruction_offset_to_stack_trace_element.get(instruction_offset)
+        if stack_trace_element is None:
+            stack_trace_element = self.instruction_offset_to_stack_trace_element[instruction_offset] = \
+                self.stack_trace_element(_line_number_at_offset(code, instruction_offset))
+        return stack_trace_element
 
-from . import StackTraceElement
 
 '''
-These following are 2-D maps.  The first entry is for the app_module_names_to_exclude/django_module_names_to_include
-and the second key in the map is the moduleName.  True means that we should include it.  The reason for having a
-2-D matrix is to allow passing different variants of app_module_names_to_exclude, django_module_names_to_include
-list in the same run
+The decision for a code object is None for a frame that is excluded, the StackTraceElement for a django frame, an
+_AppCodeDecision for an app frame, and _STACK_TRACE_BOUNDARY for a frame where the walk stops.  The decisions are kept
+per thread, for the tuple (app_module_names_to_exclude, django_module_names_to_include, stack_trace_boundaries) - and
+so the threads of the server don't share a dict that they write to.  The memo of a thread is cleared when it has
+CODE_DECISION_MEMO_MAX_SIZE code objects, which bounds it if code is generated at runtime.
+
+The memo is keyed by the id of the code object, and not by the code object: code objects are hashed & compared by
+value (their file name is not a part of it), hence identical functions of two modules would share a decision - and
+hashing a code object hashes its constants.  The code object is kept in the value, so that its id is not reused while
+it is in the memo
 '''
-MEMO_DJANGO_MODULE_NAME_DECISION: Dict[Tuple[str], Dict[str, bool]] = defaultdict(dict)
-MEMO_APP_MODULE_NAME_DECISION: Dict[Tuple[str], Dict[str, bool]] = defaultdict(dict)
+CodeDecision = Union[None, StackTraceElement, _AppCodeDecision, object]
+CODE_DECISION_MEMO_MAX_SIZE = 16384
+_STACK_TRACE_BOUNDARY = object()
+
+
+class _ThreadLocalMemo(threading.local):
+    def __init__(self):
+        self.module_names_to_code_decision: Dict[Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]],
+                                                 Dict[int, Tuple[CodeType, CodeDecision]]] = {}
+        self.code_and_offsets_to_raw_stack_trace: Dict[Tuple[int, ...], RawStackTrace] = {}
+
+
+THREAD_LOCAL_MEMO = _ThreadLocalMemo()
+
+
+def code_decision_memo(app_module_names_to_exclude: Tuple[str, ...], django_module_names_to_include: Tuple[str, ...],
+                       stack_trace_boundaries: Tuple[str, ...] = ()) -> Dict[int, Tuple[CodeType, CodeDecision]]:
+    """ The memo of the current thread, which is cleared if it is full """
+    module_names_to_code_decision = THREAD_LOCAL_MEMO.module_names_to_code_decision
+    module_names = (app_module_names_to_exclude, django_module_names_to_include, stack_trace_boundaries)
+    code_to_decision = module_names_to_code_decision.get(module_names)
+    if code_to_decision is None:
+        code_to_decision = module_names_to_code_decision[module_names] = {}
+    elif len(code_to_decision) >= CODE_DECISION_MEMO_MAX_SIZE:
+        code_to_decision.clear()
+    return code_to_decision
 
 
 def find_stack_trace(app_module_names_to_exclude: Tuple[str], django_module_names_to_include: Tuple[str],
-                     max_depth: int) -> Tuple[Tuple[StackTraceElement], Tuple[StackTraceElement]]:
+                     max_depth: int, stack_trace_boundaries: Tuple[str, ...] = (),
+                     boundary_frame: Optional[FrameType] = None) \
+        -> Tuple[Tuple[StackTraceElement], Tuple[StackTraceElement]]:
     """
     This function finds the stack trace from the frame and returns a tuple of application & django stack-trace
     The exclusion and inclusion list should be mutually exclusive (they would be in practice), but if they are not -
-    the inclusion list takes precedence & it would be included in django_stack_trace
+    the inclusion list takes precedence & it would be included in django_stack_trace.
+
+    The walk stops at the first frame of a function in stack_trace_boundaries (see _code_decision), and at the
+    boundary_frame - the frame where the request entered the profiler.  Neither of them is in the stack trace
     """
     app_stack_trace: List[StackTraceElement] = []
     django_stack_trace: List[StackTraceElement] = []
     if max_depth <= 0:
         return tuple(app_stack_trace), tuple(django_stack_trace)
 
+    code_to_decision = code_decision_memo(
+        app_module_names_to_exclude, django_module_names_to_include, stack_trace_boundaries)
     current_iteration: int = 0
-    current_frame = inspect.currentframe()
+    current_frame = sys._getframe()
     try:
-        while current_iteration < max_depth and current_frame is not None:
-            module_name = _module_name_from_frame(current_frame)
-            '''
-            We would fist check if the stack_trace can be included in django stack trace because that list is the
-            include list.  If it can be included in django one, we would not add it to app stack_trace list
-            If not, we would check if it can be included in the app list based on the passed exclusion list
-            '''
-
-            # Checking django
-            is_django_stack_trace = MEMO_DJANGO_MODULE_NAME_DECISION[django_module_names_to_include].get(module_name)
-            if is_django_stack_trace is None:
-                is_django_stack_trace = any(module_name.startswith(app) for app in django_module_names_to_include)
-            MEMO_DJANGO_MODULE_NAME_DECISION[django_module_names_to_include][module_name] = is_django_stack_trace
-
-            # Checking app
-            if is_django_stack_trace:
-                is_app_stack_trace = False
-            else:
-                is_app_stack_trace = MEMO_APP_MODULE_NAME_DECISION[app_module_names_to_exclude].get(module_name)
-                if is_app_stack_trace is None:
-                    is_app_stack_trace = not (any(module_name.startswith(app) for app in app_module_names_to_exclude))
-            MEMO_APP_MODULE_NAME_DECISION[app_module_names_to_exclude][module_name] = is_app_stack_trace
-
-            if is_app_stack_trace or is_django_stack_trace:
-                function_name = _function_name_from_frame(current_frame)
-                if is_app_stack_trace:
-                    stack_trace = StackTraceElement.app_stacktrace_element(
-                        module_name=module_name,
-                        function_name=function_name,
-                        line_number=_line_number_from_frame(current_frame))
-                    app_stack_trace.append(stack_trace)
-                elif is_django_stack_trace:
-                    stack_trace = StackTraceElement.django_stacktrace_element(
-                        module_name=module_name,
-                        function_name=function_name)
-                    django_stack_trace.append(stack_trace)
+        while current_iteration < max_depth and current_frame is not None and current_frame is not boundary_frame:
+            code = current_frame.f_code
+            memoized = code_to_decision.get(id(code))
+            if memoized is None or memoized[0] is not code:
+                memoized = code_to_decision[id(code)] = (code, _code_decision(
+                    _module_name_from_frame(current_frame), code, app_module_names_to_exclude,
+                    django_module_names_to_include, stack_trace_boundaries))
+            code_decision = memoized[1]
+
+            if code_decision is not None:
+                if code_decision.__class__ is _AppCodeDecision:
+                    app_stack_trace.append(code_decision.stack_trace_element(current_frame.f_lineno))
+                elif code_decision is _STACK_TRACE_BOUNDARY:
+                    break
+                else:
+                    django_stack_trace.append(code_decision)
 
             current_frame = current_frame.f_back
             current_iteration += 1
@@ -79,13 +183,136 @@ def find_stack_trace(app_module_names_to_exclude: Tuple[str], django_module_name
     return tuple(app_stack_trace), tuple(django_stack_trace)
 
 
-def _module_name_from_frame(frame):
-    return frame.f_globals.get('__name__', '')
+class RawStackTrace:
+    """
+    The frames of a stack, as they are captured when DJANGO_QUERY_PROFILER_LAZY_STACK_CAPTURE is on - the code object
+    and the offset of the instruction being executed, for every frame.  Raw stack traces are interned, hence the same
+    stack captured again is the same instance, which is hashed & compared by identity.
+
+    The stack traces are found from it once, when they are asked for the first time (which is when the profiler block
+    exits), hence the work of classifying the frames is done once per distinct stack instead of once per query
+    """
+    __slots__ = ('code_and_offsets', 'module_names', '_stack_traces_module_names', '_stack_traces')
+
+    def __init__(self, code_and_offsets: Tuple, module_names: Tuple[str, ...]):
+        self.code_and_offsets: Tuple = code_and_offsets  # Flattened: code, offset, code, offset ...
+        self.module_names: Tuple[str, ...] = module_names
+        self._stack_traces_module_names: Optional[Tuple[Tuple[str, ...], ...]] = None
+        self._stack_traces: Tuple[Tuple[StackTraceElement], Tuple[StackTraceElement]] = ((), ())
+
+    def stack_traces(self, app_module_names_to_exclude: Tuple[str], django_module_names_to_include: Tuple[str],
+                     stack_trace_boundaries: Tuple[str, ...] = ()) \
+            -> Tuple[Tuple[StackTraceElement], Tuple[StackTraceElement]]:
+        """ The same tuple of app & django stack-trace that find_stack_trace would have found, when it was captured """
+        module_names = (app_module_names_to_exclude, django_module_names_to_include, stack_trace_boundaries)
+        if self._stack_traces_module_names != module_names:
+            app_stack_trace, django_stack_trace = self._find_stack_traces(*module_names)
+            self._stack_traces = intern_stack_trace(app_stack_trace), intern_stack_trace(django_stack_trace)
+            self._stack_traces_module_names = module_names
+        return self._stack_traces
+
+    def _find_stack_traces(self, app_module_names_to_exclude: Tuple[str], django_module_names_to_include: Tuple[str],
+                           stack_trace_boundaries: Tuple[str, ...]) \
+            -> Tuple[Tuple[StackTraceElement], Tuple[StackTraceElement]]:
+        app_stack_trace: List[StackTraceElement] = []
+        django_stack_trace: List[StackTraceElement] = []
+        code_to_decision = code_decision_memo(
+            app_module_names_to_exclude, django_module_names_to_include, stack_trace_boundaries)
+        code_and_offsets = self.code_and_offsets
+        for index, module_name in enumerate(self.module_names):
+            code, instruction_offset = code_and_offsets[2 * index], code_and_offsets[2 * index + 1]
+            memoized = code_to_decision.get(id(code))
+            if memoized is None or memoized[0] is not code:
+                memoized = code_to_decision[id(code)] = (code, _code_decision(
+                    module_name, code, app_module_names_to_exclude, django_module_names_to_include,
+                    stack_trace_boundaries))
+            code_decision = memoized[1]
+
+            if code_decision is not None:
+                if code_decision.__class__ is _AppCodeDecision:
+                    app_stack_trace.append(code_decision.stack_trace_element_at_offset(code, instruction_offset))
+                elif code_decision is _STACK_TRACE_BOUNDARY:
+                    break
+                else:
+                    django_stack_trace.append(code_decision)
+        return tuple(app_stack_trace), tuple(django_stack_trace)
+
+
+RAW_STACK_TRACE_MEMO_MAX_SIZE = 1024
+
+
+def capture_raw_stack_trace(max_depth: int, boundary_frame: Optional[FrameType] = None) -> RawStackTrace:
+    """
+    The lazy counterpart of find_stack_trace, called for every query when DJANGO_QUERY_PROFILER_LAZY_STACK_CAPTURE is
+    on.  Only the id of the code object & the instruction offset of every frame are read - the code objects and the
+    module names are read only when the stack is seen for the first time in the thread, by walking the frames again.
+    The ids are valid for as long as the stack is interned, because its RawStackTrace holds the code objects.  The
+    capture stops at the boundary_frame, and the stack trace boundaries are applied when the stack traces are found
+    from it
+    """
+    code_ids_and_offsets = []
+    current_iteration: int = 0
+    current_frame = sys._getframe()
+    try:
+        while current_iteration < max_depth and current_frame is not None and current_frame is not boundary_frame:
+            code_ids_and_offsets.append(id(current_frame.f_code))
+            code_ids_and_offsets.append(current_frame.f_lasti)
+            current_frame = current_frame.f_back
+            current_iteration += 1
+
+        code_ids_and_offsets = tuple(code_ids_and_offsets)
+        code_and_offsets_to_raw_stack_trace = THREAD_LOCAL_MEMO.code_and_offsets_to_raw_stack_trace
+        raw_stack_trace = code_and_offsets_to_raw_stack_trace.get(code_ids_and_offsets)
+        if raw_stack_trace is None:
+            if len(code_and_offsets_to_raw_stack_trace) >= RAW_STACK_TRACE_MEMO_MAX_SIZE:
+                code_and_offsets_to_raw_stack_trace.clear()
+            code_and_offsets = []
+            module_names = []
+            current_frame = sys._getframe()
+            while len(module_names) < current_iteration:
+                code_and_offsets.append(current_frame.f_code)
+                code_and_offsets.append(code_ids_and_offsets[2 * len(module_names) + 1])
+                module_names.append(_module_name_from_frame(current_frame))
+                current_frame = current_frame.f_back
+            raw_stack_trace = code_and_offsets_to_raw_stack_trace[code_ids_and_offsets] = RawStackTrace(
+                tuple(code_and_offsets), tuple(module_names))
+    finally:
+        del current_frame
+    return raw_stack_trace
 
 
-def _function_name_from_frame(frame):
-    return frame.f_code.co_name
+def _code_decision(module_name: str, code: CodeType, app_module_names_to_exclude: Tuple[str],
+                   django_module_names_to_include: Tuple[str], stack_trace_boundaries: Tuple[str, ...]) -> CodeDecision:
+    """
+    We would first check if the function is a stack trace boundary - whose "module_name.qualified_name" (like
+    "django.core.handlers.base.BaseHandler._get_response") starts with any of the boundaries.  Python < 3.11 has no
+    qualified name of a code object, and the function name is used there instead.
+
+    Then we would check if the stack_trace can be included in django stack trace because that list is the include list.
+    If it can be included in django one, we would not add it to app stack_trace list.  If not, we would check if it can
+    be included in the app list based on the passed exclusion list
+    """
+    function_name = code.co_name
+    if stack_trace_boundaries and module_prefix_trie(stack_trace_boundaries).matches(
+            f'{module_name}.{getattr(code, "co_qualname", function_name)}'):
+        return _STACK_TRACE_BOUNDARY
+    if module_prefix_trie(django_module_names_to_include).matches(module_name):
+        return StackTraceElement.django_stacktrace_element(module_name=module_name, function_name=function_name)
+    if not module_prefix_trie(app_module_names_to_exclude).matches(module_name):
+        return _AppCodeDecision(module_name=module_name, function_name=function_name)
+    return None
+
+
+def _module_name_from_frame(frame):
+    return frame.f_globals.get('__name__', '')
 
 
-def _line_number_from_frame(frame):
-    return frame.f_lineno
+def _line_number_at_offset(code: CodeType, instruction_offset: int) -> int:
+    """ The same line number as frame.f_lineno, of a frame of this code, executing the instruction at this offset """
+    line_number = code.co_firstlineno
+    for start_offset, start_line_number in dis.findlinestarts(code):
+        if start_offset > instruction_offset:
+            break
+        if start_line_number is not None:
+            line_number = start_line_number
+    return line_number
@@ -3,7 +3,7 @@ from typing import Optional
 from django.http import HttpRequest
 from django.http.response import HttpResponseBase
 
-from django_query_profiler.query_profiler_storage import QueryProfiledData, QueryProfilerLevel
+from django_query_profiler.query_profiler_storage import QueryProfiledData, QueryProfilerLevel, SqlNormalization
 
 # Parameters for configuring redis
 DJANGO_QUERY_PROFILER_REDIS_HOST: str = 'localhost'
@@ -31,6 +31,65 @@ DJANGO_QUERY_PROFILER_APP_MODULES_TO_EXCLUDE = (
     'django.template', 'django.templatetags', 'django.utils', 'django.test',
     'IPython', 'django_query_profiler', 'test', 'socketserver', 'threading')
 
+"""
+Parameters for sampling, which allow keeping the profiler on for all requests with a bounded overhead.
+1. DJANGO_QUERY_PROFILER_REQUEST_SAMPLE_RATE:  The fraction of the requests (for which DJANGO_QUERY_PROFILER_LEVEL_FUNC
+    returns a level) that the middleware profiles.  1.0 profiles all of them
+2. DJANGO_QUERY_PROFILER_QUERY_SAMPLE_INTERVAL:  Within a profiled request, only every k-th query is profiled.  The
+    other queries are only counted, and the summary reports the query sample rate along with the extrapolated totals
+"""
+DJANGO_QUERY_PROFILER_REQUEST_SAMPLE_RATE: float = 1.0
+DJANGO_QUERY_PROFILER_QUERY_SAMPLE_INTERVAL: int = 1
+
+"""
+The number of slowest executions of every query signature that are kept, along with their params, so that a slow query
+can be reproduced from the detailed view.  Memory used is bounded by this number, irrespective of the number of queries.
+Setting it to 0 disables keeping the params
+"""
+DJANGO_QUERY_PROFILER_SLOWEST_QUERY_EXECUTIONS_PER_SIGNATURE: int = 5
+
+"""
+Parameter to count the model instances built by the ORM from the rows of a query signature, and the time spent in
+python building them - which for wide querysets can be more than the time spent in the database.  This wraps
+Model.from_db, which the querysets call for every row they read - that adds a function call for every model instance
+loaded in the process (even when the profiler is not on), hence it is off by default.  Model instances built by hand
+are not counted
+"""
+DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION: bool = False
+
+"""
+Parameter to capture only the code objects & instruction offsets of the stack for every query, and find the stack
+traces from them when the profiler block exits - once for every distinct stack.  Loops executing the same query from
+the same line (like N+1 queries) capture the same stack many times, hence this cuts most of the time spent on the stack
+trace.  The stack traces are the same as the ones found when this is off
+"""
+DJANGO_QUERY_PROFILER_LAZY_STACK_CAPTURE: bool = False
+
+"""
+Parameters for stopping the walk of the stack of a query early, instead of walking through the frames of the server,
+the handler & the middlewares - which are mostly excluded from the stack trace anyway.  The frames where the walk stops
+are not in the stack trace
+1. DJANGO_QUERY_PROFILER_STACK_TRACE_BOUNDARIES:  The walk stops at the first function whose "module.qualified_name"
+    starts with any of these, like "django.core.handlers.base.BaseHandler._get_response" or a module name.  Python
+    < 3.11 has no qualified names of functions, and there it is "module.function_name"
+2. DJANGO_QUERY_PROFILER_STACK_TRACE_STOP_AT_MIDDLEWARE:  The walk stops at the frame of the QueryProfilerMiddleware,
+    and so the middlewares before it (and the handler & the server) are never walked
+"""
+DJANGO_QUERY_PROFILER_STACK_TRACE_BOUNDARIES = ()
+DJANGO_QUERY_PROFILER_STACK_TRACE_STOP_AT_MIDDLEWARE: bool = False
+
+"""
+Parameters for running EXPLAIN on the slowest SELECT query signatures, after the middleware has profiled a request.  The
+plan is shown in the detailed view
+1. DJANGO_QUERY_PROFILER_EXPLAIN_SLOWEST_QUERY_SIGNATURES:  The number of query signatures to explain, 0 turns it off.
+    The slowest execution of a query signature is explained, hence this needs
+    DJANGO_QUERY_PROFILER_SLOWEST_QUERY_EXECUTIONS_PER_SIGNATURE to be more than 0
+2. DJANGO_QUERY_PROFILER_EXPLAIN_CACHE_TTL_SECONDS:  A query is explained once in this time in a process, and the plan
+    is reused for the requests running the same query in that time
+"""
+DJANGO_QUERY_PROFILER_EXPLAIN_SLOWEST_QUERY_SIGNATURES: int = 0
+DJANGO_QUERY_PROFILER_EXPLAIN_CACHE_TTL_SECONDS: int = 3600
+
 
 # noinspection PyPep8Naming
 def DJANGO_QUERY_PROFILER_LEVEL_FUNC(request) -> Optional[QueryProfilerLevel]:
@@ -43,12 +102,29 @@ def DJANGO_QUERY_PROFILER_LEVEL_FUNC(request) -> Optional[QueryProfilerLevel]:
         (query, stack-trace), and figures out N+1 code paths, and provide recommendation to remove N+1's
     3. None:  This disables profiling for that request
 
+    Under ASGI, the middleware runs this function in a thread with sync_to_async (so it can read request.user or the
+    session from the database), unless it is a coroutine function - which is awaited
+
     NB:  Name of the function is all caps because of settings file restriction of all names to be all caps,
         including functions
     """
     return QueryProfilerLevel.QUERY_SIGNATURE
 
 
+# noinspection PyPep8Naming
+def DJANGO_QUERY_PROFILER_SQL_NORMALIZATION_FUNC(query_profiler_level: QueryProfilerLevel) -> SqlNormalization:
+    """
+    The normalization applied to the sql of queries, before grouping them by it - called when a profiler block is
+    entered, with the level active in the block.  There are three options:
+    1. NONE:  Queries are grouped by their exact sql
+    2. COLLAPSE_REPEATED_PARAMS:  Queries that differ only in the number of params in a list, like "IN (%s, %s)", are
+        grouped together.  This is the default for QUERY_SIGNATURE level
+    3. FINGERPRINT:  Queries that differ in their literals, placeholders, list sizes, comments or whitespace are
+        grouped together.  This is the default for QUERY level, where we don't have the stack-trace to group by
+    """
+    return query_profiler_level.sql_normalization
+
+
 # noinspection PyPep8Naming
 def DJANGO_QUERY_PROFILER_POST_PROCESSOR(
         query_profiled_data: QueryProfiledData,
@@ -0,0 +1,58 @@
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+
+from django_query_profiler.client.context_manager import QueryProfiler
+from django_query_profiler.query_profiler_storage import DatabaseOperation, QueryProfilerLevel, SqlStatement
+from tests.testapp.food.models import Topping
+
+
+class DatabaseOperationsTest(TransactionTestCase):
+
+    def test_commit_and_savepoint(self):
+        """ A nested atomic block creates & releases a savepoint, and the outer one commits """
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            with transaction.atomic():
+                with transaction.atomic():
+                    Topping.objects.create(name='olives', is_spicy=False)
+        summary = qp.query_profiled_data.summary
+
+        self.assertEqual(summary.commit_count, 1)
+        self.assertEqual(summary.rollback_count, 0)
+        self.assertEqual(summary.savepoint_count, 2)
+        self.assertEqual(qp.query_profiled_data.database_operation_to_count[DatabaseOperation.SAVEPOINT], 2)
+        # The savepoint queries are transactional queries too (and so is BEGIN, on the backends that run it as a query)
+        savepoint_query_count = sum(
+            query_signature_statistics.frequency for query_signature, query_signature_statistics
+            in qp.query_profiled_data.query_signature_to_query_signature_statistics.items()
+            if query_signature.query_without_params.startswith(('SAVEPOINT', 'RELEASE'))
+            and SqlStatement.from_sql(query_signature.query_without_params) is SqlStatement.TRANSACTIONALS)
+        self.assertEqual(savepoint_query_count, 2)
+
+    def test_rollback(self):
+        """ An exception in an atomic block rolls back the transaction """
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            try:
+                with transaction.atomic():
+                    Topping.objects.create(name='olives', is_spicy=False)
+                    raise ValueError()
+            except ValueError:
+                pass
+        summary = qp.query_profiled_data.summary
+
+        self.assertEqual(summary.commit_count, 0)
+        self.assertEqual(summary.rollback_count, 1)
+        self.assertFalse(Topping.objects.exists())
+
+    def test_connect(self):
+        """ A new connection to the database is counted """
+        new_connection = connection.copy()
+        try:
+            with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+                with new_connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+        finally:
+            new_connection.close()
+        summary = qp.query_profiled_data.summary
+
+        self.assertEqual(summary.connection_count, 1)
+        self.assertEqual(summary.total_query_count, 1)
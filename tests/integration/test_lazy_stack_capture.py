@@ -0,0 +1,56 @@
+from django.test import TestCase, override_settings
+
+from django_query_profiler.client.context_manager import QueryProfiler
+from django_query_profiler.query_profiler_storage import QueryProfiledData, QueryProfilerLevel, QuerySignature
+from django_query_profiler.query_profiler_storage.data_collector import LazyQuerySignature
+from tests.integration.fixtures import bulk_create_toppings
+from tests.testapp.food.models import Topping
+
+
+class LazyStackCaptureTest(TestCase):
+    """ The data found with the stack captured lazily should be the same as the one found when it is not """
+
+    def setUp(self):
+        bulk_create_toppings()
+
+    def test_same_query_signatures_as_eager_capture(self):
+        eager_query_profiled_data = _profile_toppings()
+        with override_settings(DJANGO_QUERY_PROFILER_LAZY_STACK_CAPTURE=True):
+            lazy_query_profiled_data = _profile_toppings()
+
+        self.assertTrue(all(query_signature.__class__ is QuerySignature for query_signature in
+                            lazy_query_profiled_data.query_signature_to_query_signature_statistics))
+        self.assertDictEqual(_query_signature_to_frequency(lazy_query_profiled_data),
+                             _query_signature_to_frequency(eager_query_profiled_data))
+        self.assertEqual(lazy_query_profiled_data.summary.potential_n_plus1_query_count,
+                         eager_query_profiled_data.summary.potential_n_plus1_query_count)
+
+    @override_settings(DJANGO_QUERY_PROFILER_LAZY_STACK_CAPTURE=True)
+    def test_nested_block(self):
+        """ Every block returns its data with the query signatures, and the outer block merges them """
+        with QueryProfiler(QueryProfilerLevel.QUERY_SIGNATURE) as outer_qp:
+            with QueryProfiler(QueryProfilerLevel.QUERY_SIGNATURE) as inner_qp:
+                for topping in Topping.objects.all():
+                    list(Topping.objects.filter(id=topping.id))
+            for topping in Topping.objects.all():
+                list(Topping.objects.filter(id=topping.id))
+
+        inner_query_signatures = set(inner_qp.query_profiled_data.query_signature_to_query_signature_statistics)
+        outer_query_signatures = set(outer_qp.query_profiled_data.query_signature_to_query_signature_statistics)
+        self.assertTrue(inner_query_signatures <= outer_query_signatures)
+        self.assertFalse(any(isinstance(query_signature, LazyQuerySignature)
+                             for query_signature in inner_query_signatures | outer_query_signatures))
+        self.assertEqual(outer_qp.query_profiled_data.summary.total_query_count, 12)
+
+
+def _profile_toppings() -> QueryProfiledData:
+    with QueryProfiler(QueryProfilerLevel.QUERY_SIGNATURE) as qp:
+        for _ in range(2):
+            for topping in Topping.objects.all():
+                list(Topping.objects.filter(id=topping.id))
+    return qp.query_profiled_data
+
+
+def _query_signature_to_frequency(query_profiled_data: QueryProfiledData):
+    return {query_signature: query_signature_statistics.frequency for query_signature, query_signature_statistics
+            in query_profiled_data.query_signature_to_query_signature_statistics.items()}
@@ -2,20 +2,34 @@ import json
 import logging
 import re
 from typing import Dict
+from unittest import skipIf
 from unittest.mock import patch
 
+import django
 import fakeredis
+from asgiref.sync import sync_to_async
 from django.http import HttpRequest, HttpResponse
 from django.http.response import HttpResponseBase
-from django.test import TestCase, override_settings
+from django.test import RequestFactory, TestCase, override_settings
 
 from django_query_profiler.chrome_plugin_helpers import ChromePluginData, redis_utils
 from django_query_profiler.chrome_plugin_helpers.views import get_query_profiled_data
-from django_query_profiler.client.middleware import DETAILED_VIEW_EXCEPTION_LINK_TEXT, DETAILED_VIEW_EXCEPTION_URL
-from django_query_profiler.query_profiler_storage import QueryProfiledData, QueryProfilerLevel, SqlStatement
+from django_query_profiler.client.middleware import (
+    DETAILED_VIEW_EXCEPTION_LINK_TEXT, DETAILED_VIEW_EXCEPTION_URL, QueryProfilerMiddleware
+)
+from django_query_profiler.query_profiler_storage import (
+    ProfilerPhase, QueryProfiledData, QueryProfilerLevel, SqlStatement
+)
+from django_query_profiler.query_profiler_storage.stack_tracer import find_stack_trace
 from tests.testapp.food.models import Topping
 
+try:
+    from asgiref.sync import iscoroutinefunction
+except ImportError:  # asgiref < 3.6, see the middleware
+    from asyncio import iscoroutinefunction
+
 logger = logging.getLogger('testing')
+ASYNC_TESTS_SKIP_REASON = 'Async views, middleware & tests are supported by django >= 3.1'
 
 
 def django_query_profiler_post_processor_that_adds_another_header(
@@ -48,6 +62,14 @@ class QueryProfilerMiddlewareTest(TestCase):
         self.assertTrue(response.has_header(ChromePluginData.TIME_SPENT_PROFILING_IN_MICROS))
         self.assertTrue(response.has_header(ChromePluginData.TOTAL_SERVER_TIME_IN_MILLIS))
 
+        # The time spent profiling is the sum of the time spent in its phases
+        profiler_phase_times_in_micros = [
+            int(response.get(ChromePluginData.TIME_SPENT_PROFILING_IN_MICROS_PHASE_PREFIX + profiler_phase.name))
+            for profiler_phase in ProfilerPhase]
+        self.assertGreater(profiler_phase_times_in_micros[0], 0)  # Stack walk
+        self.assertAlmostEqual(int(response.get(ChromePluginData.TIME_SPENT_PROFILING_IN_MICROS)),
+                               sum(profiler_phase_times_in_micros), delta=len(ProfilerPhase))
+
         summary_data: Dict = json.loads(response.get(ChromePluginData.QUERY_PROFILED_SUMMARY_DATA))
         self.assertEqual(summary_data['exact_query_duplicates'], 4)
         self.assertEqual(summary_data[SqlStatement.SELECT.name], 5)
@@ -55,6 +77,60 @@ class QueryProfilerMiddlewareTest(TestCase):
         self.assertEqual(summary_data[SqlStatement.UPDATE.name], 0)
         self.assertEqual(summary_data[SqlStatement.DELETE.name], 0)
 
+    @skipIf(django.VERSION < (3, 1), ASYNC_TESTS_SKIP_REASON)
+    async def test_headers_for_async_request(self):
+        response: HttpResponse = await self.async_client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get(ChromePluginData.QUERY_PROFILER_DETAILED_VIEW_LINK_TEXT),
+                         QueryProfilerLevel.QUERY_SIGNATURE.name.lower())
+
+        # The queries of the sync view, which Django runs in a thread, are profiled
+        summary_data: Dict = json.loads(response.get(ChromePluginData.QUERY_PROFILED_SUMMARY_DATA))
+        self.assertEqual(summary_data['exact_query_duplicates'], 4)
+        self.assertEqual(summary_data[SqlStatement.SELECT.name], 5)
+
+    @skipIf(django.VERSION < (3, 1), ASYNC_TESTS_SKIP_REASON)
+    def test_middleware_is_coroutine_only_for_async_get_response(self):
+        async def async_get_response(_):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(QueryProfilerMiddleware(async_get_response)))
+        self.assertFalse(iscoroutinefunction(QueryProfilerMiddleware(lambda _: HttpResponse())))
+
+    @skipIf(django.VERSION < (3, 1), ASYNC_TESTS_SKIP_REASON)
+    @override_settings(DJANGO_QUERY_PROFILER_LEVEL_FUNC=lambda _: None)
+    async def test_async_request_with_none_profiler_level(self):
+        async def async_get_response(_):
+            return HttpResponse()
+
+        response: HttpResponse = await QueryProfilerMiddleware(async_get_response)(RequestFactory().get('/'))
+        self.assertFalse(response.has_header(ChromePluginData.QUERY_PROFILED_SUMMARY_DATA))
+
+    @skipIf(django.VERSION < (3, 1), ASYNC_TESTS_SKIP_REASON)
+    @override_settings(
+        DJANGO_QUERY_PROFILER_LEVEL_FUNC=lambda _: QueryProfilerLevel.QUERY if Topping.objects.exists() else None)
+    async def test_async_request_with_profiler_level_func_using_orm(self):
+        """ A level function that reads from the database is not run in the event loop """
+        await sync_to_async(Topping.objects.create)(name='olives', is_spicy=False)
+
+        async def async_get_response(_):
+            return HttpResponse()
+
+        response: HttpResponse = await QueryProfilerMiddleware(async_get_response)(RequestFactory().get('/'))
+        self.assertTrue(response.has_header(ChromePluginData.QUERY_PROFILED_SUMMARY_DATA))
+
+    @skipIf(django.VERSION < (3, 1), ASYNC_TESTS_SKIP_REASON)
+    async def test_async_request_with_async_profiler_level_func(self):
+        async def query_profiler_level_func(_):
+            return None
+
+        async def async_get_response(_):
+            return HttpResponse()
+
+        with override_settings(DJANGO_QUERY_PROFILER_LEVEL_FUNC=query_profiler_level_func):
+            response: HttpResponse = await QueryProfilerMiddleware(async_get_response)(RequestFactory().get('/'))
+        self.assertFalse(response.has_header(ChromePluginData.QUERY_PROFILED_SUMMARY_DATA))
+
     @patch('django_query_profiler.client.middleware.redis_utils')
     @override_settings(DJANGO_QUERY_PROFILER_IGNORE_DETAILED_VIEW_EXCEPTION=False)
     def test_headers_with_redis_throws_exception_ignore_detailed_view_exception_false(self,
@@ -99,6 +175,18 @@ class QueryProfilerMiddlewareTest(TestCase):
         self.assertContains(response_detailed_url, "<th>5</th>")  # For select count
         self.assertContains(response_detailed_url, "<th>4</th>")  # For exact query duplicates
         self.assertContains(response_detailed_url, "flamegraphStack")  # For flamegraph
+        self.assertContains(response_detailed_url, "Query time p50 / p95 / p99 / max")  # For latency percentiles
+        self.assertNotContains(response_detailed_url, "Queries were sampled")
+
+    @override_settings(DJANGO_QUERY_PROFILER_EXPLAIN_SLOWEST_QUERY_SIGNATURES=1)
+    def test_detailed_view_with_explain_plan(self):
+        response_index_view: HttpResponse = self.client.get('/')
+        self.assertTrue(response_index_view.has_header(
+            ChromePluginData.TIME_SPENT_PROFILING_IN_MICROS_PHASE_PREFIX + ProfilerPhase.EXPLAIN.name))
+
+        query_profiler_detailed_view_url: str = response_index_view.get(ChromePluginData.QUERY_PROFILED_DETAILED_URL)
+        response_detailed_url: HttpResponse = self.client.get(query_profiler_detailed_view_url)
+        self.assertContains(response_detailed_url, "Query plan of the slowest execution", count=1)
 
     @override_settings(DJANGO_QUERY_PROFILER_LEVEL_FUNC=lambda _: QueryProfilerLevel.QUERY)
     def test_detailed_view_url_from_header_call_successful_query_level(self):
@@ -111,6 +199,7 @@ class QueryProfilerMiddlewareTest(TestCase):
         self.assertContains(response_detailed_url, "<th>5</th>")  # For select count
         self.assertContains(response_detailed_url, "<th>4</th>")  # For exact query duplicates
         self.assertNotContains(response_detailed_url, "flamegraphStack")  # For flamegraph
+        self.assertContains(response_detailed_url, "Slowest executions")  # For queries with their params
 
     @override_settings(DJANGO_QUERY_PROFILER_LEVEL_FUNC=lambda _: None)
     @patch('django_query_profiler.client.middleware.redis_utils')
@@ -119,6 +208,41 @@ class QueryProfilerMiddlewareTest(TestCase):
         self.assertIsNone(response_index_view.get(ChromePluginData.QUERY_PROFILED_DETAILED_URL))
         self.assertFalse(mock_redis_utils.called)
 
+    @override_settings(DJANGO_QUERY_PROFILER_REQUEST_SAMPLE_RATE=0.5)
+    @patch('django_query_profiler.client.middleware.random.random', return_value=0.6)
+    def test_request_not_sampled(self, _):
+        response: HttpResponse = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header(ChromePluginData.QUERY_PROFILED_SUMMARY_DATA))
+
+    @override_settings(DJANGO_QUERY_PROFILER_REQUEST_SAMPLE_RATE=0.5, DJANGO_QUERY_PROFILER_QUERY_SAMPLE_INTERVAL=2)
+    @patch('django_query_profiler.client.middleware.random.random', return_value=0.4)
+    def test_request_and_queries_sampled(self, _):
+        response: HttpResponse = self.client.get('/')
+        self.assertEqual(response.get(ChromePluginData.REQUEST_SAMPLE_RATE), '0.5')
+
+        summary_data: Dict = json.loads(response.get(ChromePluginData.QUERY_PROFILED_SUMMARY_DATA))
+        self.assertLess(summary_data['query_sample_rate'], 1)
+        self.assertEqual(float(response.get(ChromePluginData.QUERY_SAMPLE_RATE)), summary_data['query_sample_rate'])
+        self.assertLess(summary_data[SqlStatement.SELECT.name], summary_data['estimated_total_query_count'])
+        self.assertLess(summary_data[SqlStatement.SELECT.name], summary_data[f'estimated_{SqlStatement.SELECT.name}'])
+
+        query_profiler_detailed_view_url: str = response.get(ChromePluginData.QUERY_PROFILED_DETAILED_URL)
+        response_detailed_url: HttpResponse = self.client.get(query_profiler_detailed_view_url)
+        self.assertContains(response_detailed_url, "Queries were sampled")
+        self.assertContains(response_detailed_url, "<th>Estimated</th>")
+
+    @override_settings(DJANGO_QUERY_PROFILER_STACK_TRACE_STOP_AT_MIDDLEWARE=True)
+    def test_stack_trace_stops_at_middleware(self):
+        with patch('django_query_profiler.query_profiler_storage.data_collector.find_stack_trace',
+                   wraps=find_stack_trace) as mock_find_stack_trace:
+            response: HttpResponse = self.client.get('/')
+
+        summary_data: Dict = json.loads(response.get(ChromePluginData.QUERY_PROFILED_SUMMARY_DATA))
+        self.assertEqual(summary_data[SqlStatement.SELECT.name], 5)
+        boundary_frame_codes = {call.kwargs['boundary_frame'].f_code for call in mock_find_stack_trace.call_args_list}
+        self.assertSetEqual(boundary_frame_codes, {QueryProfilerMiddleware.__call__.__code__})
+
     @override_settings(
         DJANGO_QUERY_PROFILER_POST_PROCESSOR=django_query_profiler_post_processor_that_adds_another_header)
     def test_query_profiler_post_processor_to_write_to_logs(self):
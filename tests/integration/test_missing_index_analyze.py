@@ -0,0 +1,59 @@
+from django.test import TestCase
+
+from django_query_profiler.client.context_manager import QueryProfiler
+from django_query_profiler.query_profiler_storage import IndexRecommendation, QueryProfilerLevel
+from django_query_profiler.query_profiler_storage.missing_index_analyze import (
+    TableColumns, _parse_sql_for_table_columns
+)
+from tests.integration.fixtures import bulk_create_toppings_pizzas_restaurants
+from tests.testapp.food.models import Pizza, Restaurant, Topping
+
+
+class MissingIndexAnalyzeTest(TestCase):
+
+    def setUp(self):
+        bulk_create_toppings_pizzas_restaurants()
+
+    def test_recommend_composite_index(self):
+        """ The equality filter columns come first, followed by the order by columns """
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            for _ in range(3):
+                list(Topping.objects.filter(is_spicy=True).order_by('name'))
+                list(Topping.objects.filter(is_spicy=False).order_by('name'))
+
+        index_recommendation, = qp.query_profiled_data.index_recommendations
+        self.assertIsInstance(index_recommendation, IndexRecommendation)
+        self.assertEqual(index_recommendation.model_label, 'food.Topping')
+        self.assertEqual(index_recommendation.column_names, ('is_spicy', 'name'))
+        self.assertEqual(index_recommendation.frequency, 6)
+        self.assertEqual(index_recommendation.index_definition, "models.Index(fields=['is_spicy', 'name'])")
+
+    def test_no_recommendation_for_indexed_columns(self):
+        """ Primary keys, unique fields and foreign keys are indexed """
+        pizza = Pizza.objects.first()
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            for _ in range(3):
+                list(Topping.objects.filter(name='olives'))
+                list(Restaurant.objects.filter(best_pizza=pizza))
+                list(pizza.toppings.all())
+
+        self.assertEqual(qp.query_profiled_data.index_recommendations, [])
+
+    def test_fast_query_run_once_not_considered(self):
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            list(Restaurant.objects.filter(is_active=True))
+
+        self.assertEqual(qp.query_profiled_data.index_recommendations, [])
+
+    def test_parse_joins_ranges_and_sub_queries(self):
+        table_name_to_columns = _parse_sql_for_table_columns(
+            'SELECT "pizza"."id" FROM "pizza" INNER JOIN "restaurant" ON ("pizza"."id" = "restaurant"."best_pizza_id") '
+            'WHERE ("restaurant"."is_active" = %s AND "pizza"."name" > %s AND "pizza"."id" IN '
+            '(SELECT U0."pizza_id" FROM "pizza_toppings" U0 WHERE U0."topping_id" = %s)) ORDER BY "pizza"."name" ASC')
+
+        self.assertEqual(table_name_to_columns, {
+            'pizza': TableColumns(equality_columns=('id',), range_columns=('name',), order_by_columns=('name',)),
+            'restaurant': TableColumns(equality_columns=('best_pizza_id', 'is_active'), range_columns=(),
+                                       order_by_columns=()),
+            'pizza_toppings': TableColumns(equality_columns=('topping_id',), range_columns=(), order_by_columns=()),
+        })
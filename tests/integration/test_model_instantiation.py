@@ -0,0 +1,101 @@
+from unittest.mock import patch
+
+from django.db.models import Model
+from django.test import TestCase, override_settings
+
+from django_query_profiler.client.context_manager import QueryProfiler
+from django_query_profiler.django.db.models.model_instantiation import disconnect_model_instantiation_hook
+from django_query_profiler.query_profiler_storage import QueryProfilerLevel
+from tests.integration.fixtures import bulk_create_toppings
+from tests.testapp.food.models import Topping
+
+
+class ModelInstantiationTest(TestCase):
+
+    def setUp(self):
+        bulk_create_toppings()
+
+    def tearDown(self):
+        disconnect_model_instantiation_hook()
+
+    def test_model_instantiation_not_tracked_by_default(self):
+        """ Model instances are not counted, unless the setting is on """
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            list(Topping.objects.all())
+
+        self.assertEqual(qp.query_profiled_data.summary.total_model_instance_count, 0)
+
+    def test_hook_removed_when_setting_turned_off(self):
+        """ Model.from_db of django is put back when the profiler enters, once the setting is off """
+        django_from_db = Model.from_db
+        with override_settings(DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION=True):
+            with QueryProfiler(QueryProfilerLevel.QUERY):
+                self.assertNotEqual(Model.from_db, django_from_db)
+
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            self.assertEqual(Model.from_db, django_from_db)
+            list(Topping.objects.all())
+        self.assertEqual(qp.query_profiled_data.summary.total_model_instance_count, 0)
+
+    @override_settings(DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION=True)
+    def test_model_instantiation_attributed_to_query_signature(self):
+        """ Model instances are attributed to the query whose rows they were built from """
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            list(Topping.objects.all())
+            list(Topping.objects.values('name'))
+
+        query_signature_statistics_list = \
+            list(qp.query_profiled_data.query_signature_to_query_signature_statistics.values())
+        self.assertEqual(len(query_signature_statistics_list), 2)
+        model_query_statistics, values_query_statistics = query_signature_statistics_list
+        self.assertEqual(model_query_statistics.model_instance_count, 5)
+        self.assertGreater(model_query_statistics.model_instantiation_time_in_micros, 0)
+        self.assertEqual(values_query_statistics.model_instance_count, 0)
+        self.assertEqual(qp.query_profiled_data.summary.total_model_instance_count, 5)
+
+    @override_settings(DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION=True)
+    def test_model_instantiation_in_nested_block(self):
+        """ Instances built after a nested block exits are attributed to the last query of the nested block """
+        with QueryProfiler(QueryProfilerLevel.QUERY) as outer_qp:
+            with QueryProfiler(QueryProfilerLevel.QUERY) as inner_qp:
+                queryset_iterator = Topping.objects.all().iterator()
+                next(queryset_iterator)
+            list(queryset_iterator)
+
+        self.assertEqual(inner_qp.query_profiled_data.summary.total_model_instance_count, 1)
+        self.assertEqual(outer_qp.query_profiled_data.summary.total_model_instance_count, 5)
+
+    @override_settings(DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION=True)
+    def test_model_instantiation_with_query_in_iterator_loop(self):
+        """ The instances built from the rows of an iterator are attributed to it, not to the query run in its loop """
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            for topping in Topping.objects.all().iterator(chunk_size=1):
+                Topping.objects.filter(name=topping.name).first()
+
+        iterator_statistics, loop_query_statistics = \
+            qp.query_profiled_data.query_signature_to_query_signature_statistics.values()
+        self.assertEqual(iterator_statistics.model_instance_count, 5)
+        self.assertEqual(loop_query_statistics.frequency, 5)
+        self.assertEqual(loop_query_statistics.model_instance_count, 5)
+
+    @override_settings(DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION=True)
+    def test_model_instances_built_by_hand_not_counted(self):
+        """ Only the instances loaded from the rows of a query are counted, not the ones built for bulk_create """
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            list(Topping.objects.all())
+            Topping.objects.bulk_create(Topping(name=f'topping_{index}', is_spicy=False) for index in range(100))
+
+        self.assertEqual(qp.query_profiled_data.summary.total_model_instance_count, 5)
+
+    @override_settings(DJANGO_QUERY_PROFILER_TRACK_MODEL_INSTANTIATION=True)
+    def test_model_instantiation_that_raises(self):
+        """ A model instance that fails to be built is not counted, and the instances built later are timed """
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            with patch.object(Topping, '__init__', side_effect=ValueError):
+                with self.assertRaises(ValueError):
+                    list(Topping.objects.all())
+            list(Topping.objects.all())
+
+        query_signature_statistics, = qp.query_profiled_data.query_signature_to_query_signature_statistics.values()
+        self.assertEqual(query_signature_statistics.model_instance_count, 5)
+        self.assertGreater(query_signature_statistics.model_instantiation_time_in_micros, 0)
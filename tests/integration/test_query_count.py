@@ -1,8 +1,11 @@
 from typing import Dict
 
-from django.test import TestCase
+from django.db import connection
+from django.db.backends.utils import CursorWrapper
+from django.test import TestCase, override_settings
 
 from django_query_profiler.client.context_manager import QueryProfiler
+from django_query_profiler.django.db.backends.cursor_wrapper_instrumentation import QueryProfilerCursorWrapper
 from django_query_profiler.query_profiler_storage import QueryProfilerLevel, SqlStatement
 from tests.integration.fixtures import bulk_create_toppings
 from tests.testapp.food.models import Topping
@@ -67,3 +70,63 @@ class QueryCountTest(TestCase):
         self.assertEqual(summary_dict[SqlStatement.UPDATE.name], 0)
         self.assertEqual(summary_dict[SqlStatement.DELETE.name], 2)
         self.assertEqual(summary_dict[SqlStatement.TRANSACTIONALS.name], 0)
+
+    def test_fetched_row_count(self):
+        """ Rows fetched from the cursor are counted, whichever way django (or the application) fetches them """
+        bulk_create_toppings()
+
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp_fetch:
+            list(Topping.objects.all())
+            list(Topping.objects.all().iterator())
+            Topping.objects.filter(is_spicy=True).first()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT name FROM %s' % Topping._meta.db_table)
+                cursor.fetchone()
+                list(cursor)
+        summary_dict: Dict = qp_fetch.query_profiled_data.summary.as_dict()
+
+        self.assertEqual(summary_dict[SqlStatement.SELECT.name], 4)
+        self.assertEqual(summary_dict['total_fetched_row_count'], 5 + 5 + 1 + 5)
+
+    def test_fetched_row_count_after_nested_block_exits(self):
+        """ The rows fetched after the nested block of the query has exited are added to its parent block """
+        Topping.objects.bulk_create(Topping(name=f'topping_{index}', is_spicy=False) for index in range(250))
+
+        for lazy_stack_capture in (False, True):
+            with self.subTest(lazy_stack_capture=lazy_stack_capture), \
+                    override_settings(DJANGO_QUERY_PROFILER_LAZY_STACK_CAPTURE=lazy_stack_capture):
+                with QueryProfiler(QueryProfilerLevel.QUERY) as qp_outer:
+                    with QueryProfiler(QueryProfilerLevel.QUERY) as qp_inner:
+                        toppings = Topping.objects.all().iterator(chunk_size=100)
+                        next(toppings)
+                    list(toppings)
+                inner_summary_dict: Dict = qp_inner.query_profiled_data.summary.as_dict()
+                outer_summary_dict: Dict = qp_outer.query_profiled_data.summary.as_dict()
+
+                self.assertEqual(inner_summary_dict['total_fetched_row_count'], 100)
+                self.assertEqual(outer_summary_dict[SqlStatement.SELECT.name], 1)
+                self.assertEqual(outer_summary_dict['total_fetched_row_count'], 250)
+
+    def test_cursor_when_profiler_not_on(self):
+        """ Django's own cursor wrapper is used when the profiler is not on, so that the backend costs nothing extra """
+        with connection.cursor() as cursor:
+            self.assertIs(type(cursor), CursorWrapper)
+
+        with QueryProfiler(QueryProfilerLevel.QUERY):
+            with connection.cursor() as cursor:
+                self.assertIsInstance(cursor, QueryProfilerCursorWrapper)
+
+    def test_executemany_batches(self):
+        """ Every executemany is one query, and the parameter sets sent in it are counted """
+        sql = 'INSERT INTO %s (name, is_spicy) VALUES (%%s, %%s)' % Topping._meta.db_table
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp_executemany:
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, [('olives', False), ('pineapple', False), ('pepperoni', True)])
+                cursor.executemany(sql, ((name, False) for name in ('mozzarella', 'basil', 'onions', 'garlic', 'ham')))
+        summary = qp_executemany.query_profiled_data.summary
+
+        self.assertEqual(summary.sql_statement_type_counter[SqlStatement.INSERT], 2)
+        self.assertEqual(summary.total_executemany_count, 2)
+        self.assertEqual(summary.total_executemany_param_set_count, 8)
+        self.assertEqual(summary.average_executemany_batch_size, 4)
+        self.assertEqual(Topping.objects.count(), 8)
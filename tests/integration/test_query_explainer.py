@@ -0,0 +1,81 @@
+from typing import Dict, List
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from django_query_profiler.client.context_manager import QueryProfiler
+from django_query_profiler.client.query_explainer import (
+    EXPLAIN_PLAN_CACHE, _run_explain, explain_slowest_query_signatures
+)
+from django_query_profiler.query_profiler_storage import ProfilerPhase, QueryExecution, QueryProfilerLevel
+from tests.integration.fixtures import bulk_create_toppings
+from tests.testapp.food.models import Topping
+
+
+class QueryExplainerTest(TestCase):
+
+    def setUp(self):
+        EXPLAIN_PLAN_CACHE.clear()
+        bulk_create_toppings()
+
+    def test_explain_slowest_select_query_signatures(self):
+        """ Only the SELECT query signatures are explained, with the params of their slowest execution """
+        with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+            list(Topping.objects.filter(is_spicy=False))
+            Topping.objects.filter(name='olives').update(is_spicy=True)
+        query_profiled_data = qp.query_profiled_data
+
+        explain_slowest_query_signatures(query_profiled_data, query_signature_count=5)
+
+        select_statistics, update_statistics = \
+            query_profiled_data.query_signature_to_query_signature_statistics.values()
+        self.assertIn(f'SCAN {Topping._meta.db_table}', select_statistics.explain_plan)
+        self.assertIsNone(update_statistics.explain_plan)
+        self.assertIn(ProfilerPhase.EXPLAIN, query_profiled_data.profiler_phase_to_time_in_nanos)
+
+    def test_explain_plan_cached(self):
+        """ A query is explained only once, till the plan expires """
+        for _ in range(2):
+            with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+                list(Topping.objects.filter(name='olives'))
+            with CaptureQueriesContext(connection) as explain_queries:
+                explain_slowest_query_signatures(qp.query_profiled_data, query_signature_count=1)
+            query_signature_statistics, = qp.query_profiled_data.query_signature_to_query_signature_statistics.values()
+            self.assertIsNotNone(query_signature_statistics.explain_plan)
+        self.assertEqual(len(explain_queries), 0)
+
+        with override_settings(DJANGO_QUERY_PROFILER_EXPLAIN_CACHE_TTL_SECONDS=0):
+            EXPLAIN_PLAN_CACHE.clear()
+            for _ in range(2):
+                with CaptureQueriesContext(connection) as explain_queries:
+                    explain_slowest_query_signatures(qp.query_profiled_data, query_signature_count=1)
+                self.assertEqual(len(self._explain_queries(explain_queries)), 1)
+
+    def test_failing_explain_in_savepoint(self):
+        """ An EXPLAIN that fails is rolled back to its savepoint, so the transaction of the request is still usable """
+        with CaptureQueriesContext(connection) as explain_queries:
+            explain_plan = _run_explain('default', QueryExecution(1, 'SELECT * FROM missing_table WHERE id=%s', [1]))
+        self.assertIsNone(explain_plan)
+        self.assertTrue(any(query['sql'].startswith('ROLLBACK TO SAVEPOINT') for query in explain_queries))
+        self.assertEqual(Topping.objects.count(), 5)
+
+    @staticmethod
+    def _explain_queries(captured_queries: CaptureQueriesContext) -> List[Dict]:
+        """ The savepoint queries around every EXPLAIN are left out """
+        return [query for query in captured_queries
+                if query['sql'].startswith(connection.ops.explain_query_prefix())]
+
+    def test_explain_queries_profiled_in_outer_block(self):
+        """ The EXPLAIN queries are not in the block that is explained, but they are in an outer block that is on """
+        with QueryProfiler(QueryProfilerLevel.QUERY) as outer_qp:
+            with QueryProfiler(QueryProfilerLevel.QUERY) as qp:
+                list(Topping.objects.filter(name='olives'))
+            explain_slowest_query_signatures(qp.query_profiled_data, query_signature_count=1)
+
+        self.assertEqual(len(qp.query_profiled_data.query_signature_to_query_signature_statistics), 1)
+        outer_query_signatures = outer_qp.query_profiled_data.query_signature_to_query_signature_statistics
+        explain_query_signatures = [
+            query_signature for query_signature in outer_query_signatures
+            if query_signature.query_without_params.startswith(connection.ops.explain_query_prefix())]
+        self.assertEqual(len(explain_query_signatures), 1)
@@ -1,9 +1,11 @@
 from collections import Counter
-from typing import Any
+from typing import Any, Optional
 from unittest import TestCase
 
-from django_query_profiler.query_profiler_storage import QueryProfiledSummaryData, QueryProfilerLevel, SqlStatement
-from django_query_profiler.query_profiler_storage.data_collector import data_collector_thread_local_storage
+from django_query_profiler.query_profiler_storage import (
+    ProfilerPhase, QueryProfiledSummaryData, QueryProfilerLevel, SqlStatement
+)
+from django_query_profiler.query_profiler_storage.data_collector import QueryHandle, data_collector_thread_local_storage
 
 
 class DataStorageTest(TestCase):
@@ -18,6 +20,10 @@ class DataStorageTest(TestCase):
     target_db = 'master'
     query_execution_time_in_micros = 1
     db_row_count = 12
+    # Every query takes the same time, so all the latency statistics in the summary are that time
+    expected_latency_summary = dict.fromkeys(
+        (f'{statistic}_query_execution_time_in_micros' for statistic in ('min', 'max', 'p50', 'p95', 'p99')),
+        query_execution_time_in_micros)
 
     def setUp(self):
         data_collector_thread_local_storage.reset()
@@ -47,13 +53,24 @@ class DataStorageTest(TestCase):
             exact_query_duplicates=0,
             total_query_execution_time_in_micros=self.query_execution_time_in_micros,
             total_db_row_count=self.db_row_count,
-            potential_n_plus1_query_count=0)
+            potential_n_plus1_query_count=0,
+            **self.expected_latency_summary)
         self.assertEqual(query_profiled_data.summary, expected_query_profiled_summary_data)
 
         summary_data_expected_dict = {
             "exact_query_duplicates": 0, "total_query_execution_time_in_micros": 1, "total_db_row_count": 12,
             "potential_n_plus1_query_count": 0, "SELECT": 1, "INSERT": 0, "UPDATE": 0, "DELETE": 0,
-            "TRANSACTIONALS": 0, "OTHER": 0}
+            "TRANSACTIONALS": 0, "OTHER": 0, "query_sample_rate": 1.0, "estimated_total_query_count": 1,
+            "estimated_total_query_execution_time_in_micros": 1, "estimated_total_db_row_count": 12,
+            "min_query_execution_time_in_micros": 1, "max_query_execution_time_in_micros": 1,
+            "p50_query_execution_time_in_micros": 1, "p95_query_execution_time_in_micros": 1,
+            "p99_query_execution_time_in_micros": 1, "total_fetched_row_count": 0, "total_fetch_time_in_micros": 0,
+            "total_model_instance_count": 0, "total_model_instantiation_time_in_micros": 0,
+            "connection_count": 0, "connection_time_in_micros": 0, "commit_count": 0, "commit_time_in_micros": 0,
+            "rollback_count": 0, "rollback_time_in_micros": 0, "savepoint_count": 0, "savepoint_time_in_micros": 0,
+            "total_executemany_count": 0, "total_executemany_param_set_count": 0,
+            "average_executemany_batch_size": None, "estimated_SELECT": 1, "estimated_INSERT": 0,
+            "estimated_UPDATE": 0, "estimated_DELETE": 0, "estimated_TRANSACTIONALS": 0, "estimated_OTHER": 0}
         self.assertDictEqual(query_profiled_data.summary.as_dict(), summary_data_expected_dict)
 
     def test_two_query_signatures(self):
@@ -71,7 +88,8 @@ class DataStorageTest(TestCase):
             exact_query_duplicates=2,
             total_query_execution_time_in_micros=self.query_execution_time_in_micros * 2,
             total_db_row_count=self.db_row_count * 2,
-            potential_n_plus1_query_count=2)  # Since query signature is different
+            potential_n_plus1_query_count=2,
+            **self.expected_latency_summary)  # Since query signature is different
         self.assertEqual(query_profiled_data.summary, expected_query_profiled_summary_data)
 
         # Verifying number of query_signatures in profiled data
@@ -92,7 +110,8 @@ class DataStorageTest(TestCase):
             exact_query_duplicates=2,
             total_query_execution_time_in_micros=self.query_execution_time_in_micros * 2,
             total_db_row_count=self.db_row_count * 2,
-            potential_n_plus1_query_count=2)  # Since query signature is same
+            potential_n_plus1_query_count=2,
+            **self.expected_latency_summary)  # Since query signature is same
         self.assertEqual(query_profiled_data.summary, expected_query_profiled_summary_data)
 
         # Verifying number of query_signatures in profiled data
@@ -119,17 +138,17 @@ class DataStorageTest(TestCase):
 
         # First exit testing
         first_exit_query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
-        self.assertTrue(data_collector_thread_local_storage._query_profiler_enabled)
+        self.assertTrue(data_collector_thread_local_storage.query_profiler_enabled)
 
-        # Size of list does not decrease, and stack should contain only first enter index
-        self.assertEqual(len(data_collector_thread_local_storage._query_profiled_data_list), 2)
-        self.assertListEqual(data_collector_thread_local_storage._entry_index_stack, [0])
+        # Only the outer block should be active now
+        self.assertEqual(data_collector_thread_local_storage._nesting_depth, 1)
         expected_query_profiled_summary_data = QueryProfiledSummaryData(
             sql_statement_type_counter=Counter({SqlStatement.SELECT: 2}),
             exact_query_duplicates=2,
             total_query_execution_time_in_micros=self.query_execution_time_in_micros * 2,
             total_db_row_count=self.db_row_count * 2,
-            potential_n_plus1_query_count=2)  # Since query signature is different
+            potential_n_plus1_query_count=2,
+            **self.expected_latency_summary)  # Since query signature is different
         self.assertEqual(first_exit_query_profiled_data.summary, expected_query_profiled_summary_data)
 
         # Second exit testing.  This should return *ALL* the queries data
@@ -140,7 +159,8 @@ class DataStorageTest(TestCase):
             exact_query_duplicates=3,
             total_query_execution_time_in_micros=self.query_execution_time_in_micros * 3,
             total_db_row_count=self.db_row_count * 3,
-            potential_n_plus1_query_count=3)
+            potential_n_plus1_query_count=3,
+            **self.expected_latency_summary)
         self.assertEqual(second_exit_query_profiled_data.summary, expected_query_profiled_summary_data)
 
     def test_complex_nested_entry_exit_calls(self):
@@ -169,15 +189,13 @@ class DataStorageTest(TestCase):
         data_collector_thread_local_storage.enter_profiler_mode(QueryProfilerLevel.QUERY_SIGNATURE)
 
         # Before first exit
-        self.assertEqual(len(data_collector_thread_local_storage._query_profiled_data_list), 3)
-        self.assertListEqual(data_collector_thread_local_storage._entry_index_stack, [0, 1, 2])
+        self.assertEqual(data_collector_thread_local_storage._nesting_depth, 3)
 
         # First exit.
         first_exit_query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
-        self.assertTrue(data_collector_thread_local_storage._query_profiler_enabled)
-        # Size of list does not decrease, and stack should contain only first enter index
-        self.assertEqual(len(data_collector_thread_local_storage._query_profiled_data_list), 3)
-        self.assertListEqual(data_collector_thread_local_storage._entry_index_stack, [0, 1])
+        self.assertTrue(data_collector_thread_local_storage.query_profiler_enabled)
+        # The innermost block is folded into its parent, and is not active anymore
+        self.assertEqual(data_collector_thread_local_storage._nesting_depth, 2)
         expected_query_profiled_summary_data = QueryProfiledSummaryData(
             sql_statement_type_counter=Counter(),
             exact_query_duplicates=0,
@@ -190,71 +208,161 @@ class DataStorageTest(TestCase):
         self._add_query_to_storage((1,))
 
         # Before second exit
-        self.assertListEqual(data_collector_thread_local_storage._entry_index_stack, [0, 1, 3])
+        self.assertEqual(data_collector_thread_local_storage._nesting_depth, 3)
 
         # Second exit
         second_exit_query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
-        self.assertTrue(data_collector_thread_local_storage._query_profiler_enabled)
-        # Size of list does not decrease, and stack should contain only first enter index
-        self.assertEqual(len(data_collector_thread_local_storage._query_profiled_data_list), 4)
-        self.assertListEqual(data_collector_thread_local_storage._entry_index_stack, [0, 1])
+        self.assertTrue(data_collector_thread_local_storage.query_profiler_enabled)
+        # The innermost block is folded into its parent, and is not active anymore
+        self.assertEqual(data_collector_thread_local_storage._nesting_depth, 2)
         expected_query_profiled_summary_data = QueryProfiledSummaryData(
             sql_statement_type_counter=Counter({SqlStatement.SELECT: 1}),
             exact_query_duplicates=0,
             total_query_execution_time_in_micros=self.query_execution_time_in_micros,
             total_db_row_count=self.db_row_count,
-            potential_n_plus1_query_count=0)
+            potential_n_plus1_query_count=0,
+            **self.expected_latency_summary)
         self.assertEqual(second_exit_query_profiled_data.summary, expected_query_profiled_summary_data)
 
         # Before third exit
-        self.assertEqual(len(data_collector_thread_local_storage._query_profiled_data_list), 4)
-        self.assertListEqual(data_collector_thread_local_storage._entry_index_stack, [0, 1])
+        self.assertEqual(data_collector_thread_local_storage._nesting_depth, 2)
 
         # Third exit
         third_exit_query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
-        self.assertTrue(data_collector_thread_local_storage._query_profiler_enabled)
-        # Size of list does not decrease, and stack should contain only first enter index
-        self.assertEqual(len(data_collector_thread_local_storage._query_profiled_data_list), 4)
-        self.assertListEqual(data_collector_thread_local_storage._entry_index_stack, [0])
+        self.assertTrue(data_collector_thread_local_storage.query_profiler_enabled)
+        # The innermost block is folded into its parent, and is not active anymore
+        self.assertEqual(data_collector_thread_local_storage._nesting_depth, 1)
         expected_query_profiled_summary_data = QueryProfiledSummaryData(
             sql_statement_type_counter=Counter({SqlStatement.SELECT: 2}),
             exact_query_duplicates=2,
             total_query_execution_time_in_micros=self.query_execution_time_in_micros * 2,
             total_db_row_count=self.db_row_count * 2,
-            potential_n_plus1_query_count=2)
+            potential_n_plus1_query_count=2,
+            **self.expected_latency_summary)
         self.assertEqual(third_exit_query_profiled_data.summary, expected_query_profiled_summary_data)
 
         # Before fourth exit
-        self.assertEqual(len(data_collector_thread_local_storage._query_profiled_data_list), 4)
-        self.assertListEqual(data_collector_thread_local_storage._entry_index_stack, [0])
+        self.assertEqual(data_collector_thread_local_storage._nesting_depth, 1)
 
         # Fourth exit
         fourth_exit_query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
-        self.assertFalse(data_collector_thread_local_storage._query_profiler_enabled)
-        # Size of list does not decrease, and stack should contain only first enter index
-        self.assertEqual(len(data_collector_thread_local_storage._query_profiled_data_list), 0)
-        self.assertListEqual(data_collector_thread_local_storage._entry_index_stack, [])
+        self.assertFalse(data_collector_thread_local_storage.query_profiler_enabled)
+        # No block should be active now
+        self.assertEqual(data_collector_thread_local_storage._nesting_depth, 0)
         expected_query_profiled_summary_data = QueryProfiledSummaryData(
             sql_statement_type_counter=Counter({SqlStatement.SELECT: 3}),
             exact_query_duplicates=3,
             total_query_execution_time_in_micros=self.query_execution_time_in_micros * 3,
             total_db_row_count=self.db_row_count * 3,
-            potential_n_plus1_query_count=3)
+            potential_n_plus1_query_count=3,
+            **self.expected_latency_summary)
         self.assertEqual(fourth_exit_query_profiled_data.summary, expected_query_profiled_summary_data)
 
+    def test_exited_block_data_unchanged_by_parent_block(self):
+        """ Data returned when exiting a nested block should not change when the parent block collects more queries """
+        data_collector_thread_local_storage.enter_profiler_mode(QueryProfilerLevel.QUERY_SIGNATURE)
+        data_collector_thread_local_storage.enter_profiler_mode(QueryProfilerLevel.QUERY_SIGNATURE)
+        for _ in range(2):
+            self._add_query_to_storage((1,))
+        inner_query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
+
+        for _ in range(2):
+            self._add_query_to_storage((1,))
+        outer_query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
+        self._assert_empty_storage()
+
+        self.assertEqual(inner_query_profiled_data.summary.total_query_count, 2)
+        self.assertEqual(sum(inner_query_profiled_data._query_params_db_hash_counter.values()), 2)
+        self.assertEqual(outer_query_profiled_data.summary.total_query_count, 4)
+        self.assertEqual(sum(outer_query_profiled_data._query_params_db_hash_counter.values()), 4)
+
+    def test_query_sampling(self):
+        """ Only every 3rd query is profiled, and the summary should extrapolate the totals from the profiled ones """
+        data_collector_thread_local_storage.enter_profiler_mode(QueryProfilerLevel.QUERY, query_sample_interval=3)
+        for _ in range(6):
+            self._add_query_to_storage((1,))
+        query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
+        self._assert_empty_storage()
+
+        self.assertEqual(query_profiled_data.skipped_query_count, 4)
+        summary = query_profiled_data.summary
+        self.assertEqual(summary.total_query_count, 2)
+        self.assertAlmostEqual(summary.query_sample_rate, 1 / 3)
+        self.assertEqual(summary.estimated_total_query_count, 6)
+        self.assertEqual(summary.estimated_total_query_execution_time_in_micros,
+                         self.query_execution_time_in_micros * 6)
+        self.assertEqual(summary.estimated_total_db_row_count, self.db_row_count * 6)
+        self.assertEqual(summary.sql_statement_type_counter[SqlStatement.SELECT], 2)
+        self.assertEqual(summary.estimated_sql_statement_type_counter[SqlStatement.SELECT], 6)
+        self.assertEqual(summary.as_dict()['estimated_SELECT'], 6)
+
+    def test_query_sampling_nested(self):
+        """ A nested block samples with the smallest interval of its own and its parent block """
+        data_collector_thread_local_storage.enter_profiler_mode(QueryProfilerLevel.QUERY, query_sample_interval=2)
+        data_collector_thread_local_storage.enter_profiler_mode(QueryProfilerLevel.QUERY, query_sample_interval=4)
+        for _ in range(4):
+            self._add_query_to_storage((1,))
+        inner_query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
+        outer_query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
+
+        self.assertEqual(inner_query_profiled_data.summary.total_query_count, 2)
+        self.assertEqual(inner_query_profiled_data.skipped_query_count, 2)
+        self.assertEqual(outer_query_profiled_data.summary.estimated_total_query_count, 4)
+
+    def test_profiler_phase_times(self):
+        """ Time spent by the profiler is reported by phase, and a nested block adds its phases to its parent """
+        data_collector_thread_local_storage.enter_profiler_mode(QueryProfilerLevel.QUERY_SIGNATURE)
+        data_collector_thread_local_storage.enter_profiler_mode(QueryProfilerLevel.QUERY_SIGNATURE)
+        self._add_query_to_storage((1,))
+        inner_query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
+        outer_query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
+
+        for profiler_phase in (ProfilerPhase.NORMALIZATION, ProfilerPhase.STACK_WALK, ProfilerPhase.HASHING,
+                               ProfilerPhase.MERGE):
+            self.assertGreater(inner_query_profiled_data.profiler_phase_to_time_in_nanos[profiler_phase], 0)
+        self.assertEqual(outer_query_profiled_data.profiler_phase_to_time_in_nanos,
+                         inner_query_profiled_data.profiler_phase_to_time_in_nanos)
+        self.assertNotIn(ProfilerPhase.SUMMARY, outer_query_profiled_data.profiler_phase_to_time_in_nanos)
+
+        outer_query_profiled_data.summary  # Reading the summary doesn't change the data
+        self.assertNotIn(ProfilerPhase.SUMMARY, outer_query_profiled_data.profiler_phase_to_time_in_nanos)
+        outer_query_profiled_data.add_profiler_phase_time(ProfilerPhase.SUMMARY, 1000)
+        self.assertEqual(outer_query_profiled_data.profiler_phase_to_time_in_micros[ProfilerPhase.SUMMARY], 1)
+        self.assertEqual(outer_query_profiled_data.time_spent_profiling_in_micros,
+                         sum(outer_query_profiled_data.profiler_phase_to_time_in_nanos.values()) // 1000)
+
+    def test_fetch_statistics(self):
+        """ Rows fetched for a query are added to its query signature, until the block is exited """
+        self.assertIsNone(self._add_query_to_storage((1,)))
+
+        data_collector_thread_local_storage.enter_profiler_mode(QueryProfilerLevel.QUERY_SIGNATURE)
+        query_handle = self._add_query_to_storage((1,))
+        query_handle.add_fetch_data(fetched_row_count=10, fetch_time_in_micros=3)
+        query_handle.add_fetch_data(fetched_row_count=5, fetch_time_in_micros=2)
+        query_profiled_data = data_collector_thread_local_storage.exit_profiler_mode()
+        query_handle.add_fetch_data(fetched_row_count=100, fetch_time_in_micros=100)
+        self._assert_empty_storage()
+
+        query_signature_statistics, = query_profiled_data.query_signature_to_query_signature_statistics.values()
+        self.assertEqual(query_signature_statistics.fetched_row_count, 15)
+        self.assertEqual(query_signature_statistics.fetch_time_in_micros, 5)
+        self.assertEqual(query_signature_statistics.total_time_in_micros, self.query_execution_time_in_micros + 5)
+        self.assertEqual(query_profiled_data.summary.total_fetched_row_count, 15)
+        self.assertEqual(query_profiled_data.summary.total_fetch_time_in_micros, 5)
+
     def _assert_empty_storage(self) -> None:
         """ This is a helper function for checking if thread local storage is all empty or not"""
-        self.assertFalse(data_collector_thread_local_storage._query_profiler_enabled)
-        self.assertListEqual(data_collector_thread_local_storage._query_profiled_data_list, [])
-        self.assertListEqual(data_collector_thread_local_storage._entry_index_stack, [])
+        self.assertFalse(data_collector_thread_local_storage.query_profiler_enabled)
+        self.assertIsNone(data_collector_thread_local_storage._innermost_block)
+        self.assertEqual(data_collector_thread_local_storage._nesting_depth, 0)
 
-    def _add_query_to_storage(self, params: Any) -> None:
+    def _add_query_to_storage(self, params: Any) -> Optional[QueryHandle]:
         """
         This function adds one query to the thread local storage.  Note that the stack trace is calculated
         by the function data_collector_thread_local_storage#add_query_profiler_data, and hence if we are
         calling this function from different line numbers - they would have a different stack trace
         """
-        data_collector_thread_local_storage.add_query_profiler_data(
+        return data_collector_thread_local_storage.add_query_profiler_data(
             query_without_params=self.query_without_params,
             params=params,
             target_db=self.target_db,
@@ -0,0 +1,80 @@
+import asyncio
+import sys
+from unittest import TestCase, skipIf
+
+from asgiref.sync import sync_to_async
+
+from django_query_profiler.client.context_manager import QueryProfiler
+from django_query_profiler.query_profiler_storage import QueryProfiledData, QueryProfilerLevel, SqlStatement
+from django_query_profiler.query_profiler_storage.data_collector import data_collector_storage
+
+
+@skipIf(sys.version_info < (3, 7), 'asyncio.run is in python >= 3.7')
+class DataStorageAsyncTest(TestCase):
+    """
+    Tests for checking that the profiled data of concurrent coroutines is not mixed up, and that the queries run in the
+    children of a coroutine (by asyncio.gather, or in a thread by sync_to_async) are profiled in its block
+    """
+
+    def setUp(self):
+        data_collector_storage.reset()
+
+    @staticmethod
+    def _add_query_to_storage(table_name: str) -> None:
+        data_collector_storage.add_query_profiler_data(
+            query_without_params=f"SELECT 1 FROM {table_name} where id=%s",
+            params=(1,),
+            target_db='default',
+            query_execution_time_in_micros=1,
+            db_row_count=1)
+
+    @staticmethod
+    def _select_count(query_profiled_data: QueryProfiledData) -> int:
+        return query_profiled_data.summary.sql_statement_type_counter[SqlStatement.SELECT]
+
+    def test_concurrent_coroutines_isolated(self):
+        async def profiled_request(query_count: int) -> QueryProfiledData:
+            async with QueryProfiler(QueryProfilerLevel.QUERY) as query_profiler:
+                for _ in range(query_count):
+                    self._add_query_to_storage('table')
+                    await asyncio.sleep(0)  # Lets the other coroutine run in between
+            return query_profiler.query_profiled_data
+
+        async def main():
+            return await asyncio.gather(profiled_request(3), profiled_request(5))
+
+        query_profiled_data1, query_profiled_data2 = asyncio.run(main())
+        self.assertEqual(self._select_count(query_profiled_data1), 3)
+        self.assertEqual(self._select_count(query_profiled_data2), 5)
+
+    def test_gather_and_sync_to_async_children_profiled(self):
+        async def child_coroutine():
+            await asyncio.sleep(0)
+            self._add_query_to_storage('table_in_coroutine')
+
+        async def main() -> QueryProfiledData:
+            async with QueryProfiler(QueryProfilerLevel.QUERY) as query_profiler:
+                self._add_query_to_storage('table')
+                await asyncio.gather(child_coroutine(), child_coroutine())
+                await sync_to_async(self._add_query_to_storage)('table_in_thread')
+            return query_profiler.query_profiled_data
+
+        self.assertEqual(self._select_count(asyncio.run(main())), 4)
+
+    def test_nested_block_in_child_coroutine(self):
+        """ A block entered in a child coroutine returns its own data, and the data is also folded in the parent """
+        async def child_coroutine() -> QueryProfiledData:
+            async with QueryProfiler(QueryProfilerLevel.QUERY) as query_profiler:
+                self._add_query_to_storage('table_in_coroutine')
+            return query_profiler.query_profiled_data
+
+        async def main():
+            async with QueryProfiler(QueryProfilerLevel.QUERY) as query_profiler:
+                self._add_query_to_storage('table')
+                child_query_profiled_data, = await asyncio.gather(child_coroutine())
+            return query_profiler.query_profiled_data, child_query_profiled_data
+
+        query_profiled_data, child_query_profiled_data = asyncio.run(main())
+        self.assertEqual(self._select_count(child_query_profiled_data), 1)
+        self.assertEqual(self._select_count(query_profiled_data), 2)
+        self.assertFalse(data_collector_storage.query_profiler_enabled)
@@ -0,0 +1,49 @@
+from unittest import TestCase
+
+from django_query_profiler.query_profiler_storage import LatencyHistogram, QuerySignatureStatistics
+
+
+class LatencyHistogramTest(TestCase):
+    """ Tests for checking the percentiles read from the histogram, and if adding histograms is correct """
+
+    def test_empty_histogram(self):
+        self.assertIsNone(LatencyHistogram().percentile(50))
+
+    def test_percentile_error_is_bounded(self):
+        for query_execution_time_in_micros in (1, 7, 100, 12345, 800 * 1000):
+            histogram = LatencyHistogram.from_query_execution_time(query_execution_time_in_micros)
+            percentile = histogram.percentile(50)
+            self.assertGreaterEqual(percentile, query_execution_time_in_micros)
+            self.assertLessEqual(percentile, query_execution_time_in_micros * 2 ** (1 / 4) + 1)
+
+    def test_zero_and_huge_times(self):
+        self.assertEqual(LatencyHistogram.from_query_execution_time(0).percentile(50), 0)
+        huge_histogram = LatencyHistogram.from_query_execution_time(2 ** 40)
+        self.assertEqual(list(huge_histogram.bucket_index_to_count), [LatencyHistogram.MAX_BUCKET_INDEX])
+
+    def test_histogram_addition(self):
+        histogram = sum(LatencyHistogram.from_query_execution_time(time) for time in (10, 10, 10, 1000))
+        self.assertEqual(sum(histogram.bucket_index_to_count.values()), 4)
+        self.assertEqual(len(histogram.bucket_index_to_count), 2)
+        self.assertLess(histogram.percentile(50), 20)
+        self.assertGreater(histogram.percentile(99), 1000)
+
+    def test_outlier_visible_in_statistics(self):
+        """ One slow query hidden in 500 fast N+1 queries should show up in the max, but not in the percentiles """
+        query_execution_times = [100] * 500 + [800 * 1000]
+        query_signature_statistics = sum(
+            (QuerySignatureStatistics(
+                frequency=1,
+                query_execution_time_in_micros=time,
+                db_row_count=None,
+                min_query_execution_time_in_micros=time,
+                max_query_execution_time_in_micros=time,
+                latency_histogram=LatencyHistogram.from_query_execution_time(time))
+             for time in query_execution_times[1:]),
+            QuerySignatureStatistics(1, 100, None, 100, 100, LatencyHistogram.from_query_execution_time(100)))
+
+        self.assertEqual(query_signature_statistics.frequency, 501)
+        self.assertEqual(query_signature_statistics.min_query_execution_time_in_micros, 100)
+        self.assertEqual(query_signature_statistics.max_query_execution_time_in_micros, 800 * 1000)
+        self.assertLess(query_signature_statistics.p50_query_execution_time_in_micros, 120)
+        self.assertLess(query_signature_statistics.p99_query_execution_time_in_micros, 120)
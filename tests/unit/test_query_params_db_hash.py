@@ -0,0 +1,42 @@
+from datetime import date
+from unittest import TestCase
+
+from django_query_profiler.query_profiler_storage.data_collector import query_params_db_hash
+
+
+class QueryParamsDbHashTest(TestCase):
+    """ Tests for checking the key for exact duplicate queries, for all the shapes of params """
+
+    query_without_params = "SELECT 1 FROM table where id=%s"
+
+    def _assert_duplicates(self, params1, params2):
+        self.assertEqual(query_params_db_hash(self.query_without_params, params1, 'default'),
+                         query_params_db_hash(self.query_without_params, params2, 'default'))
+
+    def _assert_not_duplicates(self, params1, params2):
+        self.assertNotEqual(query_params_db_hash(self.query_without_params, params1, 'default'),
+                            query_params_db_hash(self.query_without_params, params2, 'default'))
+
+    def test_list_and_tuple_params(self):
+        self._assert_duplicates([1, 'a', date(2020, 1, 1)], (1, 'a', date(2020, 1, 1)))
+        self._assert_not_duplicates([1], [2])
+
+    def test_empty_params(self):
+        self._assert_duplicates(None, [])
+        self._assert_duplicates(None, ())
+
+    def test_dict_params(self):
+        self._assert_duplicates({'id': 1}, {'id': 1})
+        self._assert_not_duplicates({'id': 1}, {'id': 2})
+
+    def test_unhashable_params(self):
+        """ For executemany & array columns, params have lists in them """
+        self._assert_duplicates([[1, 2], [3, 4]], [[1, 2], [3, 4]])
+        self._assert_not_duplicates([[1, 2], [3, 4]], [[1, 2], [3, 5]])
+        self._assert_duplicates({'ids': [1, 2]}, {'ids': [1, 2]})
+
+    def test_sql_and_db_are_part_of_key(self):
+        self.assertNotEqual(query_params_db_hash(self.query_without_params, [1], 'default'),
+                            query_params_db_hash(self.query_without_params, [1], 'replica'))
+        self.assertNotEqual(query_params_db_hash(self.query_without_params, [1], 'default'),
+                            query_params_db_hash("SELECT 2 FROM table where id=%s", [1], 'default'))
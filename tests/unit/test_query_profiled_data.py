@@ -2,7 +2,7 @@ from collections import Counter
 from unittest import TestCase
 
 from django_query_profiler.query_profiler_storage import (
-    QueryProfiledData, QueryProfiledSummaryData, QuerySignature, QuerySignatureStatistics, SqlStatement,
+    ProfilerPhase, QueryProfiledData, QueryProfiledSummaryData, QuerySignature, QuerySignatureStatistics, SqlStatement,
     StackTraceElement
 )
 
@@ -121,3 +121,16 @@ class QueryProfiledDataTest(TestCase):
 
         self.assertEqual(combined_query_profiled_data, expected_query_profiled_data)
         self.assertEqual(sum([query_profiled_data_1, query_profiled_data_2]), expected_query_profiled_data)
+
+    def test_time_spent_profiling_in_constructor(self):
+        """ The time passed to the constructor is the time of the OTHER phase, and the time of the phases is added """
+        query_profiled_data = QueryProfiledData(
+            query_signature_to_query_signature_statistics={self.query_signature_1: self.query_signature_statistics_1},
+            time_spent_profiling_in_micros=100)
+        self.assertEqual(query_profiled_data.time_spent_profiling_in_micros, 100)
+        self.assertEqual(query_profiled_data.profiler_phase_to_time_in_micros[ProfilerPhase.OTHER], 100)
+
+        query_profiled_data.add_profiler_phase_time(ProfilerPhase.SUMMARY, 50 * 1000)
+        self.assertEqual(query_profiled_data.time_spent_profiling_in_micros, 150)
+        self.assertEqual((query_profiled_data + QueryProfiledData()).time_spent_profiling_in_micros, 150)
+        self.assertEqual(QueryProfiledData().time_spent_profiling_in_micros, 0)
@@ -1,6 +1,8 @@
 from unittest import TestCase
 
-from django_query_profiler.query_profiler_storage import QuerySignature, QuerySignatureAnalyzeResult, StackTraceElement
+from django_query_profiler.query_profiler_storage import (
+    QuerySignature, QuerySignatureAnalyzeResult, StackTraceElement, django_stack_trace_analyze
+)
 from django_query_profiler.query_profiler_storage.django_stack_trace_analyze import _parse_sql_for_tables_and_eq
 
 
@@ -221,3 +223,53 @@ class QuerySignatureAnalyzeTest(TestCase):
                               StackTraceElement('django.db.models.query', 'first', None)]
         query_signature: QuerySignature = QuerySignature(query_without_params, (), django_stack_trace, 'default')
         self.assertEqual(query_signature.analysis, QuerySignatureAnalyzeResult.UNKNOWN)
+
+    def test_code_recommendation_cached_for_process(self):
+        """ Query signatures that differ only in the app stack trace share the cached recommendation """
+        django_stack_trace_analyze.cache_clear()
+        query_without_params = 'SELECT (1) AS a FROM toppings WHERE toppings.is_spicy = %s LIMIT 1'
+        django_stack_trace = (StackTraceElement('django.db.models.sql.compiler', 'execute_sql', None),
+                              StackTraceElement('django.db.models.query', 'exists', None))
+        for line_number in (10, 20):
+            app_stack_trace = (StackTraceElement('app.views', 'index', line_number),)
+            query_signature = QuerySignature(query_without_params, app_stack_trace, django_stack_trace, 'default')
+            self.assertEqual(query_signature.analysis, QuerySignatureAnalyzeResult.FILTER)
+
+        cache_info = django_stack_trace_analyze.cache_info()
+        self.assertEqual(cache_info['misses'], 1)
+        self.assertEqual(cache_info['hits'], 1)
+        self.assertEqual(cache_info['currsize'], 1)
+
+    def test_parse_django_quoted_sql(self):
+        """ The sql that the ORM generates quotes the names, and has clauses that are not looked at """
+        query_without_params = '''
+            SELECT "toppings"."id", "toppings"."name" FROM "toppings"
+                INNER JOIN "pizza_toppings" ON ("toppings"."id" = "pizza_toppings"."topping_id")
+            WHERE ("pizza_toppings"."pizza_id" = %s)
+            ORDER BY "toppings"."name" ASC
+        '''
+        self.assertTupleEqual(_parse_sql_for_tables_and_eq(query_without_params),
+                              (['toppings', 'pizza_toppings'], True, 'pizza_toppings.pizza_id'))
+
+        query_without_params = '''
+            SELECT "toppings"."id" FROM "toppings"
+            WHERE NOT ("toppings"."name" LIKE %s ESCAPE '\\') AND "toppings"."id" = %s
+        '''
+        self.assertTupleEqual(_parse_sql_for_tables_and_eq(query_without_params), (['toppings'], True, ''))
+
+    def test_parse_sub_queries(self):
+        """ Only the top level FROM & WHERE clauses are looked at """
+        query_without_params = '''
+            SELECT COUNT(*) FROM (SELECT DISTINCT "pizza"."id" AS "col1" FROM "pizza" WHERE "pizza"."id" = %s) subquery
+        '''
+        self.assertTupleEqual(_parse_sql_for_tables_and_eq(query_without_params), ([], False, ''))
+
+        query_without_params = '''
+            SELECT "pizza"."id" FROM "pizza" AS "p", restaurant r
+            WHERE EXISTS(SELECT %s AS "a" FROM "restaurant" U0 WHERE U0."best_pizza_id" = ("pizza"."id") LIMIT 1)
+        '''
+        self.assertTupleEqual(_parse_sql_for_tables_and_eq(query_without_params), (['pizza', 'restaurant'], True, ''))
+
+    def test_parse_unbalanced_parentheses(self):
+        with self.assertRaises(Exception):
+            _parse_sql_for_tables_and_eq('SELECT "pizza"."id" FROM "pizza" WHERE ("pizza"."id" = %s')
@@ -0,0 +1,76 @@
+import gc
+import pickle
+from unittest import TestCase
+
+from django_query_profiler.query_profiler_storage import (
+    INTERNED_QUERY_SIGNATURES, QuerySignature, QuerySignatureStatistics, StackTraceElement, intern_stack_trace
+)
+
+
+class QuerySignatureInterningTest(TestCase):
+    """ Tests for checking that repeated query signatures, and their stack traces, share one canonical instance """
+
+    query_without_params = "SELECT 1 FROM table where id=%s"
+
+    def _query_signature(self) -> QuerySignature:
+        return QuerySignature.intern(
+            query_without_params=self.query_without_params,
+            app_stack_trace=(StackTraceElement.app_stacktrace_element('app.views', 'index', 10),),
+            django_stack_trace=(StackTraceElement.django_stacktrace_element('django.db.models.query', 'get'),),
+            target_db='default')
+
+    def test_stack_trace_element_interned(self):
+        self.assertIs(StackTraceElement.app_stacktrace_element('app.views', 'index', 10),
+                      StackTraceElement.app_stacktrace_element('app.views', 'index', 10))
+        self.assertIs(StackTraceElement.django_stacktrace_element('django.db.models.query', 'get'),
+                      StackTraceElement('django.db.models.query', 'get').intern('django.db.models.query', 'get', None))
+
+    def test_query_signature_interned(self):
+        query_signature = self._query_signature()
+        self.assertIs(query_signature, self._query_signature())
+
+        # Instances that are not interned are still equal, and have the same hash
+        query_signature_not_interned = QuerySignature(
+            query_without_params=self.query_without_params,
+            app_stack_trace=(StackTraceElement('app.views', 'index', 10),),
+            django_stack_trace=[StackTraceElement('django.db.models.query', 'get')],
+            target_db='default')
+        self.assertIsNot(query_signature, query_signature_not_interned)
+        self.assertEqual(query_signature, query_signature_not_interned)
+        self.assertEqual(hash(query_signature), hash(query_signature_not_interned))
+
+    def test_stack_traces_interned(self):
+        """ A query signature keeps the canonical stack traces, which is what it is interned by """
+        query_signature = self._query_signature()
+        app_stack_trace = (StackTraceElement.app_stacktrace_element('app.views', 'index', 10),)
+        self.assertIsNot(app_stack_trace, query_signature.app_stack_trace)
+        self.assertIs(intern_stack_trace(app_stack_trace), query_signature.app_stack_trace)
+        self.assertIs(intern_stack_trace(query_signature.app_stack_trace), query_signature.app_stack_trace)
+        self.assertIs(QuerySignature.intern(self.query_without_params, app_stack_trace,
+                                            list(query_signature.django_stack_trace), 'default'),
+                      query_signature)
+
+    def test_query_signature_released_when_not_referenced(self):
+        query_signature = self._query_signature()
+        self.assertIn(query_signature, INTERNED_QUERY_SIGNATURES.values())
+
+        del query_signature
+        gc.collect()
+        interned_queries = [query_signature.query_without_params
+                            for query_signature in INTERNED_QUERY_SIGNATURES.values()]
+        self.assertNotIn(self.query_without_params, interned_queries)
+
+    def test_pickling_returns_canonical_instance(self):
+        query_signature = self._query_signature()
+        self.assertIs(pickle.loads(pickle.dumps(query_signature)), query_signature)
+        self.assertIs(pickle.loads(pickle.dumps(query_signature.app_stack_trace[0])),
+                      query_signature.app_stack_trace[0])
+
+        query_signature_statistics = QuerySignatureStatistics(frequency=1, query_execution_time_in_micros=1,
+                                                              db_row_count=None)
+        self.assertEqual(pickle.loads(pickle.dumps(query_signature_statistics)), query_signature_statistics)
+
+    def test_no_instance_dict(self):
+        self.assertFalse(hasattr(self._query_signature(), '__dict__'))
+        self.assertFalse(hasattr(StackTraceElement.app_stacktrace_element('app.views', 'index', 10), '__dict__'))
+        self.assertFalse(hasattr(QuerySignatureStatistics(1, 1, None), '__dict__'))
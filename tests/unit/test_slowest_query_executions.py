@@ -0,0 +1,103 @@
+import pickle
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from django.test import override_settings
+
+from django_query_profiler.query_profiler_storage import (
+    EXECUTEMANY_PARAM_SETS_KEPT, QueryExecution, QuerySignatureStatistics, QuerySignatureStatisticsAccumulator
+)
+
+
+class SlowestQueryExecutionsTest(TestCase):
+    """ Tests for checking that only the slowest executions are kept, and that they can be reproduced """
+
+    @staticmethod
+    def _query_signature_statistics(query_execution_time_in_micros: int) -> QuerySignatureStatistics:
+        return QuerySignatureStatistics(
+            frequency=1,
+            query_execution_time_in_micros=query_execution_time_in_micros,
+            db_row_count=None,
+            slowest_query_executions=(
+                QueryExecution(query_execution_time_in_micros, "SELECT * FROM t WHERE id=%s",
+                               [query_execution_time_in_micros]),))
+
+    @override_settings(DJANGO_QUERY_PROFILER_SLOWEST_QUERY_EXECUTIONS_PER_SIGNATURE=3)
+    def test_only_slowest_executions_kept(self):
+        query_execution_times = [5, 50, 1, 500, 7, 70, 3]
+        query_signature_statistics = sum(
+            (self._query_signature_statistics(time) for time in query_execution_times[1:]),
+            self._query_signature_statistics(query_execution_times[0]))
+
+        self.assertEqual(query_signature_statistics.frequency, len(query_execution_times))
+        self.assertEqual(
+            [execution.query_execution_time_in_micros
+             for execution in query_signature_statistics.slowest_query_executions_sorted],
+            [500, 70, 50])
+        self.assertEqual(query_signature_statistics.slowest_query_executions_sorted[0].params, [500])
+
+    @override_settings(DJANGO_QUERY_PROFILER_SLOWEST_QUERY_EXECUTIONS_PER_SIGNATURE=1)
+    def test_memory_bounded(self):
+        query_signature_statistics = sum(
+            (self._query_signature_statistics(time) for time in range(1, 1000)), self._query_signature_statistics(0))
+        self.assertEqual(len(query_signature_statistics.slowest_query_executions), 1)
+        self.assertEqual(query_signature_statistics.slowest_query_executions[0].query_execution_time_in_micros, 999)
+
+    def test_params_captured_only_for_slowest_executions(self):
+        """ The params are copied only for an execution that enters the heap of the slowest executions """
+        query_signature_statistics_accumulator = QuerySignatureStatisticsAccumulator()
+        with patch.object(QueryExecution, 'capture', wraps=QueryExecution.capture) as capture:
+            for time in [5, 50, 1, 500, 7, 70, 3]:
+                query_signature_statistics_accumulator.add_query(time, None, "SELECT * FROM t WHERE id=%s", [time],
+                                                                 is_executemany=False, slowest_query_execution_count=3)
+        query_signature_statistics = query_signature_statistics_accumulator.freeze()
+
+        self.assertEqual([args[0] for args, _ in capture.call_args_list], [5, 50, 1, 500, 7, 70])
+        self.assertEqual(query_signature_statistics.frequency, 7)
+        self.assertEqual(
+            [execution.query_execution_time_in_micros
+             for execution in query_signature_statistics.slowest_query_executions_sorted],
+            [500, 70, 50])
+
+    def test_query_with_params(self):
+        self.assertEqual(
+            QueryExecution(1, "SELECT * FROM t WHERE a=%s AND b=%s AND c IS %s", ["it's", 2, None]).query_with_params,
+            "SELECT * FROM t WHERE a='it''s' AND b=2 AND c IS NULL")
+        self.assertEqual(
+            QueryExecution(1, "SELECT * FROM t WHERE a=%(a)s", {'a': True}).query_with_params,
+            "SELECT * FROM t WHERE a=TRUE")
+        self.assertEqual(QueryExecution(1, "SELECT '%'", None).query_with_params, "SELECT '%'")
+        # Params not matching the query, like in executemany
+        self.assertIsNone(QueryExecution(1, "INSERT INTO t VALUES (%s)", [[1], [2]]).query_with_params)
+
+    def test_pickling_with_unpicklable_params(self):
+        query_execution = QueryExecution(1, "SELECT %s, %s", (1, threading.Lock()))
+        unpickled_query_execution = pickle.loads(pickle.dumps(query_execution))
+        self.assertEqual(unpickled_query_execution.params[0], 1)
+        self.assertIsInstance(unpickled_query_execution.params[1], str)
+
+    def test_capture_copies_params(self):
+        """ Changing the params passed to the cursor after the query was executed doesn't change the captured ones """
+        params = ["it's", 2]
+        query_execution = QueryExecution.capture(1, "SELECT * FROM t WHERE a=%s AND b=%s", params)
+        params.append(3)
+        self.assertEqual(query_execution.params, ("it's", 2))
+        self.assertEqual(query_execution.query_with_params, "SELECT * FROM t WHERE a='it''s' AND b=2")
+
+    def test_capture_executemany(self):
+        """ Only the first parameter sets of an executemany are kept, and their count """
+        param_sets = [[index, 'name'] for index in range(EXECUTEMANY_PARAM_SETS_KEPT * 100)]
+        query_execution = QueryExecution.capture(1, "INSERT INTO t VALUES (%s, %s)", param_sets, is_executemany=True)
+        self.assertEqual(len(query_execution.params), EXECUTEMANY_PARAM_SETS_KEPT)
+        self.assertEqual(query_execution.params[0], (0, 'name'))
+        self.assertEqual(query_execution.param_set_count, EXECUTEMANY_PARAM_SETS_KEPT * 100)
+        self.assertIsNone(query_execution.query_with_params)
+        self.assertTrue(query_execution.params_repr.endswith(
+            f'the first {EXECUTEMANY_PARAM_SETS_KEPT} of {EXECUTEMANY_PARAM_SETS_KEPT * 100} parameter sets'))
+        self.assertEqual(pickle.loads(pickle.dumps(query_execution)), query_execution)
+        self.assertEqual(pickle.loads(pickle.dumps(query_execution)).param_set_count, query_execution.param_set_count)
+
+    def test_params_repr_abbreviated(self):
+        query_execution = QueryExecution.capture(1, "SELECT * FROM t WHERE a IN %s", [list(range(10000)), 'x' * 10000])
+        self.assertLess(len(query_execution.params_repr), 1000)
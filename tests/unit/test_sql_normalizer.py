@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+from django.test import override_settings
+
+from django_query_profiler.query_profiler_storage import (
+    QueryProfilerLevel, SqlNormalization, SqlStatement, sql_normalizer
+)
+from django_query_profiler.query_profiler_storage.data_collector import data_collector_storage
+
+
+class SqlNormalizerTest(TestCase):
+    """ Tests for checking the normalized sql, and that the results are cached """
+
+    def setUp(self):
+        sql_normalizer.cache_clear()
+
+    def test_normalize_repeated_params(self):
+        self.assertEqual(sql_normalizer.normalize_repeated_params("SELECT * FROM t WHERE id IN (%s, %s, %s)"),
+                         "SELECT * FROM t WHERE id IN (%s)")
+        self.assertEqual(sql_normalizer.normalize_repeated_params("SELECT * FROM t WHERE id=%s AND a=%s"),
+                         "SELECT * FROM t WHERE id=%s AND a=%s")
+
+    def test_fingerprint(self):
+        expected_fingerprint = 'SELECT * FROM "t" WHERE "a" = ? AND "id" IN (?)'
+        for query_without_params in (
+                'SELECT * FROM "t" WHERE "a" = %s AND "id" IN (%s, %s, %s)',
+                '''SELECT * FROM "t" WHERE "a" = 'it''s -- not a comment' AND "id" IN (1, 2) -- a comment''',
+                'SELECT  *\n FROM "t" /* a comment */ WHERE "a" = :arg0 AND "id" IN (:arg1);',
+                'SELECT * FROM "t" WHERE "a" = %(a)s AND "id" IN (0x1F, 1.5e3)'):
+            self.assertEqual(sql_normalizer.fingerprint(query_without_params), expected_fingerprint)
+
+    def test_fingerprint_keeps_identifiers_and_casts(self):
+        self.assertEqual(sql_normalizer.fingerprint('SELECT "t1"."col_2" FROM "t1" WHERE "t1"."a"::int = 3'),
+                         'SELECT "t1"."col_2" FROM "t1" WHERE "t1"."a"::int = ?')
+
+    def test_fingerprint_values_tuples(self):
+        self.assertEqual(sql_normalizer.fingerprint("INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)"),
+                         sql_normalizer.fingerprint("INSERT INTO t (a, b) VALUES (1, 'x')"))
+
+    def test_query_level_groups_by_fingerprint(self):
+        data_collector_storage.reset()
+        data_collector_storage.enter_profiler_mode(QueryProfilerLevel.QUERY)
+        for user_id in range(3):
+            data_collector_storage.add_query_profiler_data(f"SELECT * FROM user WHERE id = {user_id}", None,
+                                                           'default', 1, None)
+        query_profiled_data = data_collector_storage.exit_profiler_mode()
+        self.assertEqual(len(query_profiled_data.query_signature_to_query_signature_statistics), 1)
+
+    def test_query_profiler_level_normalize_sql(self):
+        """ The attribute from before a level had a SqlNormalization is still there, and is read-only """
+        self.assertTrue(QueryProfilerLevel.QUERY.normalize_sql)
+        self.assertTrue(QueryProfilerLevel.QUERY_SIGNATURE.normalize_sql)
+        with self.assertRaises(AttributeError):
+            QueryProfilerLevel.QUERY.normalize_sql = False
+
+    @override_settings(DJANGO_QUERY_PROFILER_SQL_NORMALIZATION_FUNC=lambda _: SqlNormalization.NONE)
+    def test_sql_normalization_from_settings(self):
+        data_collector_storage.reset()
+        data_collector_storage.enter_profiler_mode(QueryProfilerLevel.QUERY)
+        for param_count in range(1, 4):
+            data_collector_storage.add_query_profiler_data(
+                f"SELECT * FROM user WHERE id IN ({', '.join(['%s'] * param_count)})", [1] * param_count,
+                'default', 1, None)
+        query_profiled_data = data_collector_storage.exit_profiler_mode()
+        self.assertEqual(len(query_profiled_data.query_signature_to_query_signature_statistics), 3)
+
+    def test_cache_hits_and_misses(self):
+        query_without_params = "SELECT * FROM t WHERE id IN (%s, %s)"
+        for _ in range(3):
+            sql_normalizer.normalize_repeated_params(query_without_params)
+            self.assertEqual(SqlStatement.from_sql(query_without_params), SqlStatement.SELECT)
+
+        cache_info = sql_normalizer.cache_info()
+        self.assertEqual(cache_info['fingerprint']['currsize'], 0)
+        for name in ('normalize_repeated_params', 'sql_statement_from_sql'):
+            self.assertEqual(cache_info[name]['misses'], 1)
+            self.assertEqual(cache_info[name]['hits'], 2)
+            self.assertEqual(cache_info[name]['currsize'], 1)
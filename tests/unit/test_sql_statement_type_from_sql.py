@@ -36,6 +36,11 @@ class SqlStatementFromSqlTest(TestCase):
         sql_statement = SqlStatement.from_sql(query)
         self.assertEqual(sql_statement, SqlStatement.TRANSACTIONALS)
 
+    def test_savepoints(self):
+        for query in ('SAVEPOINT "s1_x1"', 'RELEASE SAVEPOINT "s1_x1"', 'ROLLBACK TO SAVEPOINT "s1_x1"'):
+            sql_statement = SqlStatement.from_sql(query)
+            self.assertEqual(sql_statement, SqlStatement.TRANSACTIONALS)
+
     def test_other(self):
         query = "END2"
         sql_statement = SqlStatement.from_sql(query)
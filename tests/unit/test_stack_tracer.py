@@ -1,5 +1,9 @@
-from typing import Dict, Set
+import sys
+import threading
+from types import CodeType, FrameType
+from typing import Callable, Dict, List, Optional, Set, Tuple
 from unittest import TestCase
+from unittest.mock import patch
 
 from django_query_profiler.query_profiler_storage import stack_tracer
 
@@ -20,14 +24,9 @@ class StackTracerTest(TestCase):
         self.assertEqual(self.__module__, app_module_names[1])
         self.assertTrue('unittest' in app_module_names[2])
 
-        # Checking if the cache was populated correctly.  All module_names would have value as True
-        memoized_value_app_modules = stack_tracer.MEMO_APP_MODULE_NAME_DECISION[()]
-
-        self.assertSetEqual(_keys_set_for_passed_value(memoized_value_app_modules, True), set(app_module_names))
-        self.assertEqual(_keys_set_for_passed_value(memoized_value_app_modules, False), set())
-
-        memoized_value_django_modules = stack_tracer.MEMO_DJANGO_MODULE_NAME_DECISION[()]
-        self.assertEqual(_keys_set_for_passed_value(memoized_value_django_modules, False), set(app_module_names))
+        # Checking if the cache was populated correctly.  All code objects would be of app frames
+        code_to_decision = stack_tracer.code_decision_memo((), ())
+        self.assertTrue(set(app_module_names) <= _app_module_names(code_to_decision))
 
     def test_valid_app_params(self):
         app_stack_trace, django_stack_trace = stack_tracer.find_stack_trace(
@@ -50,14 +49,9 @@ class StackTracerTest(TestCase):
         self.assertEqual(self.__module__, app_module_names[1])
         self.assertTrue('unittest' in app_module_names[2])
 
-        # Checking if the cache was populated correctly.  All module_names would have value as True
-        memoized_value_app_modules = stack_tracer.MEMO_APP_MODULE_NAME_DECISION[('random_does_not_exist',)]
-
-        self.assertSetEqual(_keys_set_for_passed_value(memoized_value_app_modules, True), set(app_module_names))
-        self.assertEqual(_keys_set_for_passed_value(memoized_value_app_modules, False), set())
-
-        memoized_value_django_modules = stack_tracer.MEMO_DJANGO_MODULE_NAME_DECISION[()]
-        self.assertEqual(_keys_set_for_passed_value(memoized_value_django_modules, False), set(app_module_names))
+        # Checking if the cache was populated correctly.  All code objects would be of app frames
+        code_to_decision = stack_tracer.code_decision_memo(('random_does_not_exist',), ())
+        self.assertTrue(set(app_module_names) <= _app_module_names(code_to_decision))
 
     def test_valid_django_params(self):
         app_stack_trace, django_stack_trace = stack_tracer.find_stack_trace(
@@ -69,7 +63,151 @@ class StackTracerTest(TestCase):
         self.assertTrue(self.__module__ in django_module_names)
         self.assertTrue(any(module_name.startswith('unittest') for module_name in django_module_names))
 
+    def test_code_decision_memoized(self):
+        """ The decision is memoized per code object, and an app frame gets an element per line number """
+        stack_traces = []
+        for _ in range(2):
+            stack_traces.append(stack_tracer.find_stack_trace(('unittest',), (), 100)[0])
+        self.assertEqual(stack_traces[0], stack_traces[1])
+        self.assertIs(stack_traces[0][1], stack_traces[1][1])
+
+        code_to_decision = stack_tracer.code_decision_memo(('unittest',), ())
+        code, code_decision = code_to_decision[id(self.test_code_decision_memoized.__code__)]
+        self.assertIs(code, self.test_code_decision_memoized.__code__)
+        self.assertEqual(code_decision.module_name, self.__module__)
+        self.assertIn(stack_traces[0][1], code_decision.line_number_to_stack_trace_element.values())
+        self.assertTrue(any(code_decision is None for _, code_decision in code_to_decision.values()))  # unittest frames
+
+    def test_code_decision_of_identical_functions(self):
+        """ Identical functions of two modules have equal code objects, but each has the decision of its module """
+        functions = _identical_functions(('myapp.views', 'otherapp.views'))
+        self.assertEqual(functions[0].__code__, functions[1].__code__)
+
+        app_module_names_to_exclude = (stack_tracer.find_stack_trace.__module__, self.__module__, 'unittest')
+        for function, module_name in zip(functions, ('myapp.views', 'otherapp.views')):
+            app_stack_trace, _ = function(lambda: stack_tracer.find_stack_trace(app_module_names_to_exclude, (), 100))
+            self.assertEqual(app_stack_trace[0].module_name, module_name)
+
+    def test_code_decision_memo_per_thread(self):
+        """ Every thread has its own memo, and it is cleared once it is full """
+        stack_tracer.find_stack_trace(('unittest',), (), 100)
+        code_to_decision = stack_tracer.code_decision_memo(('unittest',), ())
+        self.assertTrue(code_to_decision)
+
+        code_to_decision_of_other_thread = []
+        thread = threading.Thread(
+            target=lambda: code_to_decision_of_other_thread.append(stack_tracer.code_decision_memo(('unittest',), ())))
+        thread.start()
+        thread.join()
+        self.assertIsNot(code_to_decision_of_other_thread[0], code_to_decision)
+        self.assertEqual(code_to_decision_of_other_thread[0], {})
+
+        with patch.object(stack_tracer, 'CODE_DECISION_MEMO_MAX_SIZE', len(code_to_decision)):
+            self.assertEqual(stack_tracer.code_decision_memo(('unittest',), ()), {})
+
+    def test_raw_stack_trace(self):
+        """ A raw stack trace is interned, and has the same stack traces that find_stack_trace finds """
+        raw_stack_traces = []
+        for _ in range(2):
+            raw_stack_traces.append(stack_tracer.capture_raw_stack_trace(100))
+        self.assertIs(raw_stack_traces[0], raw_stack_traces[1])
+
+        app_module_names_to_exclude = (stack_tracer.__name__, 'unittest')
+        stack_traces = []
+        for is_lazy in (True, False):
+            stack_traces.append(_stack_traces(app_module_names_to_exclude, is_lazy))
+        self.assertTupleEqual(stack_traces[0], stack_traces[1])
+        app_stack_trace, django_stack_trace = stack_traces[0]
+        self.assertEqual(app_stack_trace[1].function_name, self.test_raw_stack_trace.__name__)
+        self.assertTupleEqual(django_stack_trace, ())
 
-def _keys_set_for_passed_value(dictionary: Dict[str, bool], value_condition: bool) -> Set[str]:
-    """ A helper function to find all keys for which value in dictionary is value_condition """
-    return {key for key, value in dictionary.items() if value is value_condition}
+    def test_raw_stack_trace_of_identical_functions(self):
+        """ Identical functions of two modules have equal code objects, but their raw stack traces are not the same """
+        functions = _identical_functions(('myapp.views', 'otherapp.views'))
+        raw_stack_traces = [function(lambda: stack_tracer.capture_raw_stack_trace(100)) for function in functions]
+        self.assertIsNot(raw_stack_traces[0], raw_stack_traces[1])
+
+        app_module_names_to_exclude = (stack_tracer.__name__, self.__module__, 'unittest')
+        for raw_stack_trace, module_name in zip(raw_stack_traces, ('myapp.views', 'otherapp.views')):
+            app_stack_trace, _ = raw_stack_trace.stack_traces(app_module_names_to_exclude, ())
+            self.assertEqual(app_stack_trace[0].module_name, module_name)
+            self.assertIn(functions[0].__code__, raw_stack_trace.code_and_offsets)
+
+    def test_stack_trace_boundaries(self):
+        """ The walk stops at a function in the boundaries, and at the boundary frame """
+        app_module_names_to_exclude = (stack_tracer.__name__, 'unittest')
+        app_stack_trace, _ = _stack_trace_of_helper(app_module_names_to_exclude, ())
+        self.assertListEqual([stack_trace.function_name for stack_trace in app_stack_trace[:2]],
+                             [_stack_trace_of_helper.__name__, self.test_stack_trace_boundaries.__name__])
+
+        test_function_boundary = f'{self.__module__}.{self.test_stack_trace_boundaries.__qualname__}'
+        boundaries_and_frames = (((test_function_boundary,), None), ((self.__module__,), None), ((), sys._getframe()))
+        for stack_trace_boundaries, boundary_frame in boundaries_and_frames:
+            with self.subTest(stack_trace_boundaries=stack_trace_boundaries, boundary_frame=boundary_frame):
+                app_stack_trace, django_stack_trace = _stack_trace_of_helper(
+                    app_module_names_to_exclude, stack_trace_boundaries, boundary_frame)
+                if stack_trace_boundaries == (self.__module__,):  # The helper is in the same module
+                    self.assertTupleEqual(app_stack_trace, ())
+                else:
+                    self.assertListEqual([stack_trace.function_name for stack_trace in app_stack_trace],
+                                         [_stack_trace_of_helper.__name__])
+                self.assertTupleEqual(django_stack_trace, ())
+
+    def test_raw_stack_trace_boundaries(self):
+        """ The capture stops at the boundary frame, and the boundaries are applied when finding the stack traces """
+        app_module_names_to_exclude = (stack_tracer.__name__, 'unittest')
+        raw_stack_trace = stack_tracer.capture_raw_stack_trace(100, boundary_frame=sys._getframe())
+        self.assertEqual(len(raw_stack_trace.module_names), 1)  # Only the frame of capture_raw_stack_trace
+
+        raw_stack_trace = stack_tracer.capture_raw_stack_trace(100)
+        app_stack_trace, _ = raw_stack_trace.stack_traces(app_module_names_to_exclude, (), (self.__module__,))
+        self.assertTupleEqual(app_stack_trace, ())
+
+
+class ModulePrefixTrieTest(TestCase):
+    """ The trie should match a module name exactly when str.startswith matches it with any of the prefixes """
+
+    def test_matches_like_startswith(self):
+        prefixes = ('django.db', 'django.contrib.', 'test', 'six', 'a.b.c', 'kombu.transport.redis')
+        module_names = ('django', 'django.db', 'django.dbx', 'django.db.models', 'django.contrib', 'django.contrib.a',
+                        'test', 'tests.unit', 'testing', 'tes', 'six', 'sixty', 'a', 'a.b', 'a.b.c', 'a.b.cd.e', 'a.bc',
+                        'kombu.transport', 'kombu.transport.redis', 'myapp.views', '')
+        trie = stack_tracer.ModulePrefixTrie(prefixes)
+        for module_name in module_names:
+            with self.subTest(module_name=module_name):
+                self.assertEqual(trie.matches(module_name),
+                                 any(module_name.startswith(prefix) for prefix in prefixes))
+
+    def test_empty_prefixes(self):
+        self.assertFalse(stack_tracer.ModulePrefixTrie(()).matches('django.db'))
+        self.assertTrue(stack_tracer.ModulePrefixTrie(('',)).matches('django.db'))
+
+    def test_built_once_per_prefixes(self):
+        prefixes = ('django.db', 'test')
+        self.assertIs(stack_tracer.module_prefix_trie(prefixes), stack_tracer.module_prefix_trie(prefixes))
+
+
+def _stack_trace_of_helper(app_module_names_to_exclude: Tuple[str, ...], stack_trace_boundaries: Tuple[str, ...],
+                           boundary_frame: Optional[FrameType] = None):
+    return stack_tracer.find_stack_trace(app_module_names_to_exclude, (), 100, stack_trace_boundaries, boundary_frame)
+
+
+def _stack_traces(app_module_names_to_exclude: Tuple[str, ...], is_lazy: bool):
+    """ Both are called from the same line, hence the stack traces should be equal """
+    return (stack_tracer.capture_raw_stack_trace(100).stack_traces(app_module_names_to_exclude, ()) if is_lazy else stack_tracer.find_stack_trace(app_module_names_to_exclude, (), 100))  # noqa: E501
+
+
+def _identical_functions(module_names: Tuple[str, ...]) -> List[Callable]:
+    """ The same function, compiled in each of the modules - it calls the function it is passed """
+    functions = []
+    for module_name in module_names:
+        module_globals = {'__name__': module_name}
+        exec(compile('def view(call):\n    return call()\n', 'views.py', 'exec'), module_globals)
+        functions.append(module_globals['view'])
+    return functions
+
+
+def _app_module_names(code_to_decision: Dict[int, Tuple[CodeType, stack_tracer.CodeDecision]]) -> Set[str]:
+    """ A helper function to find the module names of all app frames in the memo """
+    return {code_decision.module_name for _, code_decision in code_to_decision.values()
+            if code_decision.__class__ is stack_tracer._AppCodeDecision}